@@ -0,0 +1,883 @@
+"""Offline benchmarks for the plan model, the pipe-syntax converter and the QEP view.
+
+Usage: python benchmark.py <benchmark> [options]
+Run python benchmark.py <benchmark> --help for the options of each benchmark.
+Every benchmark can save its result with --save and compare it against a
+saved result with --baseline, which fails when a timing got slower than
+--tolerance allows.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+import pipesyntax
+from diskcache import DiskCache
+from planhistory import PlanDiff
+from resultstore import ResultStore, RowFilter, view_order
+from treelayout import TreeLayout
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example")
+# EXPLAIN (ANALYZE, BUFFERS) output of each example query, as JSON and as text,
+# recorded against a small TPC-H database
+PLAN_FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Result keys ending in these are timings in these many milliseconds, which a
+# baseline comparison checks
+TIMING_UNITS = {"_ms": 1.0, "_seconds": 1000.0, "_us": 0.001}
+# Slowdowns below this many milliseconds are timer noise, whatever their ratio
+MIN_REGRESSION_MS = 0.1
+
+
+def synthetic_partitioned_plan(partitions):
+    """EXPLAIN (FORMAT JSON) output of an aggregate over an Append of one scan per partition"""
+    scans = []
+    for i in range(partitions):
+        scans.append({
+            "Node Type": "Seq Scan",
+            "Parent Relationship": "Member",
+            "Relation Name": f"lineitem_p{i}",
+            "Alias": f"lineitem_p{i}",
+            "Startup Cost": 0.0,
+            "Total Cost": 180.0 + i % 50,
+            "Plan Rows": 6000,
+            "Plan Width": 8,
+            "Filter": "(l_quantity > '10'::numeric)",
+        })
+    return [{
+        "Plan": {
+            "Node Type": "Aggregate",
+            "Strategy": "Plain",
+            "Startup Cost": 200.0 * partitions,
+            "Total Cost": 200.0 * partitions + 0.01,
+            "Plan Rows": 1,
+            "Plan Width": 8,
+            "Plans": [{
+                "Node Type": "Append",
+                "Parent Relationship": "Outer",
+                "Startup Cost": 0.0,
+                "Total Cost": 190.0 * partitions,
+                "Plan Rows": 6000 * partitions,
+                "Plan Width": 8,
+                "Plans": scans,
+            }],
+        }
+    }]
+
+
+def synthetic_deep_plan(depth, nodes):
+    """A chain of Nested Loops depth levels deep, padded with Seq Scan leaves up to nodes nodes"""
+    leaves_per_level = max(1, (nodes - depth) // depth)
+    root = None
+    parent = None
+    for level in range(depth):
+        plan = {
+            "Node Type": "Nested Loop",
+            "Join Type": "Inner",
+            "Startup Cost": 0.0,
+            "Total Cost": float(depth - level),
+            "Plan Rows": 1,
+            "Plan Width": 8,
+            "Plans": [],
+        }
+        for leaf in range(leaves_per_level):
+            plan["Plans"].append({
+                "Node Type": "Seq Scan",
+                "Relation Name": f"t{level}_{leaf}",
+                "Startup Cost": 0.0,
+                "Total Cost": 1.0,
+                "Plan Rows": 1,
+                "Plan Width": 8,
+            })
+        if parent is None:
+            root = plan
+        else:
+            parent["Plans"].insert(0, plan)
+        parent = plan
+    return [{"Plan": root}]
+
+
+def synthetic_bushy_plan(nodes, fanout=3):
+    """A plan of about nodes nodes: joins with fanout inputs each, down to Seq Scan leaves"""
+    root = {"Node Type": "Hash Join", "Join Type": "Inner", "Startup Cost": 0.0, "Total Cost": float(nodes),
+            "Plan Rows": 1, "Plan Width": 8, "Plans": []}
+    queue = [root]
+    created = 1
+    while queue and created < nodes:
+        parent = queue.pop(0)
+        for _ in range(fanout):
+            if created >= nodes:
+                break
+            leaf = created % 4 == 0
+            plan = {
+                "Node Type": "Seq Scan" if leaf else ("Sort", "Aggregate", "Hash Join")[created % 3],
+                "Startup Cost": 0.0,
+                "Total Cost": float(nodes - created),
+                "Plan Rows": 1,
+                "Plan Width": 8,
+                "Plans": [],
+            }
+            if leaf:
+                plan["Relation Name"] = f"table_{created}"
+            else:
+                queue.append(plan)
+            parent["Plans"].append(plan)
+            created += 1
+    return [{"Plan": root}]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def with_actuals(qep_json):
+    """The plan with EXPLAIN (ANALYZE, BUFFERS) figures filled in, as if it had run"""
+    stack = [qep_json[0]["Plan"]]
+    while stack:
+        plan = stack.pop()
+        plan["Actual Startup Time"] = plan["Startup Cost"] / 100
+        plan["Actual Total Time"] = plan["Total Cost"] / 100
+        plan["Actual Rows"] = plan["Plan Rows"]
+        plan["Actual Loops"] = 1
+        plan["Shared Hit Blocks"] = int(plan["Total Cost"]) // 8
+        stack.extend(plan.get("Plans", ()))
+    qep_json[0]["Planning Time"] = 0.5
+    qep_json[0]["Execution Time"] = qep_json[0]["Plan"]["Actual Total Time"]
+    return qep_json
+
+
+def synthetic_auto_explain_log(path, plans, partitions):
+    """Write plans auto_explain entries to path; returns the number of lines written"""
+    plan_lines = pipesyntax.format_plan_text(with_actuals(synthetic_partitioned_plan(partitions))).splitlines()
+    with open(path, "w") as log:
+        for i in range(plans):
+            log.write(f"2024-01-01 00:00:{i % 60:02d}.000 UTC [{1000 + i}] LOG:  duration: 12.345 ms  plan:\n")
+            log.write("\tQuery Text: SELECT count(*)\n\tFROM lineitem\n\tWHERE l_quantity > 10;\n")
+            for line in plan_lines:
+                log.write(f"\t{line}\n")
+    return plans * (len(plan_lines) + 4)
+
+
+def example_queries():
+    """(name, SQL text) of each example query, in numeric order"""
+    names = [name for name in os.listdir(EXAMPLE_DIR) if re.fullmatch(r"query\d+\.txt", name)]
+    names.sort(key=lambda name: int(name[5:-4]))
+    queries = []
+    for name in names:
+        with open(os.path.join(EXAMPLE_DIR, name)) as f:
+            queries.append((name[:-4], f.read()))
+    return queries
+
+
+def plan_fixture(name):
+    """The recorded JSON and text plans of an example query"""
+    with open(os.path.join(PLAN_FIXTURE_DIR, f"{name}.json")) as f:
+        plan_json = json.load(f)
+    with open(os.path.join(PLAN_FIXTURE_DIR, f"{name}.txt")) as f:
+        plan_text = f.read()
+    return plan_json, plan_text
+
+
+def sample(function, warmup, repeat, setup=None):
+    """Milliseconds of each of repeat calls of function, after warmup untimed
+    calls; setup, if given, runs untimed before every call"""
+    times = []
+    for i in range(warmup + repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed * 1000)
+    return times
+
+
+def add_percentiles(result, name, times):
+    result[f"{name}_median_ms"] = percentile(times, 0.5)
+    result[f"{name}_p95_ms"] = percentile(times, 0.95)
+
+
+def clear_conversion_caches():
+    pipesyntax._pipe_cache.clear()
+    pipesyntax._clause_cache.clear()
+
+
+def compare_to_baseline(result, baseline, tolerance):
+    """Timings of result more than tolerance (a fraction) slower than in baseline"""
+    regressions = []
+    for key, value in result.items():
+        old = baseline.get(key)
+        unit = next((ms for suffix, ms in TIMING_UNITS.items() if key.endswith(suffix)), None)
+        if unit is None or not isinstance(value, (int, float)) or not old:
+            continue
+        if value > old * (1 + tolerance) and (value - old) * unit >= MIN_REGRESSION_MS:
+            regressions.append(f"{key}: {old:,.3f} -> {value:,.3f} ({value / old - 1:+.0%})")
+    return regressions
+
+
+def count_nodes(qep_json):
+    count = 0
+    stack = [qep_json[0]["Plan"]]
+    while stack:
+        plan = stack.pop()
+        count += 1
+        stack.extend(plan.get("Plans", ()))
+    return count
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+class LegacyQEPNode:
+    """QEPNode as it was before it had __slots__, for comparison"""
+    def __init__(self, operation, startup_cost=None, total_cost=None, table=None):
+        self.operation = operation
+        self.startup_cost = startup_cost
+        self.total_cost = total_cost
+        self.table = table
+        self.children = []
+        self.properties = {
+            'condition': None,
+            'group_key': None,
+            'sort_key': None,
+            'sort_order': None,
+            'filter': None,
+            'method': None,
+        }
+
+
+class LegacyTreeNode:
+    """The per-view copy of the plan that QEPTreeView used to build"""
+    def __init__(self, operation, cost=None, props=None, table=None, startup_cost=None, total_cost=None):
+        self.operation = operation
+        self.cost = cost
+        self.properties = props or {}
+        self.table = table
+        self.startup_cost = startup_cost
+        self.total_cost = total_cost
+        self.children = []
+
+
+def legacy_plan_and_view(qep_json):
+    def parse(plan):
+        node = LegacyQEPNode(plan.get('Node Type', ''), plan.get('Startup Cost'), plan.get('Total Cost'))
+        if 'Filter' in plan:
+            node.properties['filter'] = plan['Filter']
+        if 'Scan' in node.operation:
+            node.table = plan.get('Relation Name')
+        for child in plan.get('Plans', []):
+            node.children.append(parse(child))
+        return node
+
+    def copy(node):
+        props = {key: value for key, value in node.properties.items() if value}
+        tree_node = LegacyTreeNode(node.operation, f"{node.startup_cost}..{node.total_cost}", props,
+                                   node.table, node.startup_cost, node.total_cost)
+        for child in node.children:
+            tree_node.children.append(copy(child))
+        return tree_node
+
+    root = parse(qep_json[0]['Plan'])
+    return root, copy(root)
+
+
+def legacy_parse_qep(qep):
+    """parse_qep as it was before the single-pass tokenizer, for comparison"""
+    root = None
+    nodes_stack = []
+    qep = "\n-> " + qep
+
+    for line in qep.split('\n'):
+        if "->" not in line:
+            if "Sort Key:" in line:
+                if nodes_stack:
+                    sort_info = re.search(r'Sort Key: (.+)', line)
+                    if sort_info:
+                        current = nodes_stack[-1][1]
+                        current.properties['sort_key'] = sort_info.group(1)
+                        if "DESC" in line:
+                            current.properties['sort_order'] = "DESC"
+                        else:
+                            current.properties['sort_order'] = "ASC"
+            elif "Group Key:" in line:
+                if nodes_stack:
+                    group_info = re.search(r'Group Key: (.+)', line)
+                    if group_info:
+                        nodes_stack[-1][1].properties['group_key'] = group_info.group(1)
+            elif "Hash Cond:" in line:
+                if nodes_stack:
+                    cond_info = re.search(r'Hash Cond: (.+)', line)
+                    if cond_info:
+                        nodes_stack[-1][1].properties['condition'] = cond_info.group(1)
+            elif "Filter:" in line:
+                if "Rows Removed by Filter:" in line:
+                    continue
+                if nodes_stack:
+                    filter_info = re.search(r'Filter: (.+)', line)
+                    if filter_info:
+                        nodes_stack[-1][1].properties['filter'] = filter_info.group(1)
+            continue
+
+        if any(op in line for op in ['Partial', 'Finalize', 'Gather', 'Worker']):
+            continue
+
+        indent = len(line) - len(line.lstrip())
+        cost_match = re.search(r'\(cost=(\d+\.\d+)\.\.(\d+\.\d+)', line)
+        cost = f"{cost_match.group(1)}..{cost_match.group(2)}" if cost_match else None
+
+        op_match = re.search(r'->\s+([A-Za-z ]+)', line)
+        if not op_match:
+            continue
+
+        operation = op_match.group(1).strip()
+        node = LegacyQEPNode(operation, cost)
+
+        if "Scan" in operation:
+            table_match = re.search(r'on\s+(\w+)', line)
+            if table_match:
+                node.table = table_match.group(1)
+                node.operation = "SCAN"
+                if "Index" in operation:
+                    node.properties['method'] = "INDEX"
+                elif "Seq" in operation:
+                    node.properties['method'] = "SEQUENTIAL"
+        elif "Join" in operation:
+            node.operation = "JOIN"
+            if "Hash" in operation:
+                node.properties['method'] = "HASH"
+            elif "Merge" in operation:
+                node.properties['method'] = "MERGE"
+            elif "Nested" in operation:
+                node.properties['method'] = "NESTED LOOP"
+        elif "Aggregate" in operation:
+            node.operation = "AGGREGATE"
+            if "Partial" in operation:
+                node.properties['method'] = "PARTIAL"
+            elif "Final" in operation:
+                node.properties['method'] = "FINAL"
+
+        while nodes_stack and nodes_stack[-1][0] >= indent:
+            nodes_stack.pop()
+
+        if nodes_stack:
+            nodes_stack[-1][1].children.append(node)
+        else:
+            root = node
+        nodes_stack.append((indent, node))
+
+    return root
+
+
+def legacy_parse_log(path):
+    # The legacy parser takes one plan as a string, so the whole log is read and split first
+    with open(path) as log:
+        entries = re.split(r"^.*\bplan:\n", log.read(), flags=re.MULTILINE)
+    return [legacy_parse_qep(entry) for entry in entries if entry]
+
+
+def streaming_parse_log(path):
+    with open(path) as log:
+        return sum(1 for _ in pipesyntax.iter_text_plans(log))
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def allocated_by(build):
+    """Bytes still allocated by build() once it returns, and its result"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def bench_memory(args):
+    plan = synthetic_partitioned_plan(args.partitions)
+    nodes = args.partitions + 2
+    legacy_bytes, _ = allocated_by(lambda: legacy_plan_and_view(plan))
+    current_bytes, _ = allocated_by(lambda: pipesyntax.parse_qep_json(plan))
+    return {
+        "nodes": nodes,
+        "legacy_bytes": legacy_bytes,
+        "legacy_bytes_per_node": legacy_bytes / nodes,
+        "current_bytes": current_bytes,
+        "current_bytes_per_node": current_bytes / nodes,
+        "ratio": current_bytes / legacy_bytes,
+    }
+
+
+def bench_stress(args):
+    plan = synthetic_deep_plan(args.depth, args.nodes)
+    result = {"depth": args.depth, "nodes": count_nodes(plan), "recursion_limit": sys.getrecursionlimit()}
+    result["parse_seconds"], root = timed(pipesyntax.parse_qep_json, plan)
+    result["index_seconds"], _ = timed(pipesyntax.QEPIndex, root)
+    result["layout_seconds"], _ = timed(lambda: TreeLayout(root).positions())
+    result["walk_seconds"], _ = timed(lambda: sum(1 for _ in pipesyntax.walk_plan(root)))
+    return result
+
+
+def bench_textparse(args):
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    try:
+        lines = synthetic_auto_explain_log(path, args.plans, args.partitions)
+        result = {"lines": lines, "log_bytes": os.path.getsize(path)}
+        result["legacy_seconds"], _ = timed(legacy_parse_log, path)
+        result["current_seconds"], plans = timed(streaming_parse_log, path)
+        result["plans"] = plans
+        result["legacy_lines_per_second"] = lines / result["legacy_seconds"]
+        result["current_lines_per_second"] = lines / result["current_seconds"]
+        result["speedup"] = result["legacy_seconds"] / result["current_seconds"]
+        result["legacy_peak_bytes"] = peak_memory(legacy_parse_log, path)
+        result["current_peak_bytes"] = peak_memory(streaming_parse_log, path)
+    finally:
+        os.remove(path)
+    return result
+
+
+def legacy_draw_plan(view, positions):
+    """Fill view's scene the way QEPTreeView did before items were virtualized:
+    a gradient path, a text item and a line item per node, all up front"""
+    from PySide6.QtCore import QRectF, Qt
+    from PySide6.QtGui import QBrush, QColor, QFont, QLinearGradient, QPainterPath, QPen
+    from PySide6.QtWidgets import QGraphicsLineItem, QGraphicsPathItem, QGraphicsTextItem
+
+    scene = view.scene
+    scene.clear()
+    for node, (x, y) in positions.items():
+        label = node.label()
+        path = QPainterPath()
+        path.addRoundedRect(QRectF(x - 60, y - 40, 120, 80), 15, 15)
+        item = QGraphicsPathItem(path)
+        gradient = QLinearGradient(x - 60, y - 40, x + 60, y + 40)
+        gradient.setColorAt(0, QColor("#42A5F5"))
+        gradient.setColorAt(1, QColor("#1976D2"))
+        item.setBrush(QBrush(gradient))
+        item.setPen(QPen(QColor("#E0F2F1"), 2))
+        item.setAcceptHoverEvents(True)
+        scene.addItem(item)
+        text_item = QGraphicsTextItem(f"{label}\n{node.table}" if node.table else label)
+        text_item.setDefaultTextColor(QColor("white"))
+        text_item.setFont(QFont("Segoe UI", 9, QFont.Bold))
+        text_item.setPos(x - text_item.boundingRect().width() / 2, y - text_item.boundingRect().height() / 2)
+        scene.addItem(text_item)
+        for child in node.children:
+            if child in positions:
+                child_x, child_y = positions[child]
+                line = QGraphicsLineItem(x, y + 40, child_x, child_y - 40)
+                line.setPen(QPen(QColor("#90A4AE"), 2))
+                scene.addItem(line)
+    scene.setSceneRect(scene.itemsBoundingRect())
+    view.fitInView(scene.sceneRect().adjusted(-50, -50, 50, 50), Qt.KeepAspectRatio)
+
+
+def frame_times(app, view, frames):
+    """Milliseconds to repaint the view after each step of a fit, zoom and pan sequence"""
+    def frame():
+        start = time.perf_counter()
+        view.viewport().grab()
+        app.processEvents()
+        return (time.perf_counter() - start) * 1000
+
+    times = {"fit": [frame() for _ in range(frames)]}
+    view.resetTransform()
+    view.centerOn(view.sceneRect().center().x(), view.sceneRect().top())
+    times["zoomed_in"] = [frame() for _ in range(frames)]
+    times["pan"] = []
+    for _ in range(frames):
+        view.horizontalScrollBar().setValue(view.horizontalScrollBar().value() + view.viewport().width() // 2)
+        view.verticalScrollBar().setValue(view.verticalScrollBar().value() + view.viewport().height() // 4)
+        times["pan"].append(frame())
+    return times
+
+
+def bench_frames(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from interface import QEPTreeView
+
+    app = QApplication.instance() or QApplication([])
+    plan = synthetic_bushy_plan(args.nodes)
+    root = pipesyntax.parse_qep_json(plan)
+    layout = TreeLayout(root)
+    result = {"nodes": count_nodes(plan)}
+
+    for name in ("legacy", "current"):
+        view = QEPTreeView()
+        view.resize(1200, 800)
+        view.show()
+        app.processEvents()
+        if name == "legacy":
+            result["legacy_draw_seconds"], _ = timed(legacy_draw_plan, view, layout.positions())
+        else:
+            result["current_draw_seconds"], _ = timed(view.visualize_qep, root, layout)
+        times = frame_times(app, view, args.frames)
+        result[f"{name}_items"] = len(view.scene.items())
+        for phase, values in times.items():
+            result[f"{name}_{phase}_median_ms"] = percentile(values, 0.5)
+            result[f"{name}_{phase}_p95_ms"] = percentile(values, 0.95)
+        view.close()
+    return result
+
+
+def bench_collapse(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from interface import QEPTreeView
+
+    app = QApplication.instance() or QApplication([])
+    plan = synthetic_partitioned_plan(args.partitions)
+    root = pipesyntax.parse_qep_json(plan)
+    append = root.children[0]
+    view = QEPTreeView()
+    view.resize(1200, 800)
+    view.show()
+    app.processEvents()
+    result = {"nodes": count_nodes(plan)}
+
+    result["expanded_draw_seconds"], _ = timed(view.visualize_qep, root, None, frozenset())
+    result["expanded_items"] = len(view.scene.items())
+    result["collapsed_draw_seconds"], _ = timed(view.visualize_qep, root)
+    result["collapsed_items"] = len(view.scene.items())
+    expand, collapse = [], []
+    for _ in range(args.repeat):
+        expand.append(timed(view.toggle_subtree, append)[0] * 1000)
+        collapse.append(timed(view.toggle_subtree, append)[0] * 1000)
+    result["expand_median_ms"] = percentile(expand, 0.5)
+    result["collapse_median_ms"] = percentile(collapse, 0.5)
+    view.close()
+    return result
+
+
+def bench_diff(args):
+    plan = synthetic_partitioned_plan(args.partitions)
+    changed = json.loads(json.dumps(plan))
+    scan = changed[0]["Plan"]["Plans"][0]["Plans"][args.partitions // 2]
+    scan["Node Type"] = "Index Scan"
+    scan["Total Cost"] = 8.0
+    before = pipesyntax.parse_qep_json(plan)
+    same = pipesyntax.parse_qep_json(plan)
+    after = pipesyntax.parse_qep_json(changed)
+    result = {"nodes": count_nodes(plan)}
+    result["identical_seconds"], diff = timed(PlanDiff, before, same)
+    result["identical_changes"] = len(diff.changes)
+    result["one_change_seconds"], diff = timed(PlanDiff, before, after)
+    result["one_change_changes"] = len(diff.changes)
+    return result
+
+
+def bench_diskcache(args):
+    queries = [query for _, query in example_queries()]
+    result = {"queries": len(queries)}
+    with tempfile.TemporaryDirectory() as directory:
+        store = DiskCache(os.path.join(directory, "cache.sqlite"))
+        pipesyntax.use_disk_cache(store)
+        try:
+            phases = {"convert": [], "memory": [], "disk": []}
+            for _ in range(args.repeat):
+                store.clear()
+                for phase in phases:
+                    if phase != "memory":
+                        pipesyntax._pipe_cache.clear()
+                    start = time.perf_counter()
+                    for query in queries:
+                        pipesyntax.sql_to_pipe(query)
+                    phases[phase].append((time.perf_counter() - start) * 1000 / len(queries))
+        finally:
+            pipesyntax.use_disk_cache(None)
+            store.close()
+    for phase, values in phases.items():
+        result[f"{phase}_median_ms"] = percentile(values, 0.5)
+    return result
+
+
+def synthetic_result_rows(count):
+    """Rows shaped like a lineitem scan: keys, a numeric(15,2), a date, a flag, a float and a comment"""
+    start = datetime.date(1992, 1, 1)
+    return [(i, i % 200000, Decimal(i * 7919 % 1000003).scaleb(-2), start + datetime.timedelta(days=i % 2500),
+             i % 3 == 0, i * 0.01, f"comment {i % 100000}") for i in range(count)]
+
+
+def bench_results(args):
+    result = {"rows": args.rows}
+    tuples_bytes, rows = allocated_by(lambda: synthetic_result_rows(args.rows))
+    result["store_seconds"], _ = timed(ResultStore, rows)
+    # What the result holds once the tuples are freed, strings shared with them included
+    store_bytes, store = allocated_by(lambda: ResultStore(synthetic_result_rows(args.rows)))
+    result["tuples_bytes"] = tuples_bytes
+    result["store_bytes"] = store_bytes
+    result["ratio"] = store_bytes / tuples_bytes
+    columns = store.column_count
+    # A page of cells as the view paints it: as str() of the tuples did, then
+    # from the store when scrolled to and when repainted
+    phases = {
+        "tuples": lambda row, column: str(rows[row][column]),
+        "scroll": store.display,
+        "repaint": store.display,
+    }
+    times = {phase: [] for phase in phases}
+    for first in range(0, args.rows, max(args.rows // args.pages, args.page_rows)):
+        page = [(row, column) for row in range(first, min(first + args.page_rows, args.rows))
+                for column in range(columns)]
+        for phase, cell in phases.items():
+            start = time.perf_counter()
+            for row, column in page:
+                cell(row, column)
+            times[phase].append((time.perf_counter() - start) * 1000)
+    for phase, values in times.items():
+        add_percentiles(result, f"{phase}_page", values)
+
+    # Sorting and filtering in memory, as the table does off the GUI thread
+    every_row = range(len(store))
+    result["sort_seconds"], _ = timed(view_order, store, None, 2)
+    result["sort_again_seconds"], _ = timed(view_order, store, None, 2, True)
+    text_filter, narrower = RowFilter("comment 12", 6), RowFilter("comment 123", 6)
+    result["filter_text_seconds"], matches = timed(text_filter.apply, store, every_row)
+    result["filter_narrowed_seconds"], _ = timed(narrower.apply, store, matches)
+    result["filter_range_seconds"], matches = timed(RowFilter("1000..2000", 2).apply, store, every_row)
+    result["sort_filtered_seconds"], _ = timed(view_order, store, matches, 3)
+    return result
+
+
+def bench_examples(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from interface import QEPTreeView, auto_collapsed
+
+    app = QApplication.instance() or QApplication([])
+    view = QEPTreeView()
+    view.resize(1200, 800)
+    view.show()
+    app.processEvents()
+    result = {"warmup": args.warmup, "repeat": args.repeat}
+    for name, query in example_queries():
+        plan_json, plan_text = plan_fixture(name)
+        root = pipesyntax.parse_qep_json(plan_json)
+        phases = {
+            "convert": (lambda: pipesyntax.sql_to_pipe(query), clear_conversion_caches),
+            "convert_with_plan": (lambda: pipesyntax.sql_to_pipe(query, root), clear_conversion_caches),
+            "parse_json": (lambda: pipesyntax.parse_qep_json(plan_json), None),
+            "parse_text": (lambda: pipesyntax.parse_qep(plan_text), None),
+            "layout": (lambda: TreeLayout(root).positions(auto_collapsed(root)), None),
+            "draw": (lambda: (view.visualize_qep(root), app.processEvents()), None),
+        }
+        for phase, (function, setup) in phases.items():
+            add_percentiles(result, f"{name}_{phase}", sample(function, args.warmup, args.repeat, setup))
+    view.close()
+    return result
+
+
+def bench_live(args):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from interface import QEPTreeView, QueryWorker
+    from preprocessing import Database
+
+    app = QApplication.instance() or QApplication([])
+    view = QEPTreeView()
+    view.resize(1200, 800)
+    view.show()
+    db = Database(args.dbname, args.user, args.password, args.host, args.port)
+    db.connect()
+    result = {"warmup": args.warmup, "repeat": args.repeat, "cold": args.cold}
+    try:
+        for name, query in example_queries():
+            phases = {}
+            for i in range(args.warmup + args.repeat):
+                if args.cold:
+                    db.plan_cache.clear()
+                    clear_conversion_caches()
+                # The same work Execute does, on this thread, with the draw timed as well
+                runs = []
+                errors = []
+                worker = QueryWorker(0, db, query)
+                worker.signals.finished.connect(lambda run_id, run: runs.append(run))
+                worker.signals.error.connect(lambda run_id, message: errors.append(message))
+                start = time.perf_counter()
+                worker.run()
+                if errors:
+                    raise RuntimeError(f"{name}: {errors[0]}")
+                run = runs[0]
+                draw_start = time.perf_counter()
+                view.visualize_qep(run.qep_root, run.layout, run.collapsed, run.metrics)
+                app.processEvents()
+                run.timings["draw"] = time.perf_counter() - draw_start
+                run.timings["total"] = time.perf_counter() - start
+                if i < args.warmup:
+                    continue
+                for phase, seconds in run.timings.items():
+                    phases.setdefault(re.sub(r"\W+", "_", phase).strip("_"), []).append(seconds * 1000)
+            for phase, times in phases.items():
+                add_percentiles(result, f"{name}_{phase}", times)
+    finally:
+        view.close()
+        db.disconnect()
+    return result
+
+
+# Cumulative import time budget in microseconds, and modules each import must not pull in
+IMPORT_BUDGETS = {
+    "cache": (20000, ("sqlglot", "psycopg2", "PySide6")),
+    "profiling": (20000, ("sqlglot", "psycopg2", "PySide6")),
+    "pipesyntax": (60000, ("sqlglot", "psycopg2", "PySide6")),
+    "treelayout": (60000, ("sqlglot", "psycopg2", "PySide6")),
+    "resultstore": (20000, ("sqlglot", "psycopg2", "PySide6")),
+    "diskcache": (40000, ("sqlglot", "psycopg2", "PySide6")),
+    "planhistory": (80000, ("sqlglot", "psycopg2", "PySide6")),
+    "preprocessing": (100000, ("sqlglot", "psycopg2", "PySide6")),
+    "convert": (100000, ("sqlglot", "psycopg2", "PySide6")),
+    "interface": (500000, ("sqlglot", "psycopg2")),
+}
+
+
+def import_time(module):
+    """Cumulative -X importtime of module in a fresh interpreter, and the names of all modules it loaded"""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        cumulative[fields[2].strip()] = int(fields[1])
+    return cumulative[module], set(cumulative)
+
+
+def bench_importtime(args):
+    result = {}
+    failures = []
+    for module, (budget, forbidden) in IMPORT_BUDGETS.items():
+        budget = int(budget * args.budget_scale)
+        times = []
+        for _ in range(args.repeat):
+            microseconds, loaded = import_time(module)
+            times.append(microseconds)
+        best = min(times)
+        result[f"{module}_us"] = best
+        result[f"{module}_budget_us"] = budget
+        if best > budget:
+            failures.append(f"import {module} took {best:,} us, over its {budget:,} us budget")
+        for name in forbidden:
+            if name in loaded:
+                failures.append(f"import {module} loads {name}")
+    result["failures"] = failures
+    return result
+
+
+BENCHMARKS = {
+    "memory": (bench_memory, "Memory held by a parsed plan and its view, against the pre-__slots__ classes"),
+    "stress": (bench_stress, "Parse, index and lay out a very deep and very large synthetic plan"),
+    "textparse": (bench_textparse, "Text-plan parsing throughput over an auto_explain log, against the legacy parser"),
+    "frames": (bench_frames, "Draw time and frame times of the QEP view on a large synthetic plan, offscreen"),
+    "collapse": (bench_collapse, "Drawing a wide Append collapsed and expanded, and toggling it, offscreen"),
+    "diff": (bench_diff, "Structural diff of two large plans that are identical or differ in one scan"),
+    "results": (bench_results, "Memory of a large result stored by column against its row tuples, page paint, sort and filter times"),
+    "diskcache": (bench_diskcache, "Pipe-syntax conversion against the memory and disk caches"),
+    "examples": (bench_examples, "Convert, parse, lay out and draw the example queries and their recorded plans"),
+    "live": (bench_live, "Execute the example queries against PostgreSQL and time every phase, end to end"),
+    "importtime": (bench_importtime, "Import time of each module against its budget; fails when one is over"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    memory = subparsers.add_parser("memory", help=BENCHMARKS["memory"][1])
+    memory.add_argument("--partitions", type=int, default=20000)
+
+    stress = subparsers.add_parser("stress", help=BENCHMARKS["stress"][1])
+    stress.add_argument("--depth", type=int, default=10000)
+    stress.add_argument("--nodes", type=int, default=100000)
+
+    textparse = subparsers.add_parser("textparse", help=BENCHMARKS["textparse"][1])
+    textparse.add_argument("--plans", type=int, default=100)
+    textparse.add_argument("--partitions", type=int, default=500)
+
+    frames = subparsers.add_parser("frames", help=BENCHMARKS["frames"][1])
+    frames.add_argument("--nodes", type=int, default=5000)
+    frames.add_argument("--frames", type=int, default=20, help="frames timed per phase")
+
+    collapse = subparsers.add_parser("collapse", help=BENCHMARKS["collapse"][1])
+    collapse.add_argument("--partitions", type=int, default=2000)
+    collapse.add_argument("--repeat", type=int, default=10, help="expand and collapse cycles timed")
+
+    diff = subparsers.add_parser("diff", help=BENCHMARKS["diff"][1])
+    diff.add_argument("--partitions", type=int, default=20000)
+
+    results = subparsers.add_parser("results", help=BENCHMARKS["results"][1])
+    results.add_argument("--rows", type=int, default=1000000)
+    results.add_argument("--pages", type=int, default=200, help="pages scrolled to across the result")
+    results.add_argument("--page-rows", type=int, default=40, help="rows painted per page")
+
+    diskcache = subparsers.add_parser("diskcache", help=BENCHMARKS["diskcache"][1])
+    diskcache.add_argument("--repeat", type=int, default=20)
+
+    examples = subparsers.add_parser("examples", help=BENCHMARKS["examples"][1])
+    examples.add_argument("--warmup", type=int, default=3, help="untimed runs of each phase first")
+    examples.add_argument("--repeat", type=int, default=30)
+
+    live = subparsers.add_parser("live", help=BENCHMARKS["live"][1])
+    live.add_argument("--warmup", type=int, default=1, help="untimed executions of each query first")
+    live.add_argument("--repeat", type=int, default=10)
+    live.add_argument("--cold", action="store_true", help="clear the plan and conversion caches before every run")
+    live.add_argument("--dbname", default="postgres")
+    live.add_argument("--user", default="postgres")
+    live.add_argument("--password", default="")
+    live.add_argument("--host", default="localhost")
+    live.add_argument("--port", type=int, default=5432)
+
+    importtime = subparsers.add_parser("importtime", help=BENCHMARKS["importtime"][1])
+    importtime.add_argument("--repeat", type=int, default=5, help="imports per module; the fastest counts")
+    importtime.add_argument("--budget-scale", type=float, default=1.0,
+                            help="multiply every budget, e.g. on a slow machine")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--json", action="store_true", help="print the result as JSON")
+        subparser.add_argument("--save", metavar="PATH", help="write the result to PATH as JSON")
+        subparser.add_argument("--baseline", metavar="PATH", help="compare the timings against a saved result")
+        subparser.add_argument("--tolerance", type=float, default=0.25,
+                               help="fraction a timing may exceed its baseline by (default 0.25)")
+
+    args = parser.parse_args(argv)
+    result = BENCHMARKS[args.benchmark][0](args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            result["regressions"] = compare_to_baseline(result, json.load(f), args.tolerance)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({key: value for key, value in result.items() if key != "regressions"}, f, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            if isinstance(value, list):
+                for item in value:
+                    print(f"{key:>28}: {item}")
+            else:
+                print(f"{key:>28}: {value:,.3f}" if isinstance(value, float) else f"{key:>28}: {value:,}")
+    return result
+
+
+if __name__ == "__main__":
+    result = main()
+    sys.exit(1 if result.get("failures") or result.get("regressions") else 0)
@@ -0,0 +1,198 @@
+"""Headless batch conversion of SQL queries to pipe-syntax.
+
+Usage: python convert.py [options] PATH [PATH ...]
+
+Each PATH is a .sql/.txt file holding one query, a directory of such files,
+a .jsonl file of {"id": ..., "query": ..., "plan": ...} records, or - for
+JSONL on standard input. "plan" is optional and may be EXPLAIN (FORMAT JSON)
+output or a text-format plan. Results are written as JSON lines in input
+order while the batch runs; a summary and the failures go to standard error.
+
+Nothing here imports PySide6, and psycopg2 is only imported for --dsn.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import pipesyntax
+
+QUERY_SUFFIXES = (".sql", ".txt")
+DEFAULT_CHUNKSIZE = 32
+
+# The worker process's connection, when plans are fetched with --dsn
+_database = None
+
+
+def iter_records(paths):
+    """Yield an input record for every query under paths"""
+    for path in paths:
+        if path == "-":
+            yield from _jsonl_records(sys.stdin, "<stdin>")
+        elif os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.endswith(QUERY_SUFFIXES):
+                        yield _file_record(os.path.join(dirpath, name))
+        elif path.endswith(".jsonl"):
+            with open(path) as lines:
+                yield from _jsonl_records(lines, path)
+        else:
+            yield _file_record(path)
+
+
+def _file_record(path):
+    try:
+        with open(path) as query_file:
+            return {"id": path, "query": query_file.read()}
+    except OSError as e:
+        return {"id": path, "error": str(e)}
+
+
+def _jsonl_records(lines, source):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield {"id": f"{source}:{number}", "error": f"Invalid JSON: {e}"}
+            continue
+        if isinstance(record, str):
+            record = {"query": record}
+        elif not isinstance(record, dict):
+            yield {"id": f"{source}:{number}", "error": "Record is not an object or a string"}
+            continue
+        record.setdefault("id", f"{source}:{number}")
+        yield record
+
+
+def plan_root(plan):
+    """The QEPNode root of a JSON (list or object) or text-format plan, or None"""
+    if plan is None:
+        return None
+    if isinstance(plan, str):
+        stripped = plan.lstrip()
+        if stripped.startswith(("[", "{")):
+            plan = json.loads(stripped)
+        else:
+            return pipesyntax.parse_qep(plan)
+    if isinstance(plan, dict):
+        plan = [plan]
+    return pipesyntax.parse_qep_json(plan)
+
+
+def convert_record(record, database=None):
+    """Convert one input record and return its output record.
+
+    Failures are reported in the output record's "error" field, never raised.
+    """
+    result = {"id": record.get("id")}
+    if "error" in record:
+        result["error"] = record["error"]
+        return result
+    try:
+        query = record.get("query", record.get("sql"))
+        if not isinstance(query, str) or not query.strip():
+            raise ValueError("Record has no query")
+        query = query.strip().rstrip(';')
+        plan = record.get("plan")
+        if plan is None and database is not None:
+            plan = database.get_estimated_plan_json(query)
+        root = plan_root(plan)
+        result["pipe_syntax"] = pipesyntax.sql_to_pipe(query, root)
+        if root is not None:
+            result["startup_cost"] = root.startup_cost
+            result["total_cost"] = root.total_cost
+    except Exception as e:
+        # Parse errors go on to quote the query with terminal highlighting
+        message = str(e).strip().splitlines()
+        result["error"] = f"{type(e).__name__}: {message[0] if message else ''}"
+    return result
+
+
+def connect_dsn(dsn):
+    """A Database for a libpq connection string, holding a single connection"""
+    import psycopg2.extensions
+    from preprocessing import Database
+
+    params = psycopg2.extensions.parse_dsn(dsn)
+    database = Database(params.get("dbname"), params.get("user"), params.get("password"),
+                        params.get("host"), params.get("port", 5432), maxconn=1)
+    database.connect()
+    return database
+
+
+def _init_worker(dsn):
+    global _database
+    if dsn:
+        _database = connect_dsn(dsn)
+
+
+def _convert_in_worker(record):
+    return convert_record(record, _database)
+
+
+def convert_records(records, processes=None, chunksize=DEFAULT_CHUNKSIZE, dsn=None):
+    """Convert records across a process pool, yielding output records in input order.
+
+    Records are handed to the workers chunksize at a time. With processes=1
+    everything runs in this process.
+    """
+    if processes == 1:
+        _init_worker(dsn)
+        try:
+            for record in records:
+                yield _convert_in_worker(record)
+        finally:
+            if _database is not None:
+                _database.disconnect()
+        return
+    with multiprocessing.Pool(processes, _init_worker, (dsn,)) as pool:
+        yield from pool.imap(_convert_in_worker, records, chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", metavar="PATH",
+                        help="query file, directory of query files, .jsonl file, or - for JSONL on stdin")
+    parser.add_argument("-o", "--output", help="write JSON lines here instead of standard output")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="records handed to a worker at a time")
+    parser.add_argument("--dsn", help="libpq connection string; records without a plan are EXPLAINed "
+                                      "there so their costs are included")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    failures = []
+    converted = 0
+    start = time.perf_counter()
+    try:
+        for result in convert_records(iter_records(args.paths), args.processes, args.chunksize, args.dsn):
+            converted += 1
+            if "error" in result:
+                failures.append(result)
+            output.write(json.dumps(result) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    rate = converted / elapsed if elapsed else 0.0
+    print(f"Converted {converted:,} queries ({converted - len(failures):,} ok, {len(failures):,} failed) "
+          f"in {elapsed:.3f} s: {rate:,.1f} queries/s", file=sys.stderr)
+    if failures:
+        print("Failures:", file=sys.stderr)
+        for failure in failures:
+            print(f"  {failure['id']}: {failure['error']}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
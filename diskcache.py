@@ -0,0 +1,137 @@
+"""Key-value cache in a SQLite file, so plans, conversions and results outlive the process.
+
+The plan cache, the result cache and sql_to_pipe keep recent entries in memory
+as before and use a DiskCache, when given one, as a second level beneath that.
+"""
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+# Eviction goes this far below the limits, so it need not run again on the next put
+EVICT_TO = 0.9
+
+
+class DiskCache:
+    """Pickled values in a SQLite file, least recently used out first.
+
+    Keys are anything json.dumps accepts and live in a namespace, so the
+    users of one file cannot collide. The file is kept under max_bytes of
+    values and max_entries entries. Safe to use from any thread; several
+    processes may share a file.
+    """
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, max_entries=100000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+            "value BLOB NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL, PRIMARY KEY (namespace, key))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_used_at ON cache (used_at)")
+        self._db.commit()
+        # Running totals; other processes sharing the file make them estimates,
+        # so they are only trusted to tell when to count again
+        self._entries, self._bytes = self._totals()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, namespace, key, default=None):
+        digest = _digest(key)
+        with self._lock:
+            if self._db is None:
+                return default
+            row = self._db.execute("SELECT value FROM cache WHERE namespace = ? AND key = ?",
+                                   (namespace, digest)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self._db.execute("UPDATE cache SET used_at = ? WHERE namespace = ? AND key = ?",
+                             (time.time(), namespace, digest))
+            self._db.commit()
+            self.hits += 1
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            # Written by an incompatible version; drop it like any other stale entry
+            self.pop(namespace, key)
+            return default
+
+    def put(self, namespace, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                             (namespace, _digest(key), data, len(data), time.time()))
+            self._entries += 1
+            self._bytes += len(data)
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def pop(self, namespace, key):
+        with self._lock:
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, _digest(key)))
+                self._db.commit()
+
+    def clear(self, namespace=None):
+        with self._lock:
+            if self._db is None:
+                return
+            if namespace is None:
+                self._db.execute("DELETE FROM cache")
+            else:
+                self._db.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._totals() if self._db is not None else (0, 0)
+            return {
+                "entries": entries,
+                "bytes": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _totals(self):
+        return self._db.execute("SELECT count(*), coalesce(sum(size), 0) FROM cache").fetchone()
+
+    def _evict(self):
+        entries, size = self._entries, self._bytes = self._totals()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        # Oldest first, until both totals are back under EVICT_TO of their limit
+        over_entries = entries - int(self.max_entries * EVICT_TO)
+        over_bytes = size - int(self.max_bytes * EVICT_TO)
+        doomed = []
+        for rowid, entry_size in self._db.execute("SELECT rowid, size FROM cache ORDER BY used_at"):
+            if over_entries <= 0 and over_bytes <= 0:
+                break
+            doomed.append((rowid,))
+            over_entries -= 1
+            over_bytes -= entry_size
+        self._db.executemany("DELETE FROM cache WHERE rowid = ?", doomed)
+        self.evictions += len(doomed)
+        self._entries, self._bytes = self._totals()
+
+
+def _digest(key):
+    return hashlib.sha1(json.dumps(key, default=str).encode("utf-8")).hexdigest()
@@ -1,76 +1,385 @@
 import sys
+import importlib
 import json
+import threading
+import time
+from array import array
+from collections import deque
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QTextEdit, QPushButton, QLabel, 
                              QSplitter, QDialog, QLineEdit, 
                              QFormLayout, QDialogButtonBox, QMessageBox, 
                              QGraphicsView, QGraphicsScene, QGraphicsItem,
-                             QGraphicsEllipseItem, QGraphicsTextItem, QGraphicsLineItem,
-                             QGraphicsPathItem, QToolTip, QTableView, QHeaderView)
-from PySide6.QtCore import Qt, QSize, QRectF, QPointF, Signal, QAbstractTableModel
-from PySide6.QtGui import QIcon, QFont, QColor, QPalette, QPen, QBrush, QPainterPath, QLinearGradient
+                             QGraphicsEllipseItem,
+                             QGraphicsPathItem, QToolTip, QTableView, QHeaderView,
+                             QCheckBox, QSpinBox, QComboBox, QTabBar, QDockWidget, QScrollArea,
+                             QFileDialog)
+from PySide6.QtCore import (Qt, QSize, QRectF, QPointF, QLineF, Signal, QAbstractTableModel, QModelIndex,
+                            QObject, QRunnable, QThreadPool, QTimer)
+from PySide6.QtGui import (QIcon, QFont, QFontMetrics, QColor, QPalette, QPen, QBrush, QPainterPath,
+                           QLinearGradient, QTextCursor, QPainter)
+import profiling
 
-from preprocessing import Database
-from pipesyntax import parse_qep_json, sql_to_pipe
+from preprocessing import (Database, ExplainOptions, PlanCache, QueryResult, ResultCache, DEFAULT_ITERSIZE,
+                           is_read_only)
+from pipesyntax import (parse_qep_json, sql_to_pipe, format_plan_text, fingerprint_sql, walk_plan, PlanMetrics,
+                        use_disk_cache, split_statements)
+from treelayout import TreeLayout
+from planhistory import PlanHistory, PlanDiff
+from diskcache import DiskCache
+from resultstore import ResultStore, RowFilter, view_order
 
+MAX_CONCURRENT_QUERIES = 4
+PREVIEW_DEBOUNCE_MS = 150
+FILTER_DEBOUNCE_MS = 200
+# Rows fetched per round trip when a filter or sort needs the rest of a streamed result,
+# and rows filtered between checks for a newer filter or sort
+VIEW_FETCH_ROWS = 50000
+VIEW_CHUNK_ROWS = 65536
+# A SQLite file to keep plan history in across runs; None keeps it in memory only
+PLAN_HISTORY_PATH = None
+# A SQLite file to keep plans, pipe-syntax and (when enabled) small results in
+# across runs, and its size limit; None keeps them in memory only
+CACHE_PATH = None
+CACHE_MAX_BYTES = 256 * 1024 * 1024
 
-class NodeGraphicsItem(QGraphicsPathItem):
-    def __init__(self, operation, description, x, y, width, height, color_primary, color_secondary):
+
+NODE_WIDTH = 120
+NODE_HEIGHT = 80
+# Below this zoom level node labels are not drawn
+TEXT_DETAIL_LEVEL = 0.4
+# Below this one each scene tile is drawn by a single overview item instead of an item per node
+OVERVIEW_DETAIL_LEVEL = 0.15
+# Node and edge items are only created for the scene tiles around the viewport
+SCENE_TILE_SIZE = 1024
+# Append and Gather nodes with more children than this start collapsed
+AUTO_COLLAPSE_CHILDREN = 50
+AUTO_COLLAPSE_OPERATIONS = ("Append", "Gather")
+NODE_COLORS = (
+    ("SCAN", "#42A5F5", "#1976D2"),
+    ("JOIN", "#7E57C2", "#5E35B1"),
+    ("SORT", "#EF5350", "#D32F2F"),
+    ("AGGREGATE", "#FF9800", "#F57C00"),
+    ("", "#26A69A", "#00796B"),
+)
+# Analyzed plans are colored by each node's self time, through these colors from none to the bottleneck's
+HEAT_COLORS = ("#43A047", "#FB8C00", "#C62828")
+HEAT_LEVELS = 8
+# Traces the profiler panel keeps, and how it draws them: one row per span,
+# coloured by the thread that ran it
+MAX_PROFILED_RUNS = 50
+WATERFALL_ROW_HEIGHT = 18
+WATERFALL_LABEL_WIDTH = 240
+WATERFALL_COLORS = ("#26A69A", "#5C6BC0", "#FFA726", "#EC407A", "#8D6E63", "#78909C")
+NEVER_EXECUTED_COLORS = ("#B0BEC5", "#78909C")
+# Outlines of the nodes that differ between two compared plans, by PlanDiff status
+DIFF_COLORS = {
+    "added": "#1E88E5",
+    "removed": "#8E24AA",
+    "changed": "#FFB300",
+    "worse": "#E53935",
+    "better": "#43A047",
+}
+
+
+class NodeStyle:
+    """Pens, brushes and the font shared by every node item of one kind"""
+    _styles = None
+
+    def __init__(self, primary, secondary):
+        self.color = QColor(primary)
+        gradient = QLinearGradient(-NODE_WIDTH / 2, -NODE_HEIGHT / 2, NODE_WIDTH / 2, NODE_HEIGHT / 2)
+        gradient.setColorAt(0, QColor(primary))
+        gradient.setColorAt(1, QColor(secondary))
+        self.brush = QBrush(gradient)
+
+    @classmethod
+    def _create_shared(cls):
+        # Created on first use because fonts need a running QApplication
+        cls._styles = [(keyword, cls(primary, secondary)) for keyword, primary, secondary in NODE_COLORS]
+        cls._heat_styles = []
+        stops = [QColor(color) for color in HEAT_COLORS]
+        for level in range(HEAT_LEVELS):
+            position = level / (HEAT_LEVELS - 1) * (len(stops) - 1)
+            index = min(int(position), len(stops) - 2)
+            low, high = stops[index], stops[index + 1]
+            fraction = position - index
+            color = QColor.fromRgbF(low.redF() + (high.redF() - low.redF()) * fraction,
+                                    low.greenF() + (high.greenF() - low.greenF()) * fraction,
+                                    low.blueF() + (high.blueF() - low.blueF()) * fraction)
+            cls._heat_styles.append(cls(color, color.darker(130)))
+        cls.never_executed = cls(*NEVER_EXECUTED_COLORS)
+        cls.pen = QPen(QColor("#E0F2F1"), 2)
+        cls.hover_pen = QPen(QColor("#FFFFFF"), 3)
+        cls.critical_pen = QPen(QColor("#B71C1C"), 4)
+        cls.diff_pens = {status: QPen(QColor(color), 5) for status, color in DIFF_COLORS.items()}
+        cls.text_pen = QPen(QColor("white"))
+        cls.edge_pen = QPen(QColor("#90A4AE"), 2)
+        cls.edge_pen.setCosmetic(True)
+        cls.critical_edge_pen = QPen(QColor("#D32F2F"), 3)
+        cls.critical_edge_pen.setCosmetic(True)
+        cls.badge_brush = QBrush(QColor("#455A64"))
+        cls.font = QFont("Segoe UI", 9, QFont.Bold)
+        cls.font_metrics = QFontMetrics(cls.font)
+
+    @classmethod
+    def for_label(cls, label):
+        if cls._styles is None:
+            cls._create_shared()
+        for keyword, style in cls._styles:
+            if keyword in label:
+                return style
+
+    @classmethod
+    def for_heat(cls, heat):
+        """Style of a node with heat (0 to 1) as PlanMetrics.heat gives it, None for one that never ran"""
+        if cls._styles is None:
+            cls._create_shared()
+        if heat is None:
+            return cls.never_executed
+        return cls._heat_styles[min(int(heat * HEAT_LEVELS), HEAT_LEVELS - 1)]
+
+
+class PlanNodeItem(QGraphicsItem):
+    """One plan node, painting its own box and label.
+
+    Items are cached as device pixmaps and draw less as the view zooms out.
+    """
+    BOX = QRectF(-NODE_WIDTH / 2, -NODE_HEIGHT / 2, NODE_WIDTH, NODE_HEIGHT)
+    BADGE = QRectF(-24, NODE_HEIGHT / 2 - 10, 48, 20)
+    BOUNDS = BOX.united(BADGE).adjusted(-2, -2, 2, 2)
+
+    def __init__(self, node, style, metrics=None, critical=False):
         super().__init__()
-        
-        self.operation = operation
-        self.description = description
-        self.x = x
-        self.y = y
-        self.width = width
-        self.height = height
-        
-        path = QPainterPath()
-        path.addRoundedRect(QRectF(x - width/2, y - height/2, width, height), 15, 15)
-        self.setPath(path)
-        
-        gradient = QLinearGradient(x - width/2, y - height/2, x + width/2, y + height/2)
-        gradient.setColorAt(0, QColor(color_primary))
-        gradient.setColorAt(1, QColor(color_secondary))
-        
-        self.setBrush(QBrush(gradient))
-        self.setPen(QPen(QColor("#E0F2F1"), 2))
-        
+        self.node = node
+        self.style = style
+        self.metrics = metrics
+        self.critical = critical
+        label = node.label()
+        lines = [label, node.table] if node.table else [label]
+        if metrics is not None and node in metrics.self_time:
+            self_time = metrics.self_time[node]
+            share = self_time / metrics.plan_time if metrics.plan_time else 0.0
+            lines.append(f"{self_time:.1f} ms ({share:.0%})")
+        font_metrics = NodeStyle.font_metrics
+        self.text = "\n".join(font_metrics.elidedText(line, Qt.ElideRight, NODE_WIDTH - 8) for line in lines)
+        self.hovered = False
+        self.collapsed = False
+        self.highlight = None
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
         self.setAcceptHoverEvents(True)
-        
+
+    def boundingRect(self):
+        return self.BOUNDS
+
+    def set_collapsed(self, collapsed):
+        if collapsed != self.collapsed:
+            self.collapsed = collapsed
+            self.update()
+
+    def set_highlight(self, pen):
+        if pen is not self.highlight:
+            self.highlight = pen
+            self.update()
+
+    def paint(self, painter, option, widget=None):
+        detail = option.levelOfDetailFromTransform(painter.worldTransform())
+        if self.hovered:
+            painter.setPen(NodeStyle.hover_pen)
+        elif self.highlight is not None:
+            painter.setPen(self.highlight)
+        else:
+            painter.setPen(NodeStyle.critical_pen if self.critical else NodeStyle.pen)
+        painter.setBrush(self.style.brush)
+        painter.drawRoundedRect(self.BOX, 15, 15)
+        if self.node.children:
+            # Clicking a node with children collapses or expands it
+            painter.setBrush(NodeStyle.badge_brush)
+            painter.drawRoundedRect(self.BADGE, 8, 8)
+        if detail >= TEXT_DETAIL_LEVEL:
+            painter.setPen(NodeStyle.text_pen)
+            painter.setFont(NodeStyle.font)
+            painter.drawText(self.BOX, Qt.AlignCenter, self.text)
+            if self.node.children:
+                badge = f"+{len(self.node.children)}" if self.collapsed else "\u2212"
+                painter.drawText(self.BADGE, Qt.AlignCenter, badge)
+
     def hoverEnterEvent(self, event):
-        self.setPen(QPen(QColor("#FFFFFF"), 3))
-        QToolTip.showText(event.screenPos(), self.description)
+        self.hovered = True
+        self.update()
+        QToolTip.showText(event.screenPos(), describe_node(self.node, self.metrics))
         super().hoverEnterEvent(event)
-        
+
     def hoverLeaveEvent(self, event):
-        self.setPen(QPen(QColor("#E0F2F1"), 2))
+        self.hovered = False
+        self.update()
         super().hoverLeaveEvent(event)
 
 
+class TileOverviewItem(QGraphicsItem):
+    """Every node of a scene tile as a plain box, and the edges into them, in one item"""
+    def __init__(self, nodes, positions, parents, style_of):
+        super().__init__()
+        boxes = {}
+        self.edges = []
+        for node in nodes:
+            x, y = positions[node]
+            style = style_of(node)
+            boxes.setdefault(style, []).append(PlanNodeItem.BOX.translated(x, y))
+            parent = parents.get(node)
+            if parent is not None:
+                parent_x, parent_y = positions[parent]
+                self.edges.append(QLineF(parent_x, parent_y + NODE_HEIGHT / 2, x, y - NODE_HEIGHT / 2))
+        self.boxes = list(boxes.items())
+        bounds = QRectF()
+        for _, rects in self.boxes:
+            for rect in rects:
+                bounds = bounds.united(rect)
+        for line in self.edges:
+            bounds = bounds.united(QRectF(line.p1(), line.p2()).normalized())
+        self.bounds = bounds.adjusted(-2, -2, 2, 2)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+
+    def boundingRect(self):
+        return self.bounds
+
+    def paint(self, painter, option, widget=None):
+        painter.setPen(NodeStyle.edge_pen)
+        painter.drawLines(self.edges)
+        painter.setPen(Qt.NoPen)
+        for style, rects in self.boxes:
+            painter.setBrush(style.color)
+            painter.drawRects(rects)
+
+
+def describe_node(node, metrics=None):
+    description = f"Operation: {node.label()}\n"
+    if node.table:
+        description += f"Table: {node.table}\n"
+    if node.total_cost is not None:
+        description += f"Total Cost: {node.total_cost}\n"
+    if node.startup_cost is not None:
+        description += f"Startup Cost: {node.startup_cost}\n"
+    if node.plan_rows is not None:
+        description += f"Plan Rows: {node.plan_rows}\n"
+    if node.actual_loops == 0:
+        description += "Never Executed\n"
+    elif node.actual_loops is not None:
+        if node.actual_total_time is not None:
+            description += f"Actual Time: {node.actual_startup_time:.3f}..{node.actual_total_time:.3f} ms\n"
+        description += f"Actual Rows: {node.actual_rows:g}\nActual Loops: {node.actual_loops}\n"
+    if metrics is not None and node in metrics.self_time:
+        share = metrics.self_time[node] / metrics.plan_time if metrics.plan_time else 0.0
+        description += f"Self Time: {metrics.self_time[node]:.3f} ms ({share:.1%} of the plan)\n"
+        if node is metrics.bottleneck:
+            description += "Bottleneck of the plan\n"
+    if metrics is not None and node in metrics.row_ratio:
+        description += f"Actual/Estimated Rows: {metrics.row_ratio[node]:.2f}\n"
+    for key, value in node.properties.items():
+        if key == 'buffers':
+            value = ", ".join(f"{name}={count}" for name, count in value.items())
+        if value and key not in ['method']:
+            description += f"{key.capitalize()}: {value}\n"
+    return description
+
+
+def auto_collapsed(root):
+    """The Append and Gather nodes of a plan with too many children to show at first"""
+    return frozenset(node for node, _, _ in walk_plan(root)
+                     if len(node.children) > AUTO_COLLAPSE_CHILDREN
+                     and node.operation.startswith(AUTO_COLLAPSE_OPERATIONS))
+
+
 class ResultTableModel(QAbstractTableModel):
+    """The rows of a result, optionally filtered and sorted in memory.
+
+    Filtering and sorting run on a ResultViewWorker, one at a time, which
+    first fetches whatever the stream still holds, so exploring a result
+    never queries the server again.
+    """
+    # Progress and outcome of filtering and sorting, for the status bar
+    view_status = Signal(str)
+    # setData replaced the rows; the filter and sort were cleared
+    result_replaced = Signal()
+
     def __init__(self, data=None):
         super().__init__()
-        self._data = data or []
+        self._data = ResultStore(data or [])
         self._headers = []
-        
-    def setData(self, data, headers):
+        self._stream = None
+        self._filter = None
+        self._matches = None
+        self._sort = None
+        # Row numbers of _data in the order shown; None shows every row as stored
+        self._order = None
+        # What the latest ResultViewWorker was asked for, which _filter and _sort lag until it finishes
+        self._requested_filter = None
+        self._requested_sort = None
+        # Once a filter or sort needs the rest of the stream: a copy of _data that the
+        # workers fetch the remaining rows into, one after another, until one finishes
+        self._drain = None
+        # A single thread, so a stream is never fetched from by two workers at once
+        self._view_pool = QThreadPool(self)
+        self._view_pool.setMaxThreadCount(1)
+        self._view_generation = 0
+        self._view_pending = False
+        
+    @profiling.traced("table model reset")
+    def setData(self, data, headers, stream=None):
+        self._view_generation += 1
+        self._view_pending = False
         self.beginResetModel()
-        self._data = data
+        if self._stream:
+            # A worker may still be fetching from it; closing on the view thread waits for that
+            self._view_pool.start(self._stream.close)
+        # Workers hand over their rows already stored by column; plain row lists are stored here
+        self._data = data if isinstance(data, ResultStore) else ResultStore(data, len(headers))
         self._headers = headers
+        self._stream = stream
+        self._drain = None
+        self._filter = self._matches = self._sort = self._order = None
+        self._requested_filter = self._requested_sort = None
         self.endResetModel()
+        self.result_replaced.emit()
+
+    @property
+    def headers(self):
+        return self._headers
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        # Once workers fetch the rest into _drain, the stream is theirs
+        return self._stream is not None and not self._stream.exhausted and self._drain is None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.canFetchMore():
+            return
+        rows = self._stream.fetch()
+        if not rows:
+            return
+        # Rows are appended as the view scrolls, so only what has been looked at is held in memory
+        first = len(self._data)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self._data.extend(rows)
+        self.endInsertRows()
+
+    def source_row(self, row):
+        """The row number in the result of a row as shown"""
+        return row if self._order is None else self._order[row]
         
     def data(self, index, role):
         if not index.isValid():
             return None
             
         if role == Qt.DisplayRole:
-            if 0 <= index.row() < len(self._data) and 0 <= index.column() < len(self._headers):
-                return str(self._data[index.row()][index.column()])
+            row, column = index.row(), index.column()
+            if 0 <= row < self.rowCount() and 0 <= column < len(self._headers):
+                return self._data.display(self.source_row(row), column)
         return None
         
     def rowCount(self, parent=None):
-        return len(self._data)
+        return len(self._data) if self._order is None else len(self._order)
         
     def columnCount(self, parent=None):
         return len(self._headers) if self._headers else 0
@@ -79,10 +388,73 @@ class ResultTableModel(QAbstractTableModel):
         if role == Qt.DisplayRole:
             if orientation == Qt.Horizontal and 0 <= section < len(self._headers):
                 return self._headers[section]
-            elif orientation == Qt.Vertical and 0 <= section < len(self._data):
-                return str(section + 1)
+            elif orientation == Qt.Vertical and 0 <= section < self.rowCount():
+                return str(self.source_row(section) + 1)
         return None
 
+    def sort(self, column, order=Qt.AscendingOrder):
+        sort = (column, order == Qt.DescendingOrder) if 0 <= column < len(self._headers) else None
+        if sort != self._requested_sort:
+            self._requested_sort = sort
+            self._start_view()
+
+    def set_filter(self, text, column=None):
+        """Show only the rows matching text (see RowFilter) in column, or in any column when None"""
+        row_filter = RowFilter(text, column) if text.strip() else None
+        if row_filter != self._requested_filter:
+            self._requested_filter = row_filter
+            self._start_view()
+
+    def _start_view(self):
+        self._view_generation += 1
+        self._view_pending = True
+        store, stream = self._data, None
+        if self._drain is not None or self._stream is not None and not self._stream.exhausted:
+            # Rows an earlier worker fetched before it was replaced or failed stay in _drain,
+            # and the stream carries on after them
+            if self._drain is None:
+                self._drain = self._data.copy()
+            store, stream = self._drain, self._stream
+        worker = ResultViewWorker(self._view_generation, store, stream, self._requested_filter,
+                                  self._filter, self._matches, self._requested_sort,
+                                  lambda: self._view_generation)
+        worker.signals.progress.connect(self._on_view_progress)
+        worker.signals.finished.connect(self._on_view_finished)
+        worker.signals.error.connect(self._on_view_error)
+        self.view_status.emit("Filtering and sorting rows..." if self._requested_filter else "Sorting rows...")
+        self._view_pool.start(worker)
+
+    def _on_view_progress(self, generation, message):
+        if generation == self._view_generation:
+            self.view_status.emit(message)
+
+    def _on_view_finished(self, generation, view):
+        # Views of a filter or sort that was already replaced by a newer one are dropped
+        if generation != self._view_generation:
+            return
+        store, matches, order, timings = view
+        self._view_pending = False
+        self.beginResetModel()
+        if store is not self._data:
+            # The worker fetched the rest of the stream, which is now exhausted
+            self._data = store
+            self._stream = self._drain = None
+        self._filter, self._matches = self._requested_filter, matches
+        self._sort, self._order = self._requested_sort, order
+        self.endResetModel()
+        message = f"Showing {self.rowCount():,} of {len(self._data):,} rows"
+        if self._sort is not None:
+            column, descending = self._sort
+            message += f", sorted by {self._headers[column]} {'descending' if descending else 'ascending'}"
+        self.view_status.emit(f"{message}. {format_timings(timings)}")
+
+    def _on_view_error(self, generation, message):
+        if generation != self._view_generation:
+            return
+        self._view_pending = False
+        self._requested_filter, self._requested_sort = self._filter, self._sort
+        self.view_status.emit(f"Filtering and sorting failed: {message}")
+
 
 class QEPTreeView(QGraphicsView):
     def __init__(self, parent=None):
@@ -99,6 +471,25 @@ class QEPTreeView(QGraphicsView):
         self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
         self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
+        self.setOptimizationFlags(QGraphicsView.DontSavePainterState | QGraphicsView.DontAdjustForAntialiasing)
+
+        # Plan nodes by scene tile, and the items created so far for each tile
+        self.layout = None
+        self.metrics = None
+        self.critical = frozenset()
+        self.critical_item = None
+        self.highlights = {}
+        self.collapsed = frozenset()
+        self.positions = {}
+        self.parents = {}
+        self.tiles = {}
+        self.drawn_tiles = set()
+        self.edge_items = {}
+        self.overview_items = {}
+        self.node_items = {}
+        self.overview = False
+        self.press_pos = None
         
     def wheelEvent(self, event):
         zoom_in_factor = 1.25
@@ -110,166 +501,515 @@ class QEPTreeView(QGraphicsView):
             zoom_factor = zoom_out_factor
             
         self.scale(zoom_factor, zoom_factor)
-        
-    def visualize_qep(self, qep_root):
+        self.materialize_visible()
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.materialize_visible()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.materialize_visible()
+
+    def mousePressEvent(self, event):
+        self.press_pos = event.position() if event.button() == Qt.LeftButton else None
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        # A click, rather than the end of a drag, on a node toggles its subtree
+        if self.press_pos is None or event.button() != Qt.LeftButton:
+            return
+        moved = (event.position() - self.press_pos).manhattanLength()
+        self.press_pos = None
+        if moved < QApplication.startDragDistance():
+            item = self.itemAt(event.position().toPoint())
+            if isinstance(item, PlanNodeItem) and item.node.children:
+                self.toggle_subtree(item.node)
+        
+    @profiling.traced("draw plan")
+    def visualize_qep(self, qep_root, layout=None, collapsed=None, metrics=None):
+        """Show a plan; layout and metrics are its TreeLayout and PlanMetrics when
+        they were already computed.
+
+        collapsed defaults to auto_collapsed(qep_root). Analyzed plans are drawn
+        as a heat map of self time, with the critical path outlined.
+        """
         self.scene.clear()
-        
-        root = self._convert_qep_to_tree(qep_root)
-        
-        level_spacing = 150
-        node_spacing = 200
-        
-        level_widths = {}
-        self._calculate_level_widths(root, 0, level_widths)
-        
-        positions = {}
-        self._position_tree(root, 0, 0, positions, level_widths, node_spacing)
-        
-        self._draw_tree(root, positions)
-        
-        self.fitInView(self.scene.sceneRect().adjusted(-50, -50, 50, 50), Qt.KeepAspectRatio)
-        
-    def _convert_qep_to_tree(self, qep_node):
-        if not qep_node:
-            return None
-            
-        operation = qep_node.operation
-        if qep_node.properties.get('method'):
-            operation = f"{qep_node.properties['method']} {operation}"
-            
-        cost = None
-        startup_cost = None
-        total_cost = None
-        if qep_node.startup_cost is not None and qep_node.total_cost is not None:
-            startup_cost = qep_node.startup_cost
-            total_cost = qep_node.total_cost
-            cost = f"{startup_cost}..{total_cost}"
-            
-        props = {}
-        for key, value in qep_node.properties.items():
-            if value:
-                props[key] = value
-                
-        tree_node = TreeNode(operation, cost, props, qep_node.table, startup_cost, total_cost)
-        
-        for child in qep_node.children:
-            child_node = self._convert_qep_to_tree(child)
-            if child_node:
-                tree_node.add_child(child_node)
-                
-        return tree_node
-        
-    def _calculate_level_widths(self, node, level, level_widths):
-        if level not in level_widths:
-            level_widths[level] = 0
-        
-        level_widths[level] += 1
-        
-        for child in node.children:
-            self._calculate_level_widths(child, level + 1, level_widths)
-            
-    def _position_tree(self, node, level, index, positions, level_widths, node_spacing):
-        total_width = level_widths[level] * node_spacing
-        start_x = -total_width / 2
-        x = start_x + (index + 0.5) * node_spacing
-        
-        y = level * 150
-        
-        positions[node] = (x, y)
-        
-        child_index = 0
-        for child in node.children:
-            self._position_tree(child, level + 1, child_index, positions, level_widths, node_spacing)
-            child_index += 1
-    
-    def _draw_tree(self, node, positions):
-        if node not in positions:
+        self.critical_item = None
+        self.highlights = {}
+        self.tiles = {}
+        self.parents = {}
+        self.drawn_tiles = set()
+        self.edge_items = {}
+        self.overview_items = {}
+        self.node_items = {}
+        
+        self.layout = layout or TreeLayout(qep_root)
+        self.metrics = metrics or PlanMetrics(qep_root)
+        self.critical = frozenset(self.metrics.critical_path)
+        self.collapsed = auto_collapsed(qep_root) if collapsed is None else frozenset(collapsed)
+        self.positions = self.layout.positions(self.collapsed)
+        if not self.positions:
+            self.scene.setSceneRect(QRectF())
             return
-            
+
+        for node, position in self.positions.items():
+            self.tiles.setdefault(self._tile_of(position), set()).add(node)
+            for child in node.children:
+                self.parents[child] = node
+        self._update_scene_rect()
+        self._draw_critical_path()
+        self.fitInView(self.scene.sceneRect(), Qt.KeepAspectRatio)
+        self.materialize_visible()
+
+    def toggle_subtree(self, node):
+        """Collapse or expand the children of node.
+
+        Only nodes that appear, disappear or move are touched, and only the edge
+        and overview items of their tiles are rebuilt. Node items are created
+        for the visible tiles alone, as they are when scrolling.
+        """
+        if self.layout is None or node not in self.positions:
+            return
+        anchor = self.positions[node]
+        self.collapsed = self.collapsed ^ {node}
+        positions = self.layout.positions(self.collapsed)
+        old_positions = self.positions
+        self.positions = positions
+
+        dirty = set()
+        moved = []
+        for visible, position in positions.items():
+            old_position = old_positions.get(visible)
+            if old_position == position:
+                continue
+            if old_position is not None:
+                old_tile = self._tile_of(old_position)
+                self.tiles[old_tile].discard(visible)
+                dirty.add(old_tile)
+            else:
+                for child in visible.children:
+                    self.parents[child] = visible
+            tile = self._tile_of(position)
+            self.tiles.setdefault(tile, set()).add(visible)
+            dirty.add(tile)
+            moved.append(visible)
+            item = self.node_items.get(visible)
+            if item is not None:
+                item.setPos(*position)
+        for hidden, position in old_positions.items():
+            if hidden not in positions:
+                tile = self._tile_of(position)
+                self.tiles[tile].discard(hidden)
+                dirty.add(tile)
+                item = self.node_items.pop(hidden, None)
+                if item is not None:
+                    self.scene.removeItem(item)
+        # Edges into the children of a moved node moved with it
+        for parent in moved:
+            for child in parent.children:
+                if child in positions:
+                    dirty.add(self._tile_of(positions[child]))
+
+        item = self.node_items.get(node)
+        if item is not None:
+            item.set_collapsed(node in self.collapsed)
+        for tile in dirty:
+            edge_item = self.edge_items.pop(tile, None)
+            if edge_item is not None:
+                self.scene.removeItem(edge_item)
+            overview_item = self.overview_items.pop(tile, None)
+            if overview_item is not None:
+                self.scene.removeItem(overview_item)
+            if not self.tiles.get(tile):
+                self.tiles.pop(tile, None)
+                self.drawn_tiles.discard(tile)
+            elif tile in self.drawn_tiles:
+                self._draw_tile(tile)
+
+        self._update_scene_rect()
+        self._draw_critical_path()
+        # Keep the clicked node where it was on screen
         x, y = positions[node]
-        
-        tooltip = f"Operation: {node.operation}\n"
-        if node.table:
-            tooltip += f"Table: {node.table}\n"
-        if node.total_cost is not None:
-            tooltip += f"Total Cost: {node.total_cost}\n"
-        if node.startup_cost is not None:
-            tooltip += f"Startup Cost: {node.startup_cost}\n"
-        for key, value in node.properties.items():
-            if value and key not in ['method']:
-                tooltip += f"{key.capitalize()}: {value}\n"
-        
-        primary_color = "#26A69A"
-        secondary_color = "#00796B"
-
-        # Assign node colors based on type (Scan, Join, Sort, etc.) for visual distinction
-        if "SCAN" in node.operation:
-            primary_color = "#42A5F5"
-            secondary_color = "#1976D2"
-        elif "JOIN" in node.operation:
-            primary_color = "#7E57C2"
-            secondary_color = "#5E35B1"
-        elif "SORT" in node.operation:
-            primary_color = "#EF5350"
-            secondary_color = "#D32F2F"
-        elif "AGGREGATE" in node.operation:
-            primary_color = "#FF9800"
-            secondary_color = "#F57C00"
-            
-        node_width = 120
-        node_height = 80
-        
-        node_item = NodeGraphicsItem(
-            node.operation, 
-            tooltip, 
-            x, y, 
-            node_width, node_height,
-            primary_color, secondary_color
-        )
-        self.scene.addItem(node_item)
-        
-        display_text = node.operation
-        if node.table:
-            display_text = f"{display_text}\n{node.table}"
-            
-        text_item = QGraphicsTextItem(display_text)
-        text_item.setDefaultTextColor(QColor("white"))
-        font = QFont("Segoe UI", 9, QFont.Bold)
-        text_item.setFont(font)
-        
-        text_width = text_item.boundingRect().width()
-        text_height = text_item.boundingRect().height()
-        text_item.setPos(x - text_width/2, y - text_height/2)
-        
-        self.scene.addItem(text_item)
-        
-        for child in node.children:
-            if child in positions:
-                child_x, child_y = positions[child]
+        center = self.mapToScene(self.viewport().rect().center())
+        self.centerOn(center + QPointF(x - anchor[0], y - anchor[1]))
+        self.materialize_visible()
 
-                # Draw connection line from this node to its child node
-                line = QGraphicsLineItem(x, y + node_height/2, child_x, child_y - node_height/2)
-                
-                line.setPen(QPen(QColor("#90A4AE"), 2))
-                
-                self.scene.addItem(line)
-                
-            self._draw_tree(child, positions)
+    def set_highlights(self, highlights):
+        """Outline nodes by {node: status}, with the statuses of DIFF_COLORS"""
+        self.highlights = highlights
+        for node, item in self.node_items.items():
+            item.set_highlight(NodeStyle.diff_pens.get(highlights.get(node)))
 
+    def _node_style(self, node):
+        if self.metrics.total_time:
+            return NodeStyle.for_heat(self.metrics.heat(node))
+        return NodeStyle.for_label(node.label())
 
-class TreeNode:
-    def __init__(self, operation, cost=None, props=None, table=None, startup_cost=None, total_cost=None):
-        self.operation = operation
-        self.cost = cost
-        self.properties = props or {}
-        self.table = table
-        self.startup_cost = startup_cost
-        self.total_cost = total_cost
-        self.children = []
-        
-    def add_child(self, node):
-        self.children.append(node)
-        return node
+    def _draw_critical_path(self):
+        """Outline the edges from the root down to the bottleneck, as far as they are shown"""
+        if self.critical_item is not None:
+            self.scene.removeItem(self.critical_item)
+            self.critical_item = None
+        path = QPainterPath()
+        critical_path = self.metrics.critical_path
+        for parent, child in zip(critical_path, critical_path[1:]):
+            if child not in self.positions:
+                break
+            parent_x, parent_y = self.positions[parent]
+            x, y = self.positions[child]
+            path.moveTo(parent_x, parent_y + NODE_HEIGHT / 2)
+            path.lineTo(x, y - NODE_HEIGHT / 2)
+        if not path.isEmpty():
+            self.critical_item = QGraphicsPathItem(path)
+            self.critical_item.setPen(NodeStyle.critical_edge_pen)
+            self.critical_item.setZValue(-0.5)
+            self.scene.addItem(self.critical_item)
+
+    def _tile_of(self, position):
+        x, y = position
+        return (int(x // SCENE_TILE_SIZE), int(y // SCENE_TILE_SIZE))
+
+    def _update_scene_rect(self):
+        xs = [x for x, _ in self.positions.values()]
+        ys = [y for _, y in self.positions.values()]
+        bounds = QRectF(min(xs) - NODE_WIDTH / 2, min(ys) - NODE_HEIGHT / 2,
+                        max(xs) - min(xs) + NODE_WIDTH, max(ys) - min(ys) + NODE_HEIGHT)
+        # Items are created lazily, so the scene cannot size itself from them
+        self.scene.setSceneRect(bounds.adjusted(-50, -50, 50, 50))
+
+    def materialize_visible(self):
+        """Create the items of every tile within a tile of the visible area, as
+        node items or, when zoomed far out, as overview items"""
+        if not self.tiles:
+            return
+        overview = self.transform().m11() < OVERVIEW_DETAIL_LEVEL
+        if overview != self.overview:
+            self.overview = overview
+            for item in self.node_items.values():
+                item.setVisible(not overview)
+            for item in self.edge_items.values():
+                item.setVisible(not overview)
+            for item in self.overview_items.values():
+                item.setVisible(overview)
+        visible = self.mapToScene(self.viewport().rect()).boundingRect().intersected(self.sceneRect())
+        if visible.isEmpty():
+            return
+        first_column = int(visible.left() // SCENE_TILE_SIZE) - 1
+        last_column = int(visible.right() // SCENE_TILE_SIZE) + 1
+        first_row = int(visible.top() // SCENE_TILE_SIZE) - 1
+        last_row = int(visible.bottom() // SCENE_TILE_SIZE) + 1
+        created = self.overview_items if overview else self.drawn_tiles
+        for column in range(first_column, last_column + 1):
+            for row in range(first_row, last_row + 1):
+                tile = (column, row)
+                if tile in self.tiles and tile not in created:
+                    if overview:
+                        item = TileOverviewItem(self.tiles[tile], self.positions, self.parents, self._node_style)
+                        self.scene.addItem(item)
+                        self.overview_items[tile] = item
+                    else:
+                        self._draw_tile(tile)
+
+    def _draw_tile(self, tile):
+        """Create the node items of a tile that do not exist yet and the tile's edge item"""
+        edges = QPainterPath()
+        for node in self.tiles[tile]:
+            x, y = self.positions[node]
+            item = self.node_items.get(node)
+            if item is None:
+                item = PlanNodeItem(node, self._node_style(node), self.metrics, node in self.critical)
+                item.set_collapsed(node in self.collapsed)
+                item.set_highlight(NodeStyle.diff_pens.get(self.highlights.get(node)))
+                item.setPos(x, y)
+                item.setVisible(not self.overview)
+                self.scene.addItem(item)
+                self.node_items[node] = item
+            parent = self.parents.get(node)
+            if parent is not None:
+                parent_x, parent_y = self.positions[parent]
+                edges.moveTo(parent_x, parent_y + NODE_HEIGHT / 2)
+                edges.lineTo(x, y - NODE_HEIGHT / 2)
+        if not edges.isEmpty():
+            # Edges into the tile's nodes are drawn by one item behind them, so a
+            # wide fan-out shows the edges of whichever children are on screen
+            edge_item = QGraphicsPathItem(edges)
+            edge_item.setPen(NodeStyle.edge_pen)
+            edge_item.setZValue(-1)
+            edge_item.setVisible(not self.overview)
+            self.scene.addItem(edge_item)
+            self.edge_items[tile] = edge_item
+        self.drawn_tiles.add(tile)
+
+
+class WorkerSignals(QObject):
+    progress = Signal(int, str)
+    finished = Signal(int, object)
+    error = Signal(int, str)
+
+
+class QueryRun:
+    def __init__(self, query):
+        self.query = query
+        self.result = None
+        self.qep_root = None
+        self.original_plan = ""
+        self.pipe_syntax = ""
+        self.layout = None
+        self.metrics = None
+        self.fingerprint = None
+        self.collapsed = frozenset()
+        self.plan_only = False
+        self.timings = {}
+        # Seconds from the worker starting to everything being ready to show
+        self.wall_time = None
+        # The profiling.Trace of the run while the profiler panel is open
+        self.trace = None
+
+
+class QueryWorker(QRunnable):
+    """Runs one query on connections borrowed from the pool, then prepares everything the views need.
+
+    Everything except drawing happens here, off the GUI thread; results and
+    progress are reported back through WorkerSignals.
+    """
+    def __init__(self, run_id, db, query, stream=False, itersize=DEFAULT_ITERSIZE, options=None,
+                 plan_only=False):
+        super().__init__()
+        self.run_id = run_id
+        self.session = db.clone()
+        self.query = query
+        self.stream = stream
+        self.itersize = itersize
+        self.options = options
+        self.plan_only = plan_only
+        self.cancelled = False
+        self.signals = WorkerSignals()
+
+    def cancel(self):
+        self.cancelled = True
+        self.session.cancel()
+
+    def run(self):
+        run = QueryRun(self.query)
+        if profiling.is_enabled():
+            run.trace = profiling.Trace(f"Run {self.run_id}: {' '.join(self.query.split())[:60]}")
+            # Pool threads are not started by Python, so they would show up as Dummy-N
+            threading.current_thread().name = "query worker"
+        with profiling.activate(run.trace), profiling.span("query worker"):
+            self._run(run)
+
+    def _run(self, run):
+        started = time.perf_counter()
+        try:
+            if self.cancelled:
+                raise RuntimeError("Query cancelled")
+
+            clean_query = MainWindow.sanitize_query(self.query)
+            if self.plan_only:
+                self.signals.progress.emit(self.run_id, "Explaining query...")
+                start = time.perf_counter()
+                plan = self.session.explain(clean_query, self.options)
+                run.result = QueryResult([], None, plan, {"plan": time.perf_counter() - start})
+                run.plan_only = True
+            elif self.stream:
+                self.signals.progress.emit(self.run_id, "Executing query...")
+                run.result = self.session.stream_query(clean_query, self.itersize, self.options)
+            else:
+                self.signals.progress.emit(self.run_id, "Executing query...")
+                run.result = self.session.run_query(clean_query, self.options)
+            run.timings.update(run.result.timings)
+            if run.result.rows:
+                # Stored by column here rather than in the model, so the GUI thread
+                # never converts a large result and the row tuples can be freed
+                start = time.perf_counter()
+                with profiling.span("store rows"):
+                    run.result.rows = ResultStore(run.result.rows, len(run.result.headers))
+                run.timings["store rows"] = time.perf_counter() - start
+
+            self.signals.progress.emit(self.run_id, "Parsing plan...")
+            start = time.perf_counter()
+            run.qep_root = parse_qep_json(run.result.plan_json)
+            run.original_plan = format_plan_text(run.result.plan_json)
+            with profiling.span("plan metrics"):
+                run.metrics = PlanMetrics(run.qep_root)
+            with profiling.span("fingerprint"):
+                run.fingerprint = fingerprint_sql(clean_query)
+            run.timings["parse plan"] = time.perf_counter() - start
+
+            self.signals.progress.emit(self.run_id, "Converting to pipe-syntax...")
+            start = time.perf_counter()
+            # With the plan, so each step is annotated with its costs and, when analyzed, actual times
+            run.pipe_syntax = sql_to_pipe(self.query, run.qep_root)
+            run.timings["convert"] = time.perf_counter() - start
+
+            self.signals.progress.emit(self.run_id, "Laying out plan...")
+            start = time.perf_counter()
+            # The view reuses these positions, so layout never runs on the GUI thread
+            run.layout = TreeLayout(run.qep_root)
+            run.collapsed = auto_collapsed(run.qep_root)
+            run.layout.positions(run.collapsed)
+            run.timings["layout"] = time.perf_counter() - start
+            run.wall_time = time.perf_counter() - started
+        except Exception as e:
+            if run.result and run.result.stream:
+                run.result.stream.close()
+            self.signals.error.emit(self.run_id, "Query cancelled" if self.cancelled else str(e))
+            return
+
+        self.signals.finished.emit(self.run_id, run)
+
+
+class ScriptRun:
+    """The statements of a script run in workspace mode, and their runs as they finish"""
+    def __init__(self, statements, plan_only=False):
+        self.statements = statements
+        self.plan_only = plan_only
+        self.runs = [None] * len(statements)
+        self.errors = [None] * len(statements)
+        # Statement index of each run_id still running
+        self.running = {}
+        self.cancelled = False
+        self.started = time.perf_counter()
+        self.wall_time = None
+
+    @property
+    def finished(self):
+        return self.wall_time is not None
+
+
+class PipePreviewWorker(QRunnable):
+    def __init__(self, generation, query, latest_generation):
+        super().__init__()
+        self.generation = generation
+        self.query = query
+        self.latest_generation = latest_generation
+        self.signals = WorkerSignals()
+
+    def run(self):
+        # Text that changed again while this conversion waited in the queue is not worth converting
+        if self.latest_generation() != self.generation:
+            return
+        try:
+            pipe_syntax = sql_to_pipe(self.query)
+        except Exception as e:
+            self.signals.error.emit(self.generation, str(e))
+            return
+        self.signals.finished.emit(self.generation, pipe_syntax)
+
+
+class ResultViewWorker(QRunnable):
+    """Filters and sorts the rows of a result for ResultTableModel, off the GUI thread.
+
+    With a stream, store is the model's copy of the table's rows that the
+    rest of the stream is fetched into first, so the table can keep showing
+    the original meanwhile. Abandoning that halfway loses nothing: the rows
+    fetched stay in the copy for the next worker. A filter that narrows the
+    one applied so far only checks the rows that one kept.
+    """
+    def __init__(self, generation, store, stream, row_filter, applied_filter, applied_matches, sort,
+                 latest_generation):
+        super().__init__()
+        self.generation = generation
+        self.store = store
+        self.stream = stream
+        self.row_filter = row_filter
+        self.applied_filter = applied_filter
+        self.applied_matches = applied_matches
+        self.sort = sort
+        self.latest_generation = latest_generation
+        self.signals = WorkerSignals()
+
+    def stale(self):
+        return self.latest_generation() != self.generation
+
+    def run(self):
+        # Work for a filter or sort that was replaced while this one waited or ran is abandoned
+        if self.stale():
+            return
+        timings = {}
+        try:
+            store = self.store
+            if self.stream is not None:
+                start = time.perf_counter()
+                while not self.stream.exhausted:
+                    if self.stale():
+                        return
+                    store.extend(self.stream.fetch(VIEW_FETCH_ROWS))
+                    self.signals.progress.emit(self.generation, f"Fetching the rest of the result... {len(store):,} rows")
+                timings["fetch"] = time.perf_counter() - start
+
+            matches = None
+            if self.row_filter is not None:
+                start = time.perf_counter()
+                if self.stream is None and self.row_filter == self.applied_filter:
+                    matches = self.applied_matches
+                else:
+                    candidates = range(len(store))
+                    if self.stream is None and self.applied_filter is not None and self.row_filter.narrows(
+                            self.applied_filter, store):
+                        candidates = self.applied_matches
+                    matches = array('q')
+                    for first in range(0, len(candidates), VIEW_CHUNK_ROWS):
+                        if self.stale():
+                            return
+                        matches.extend(self.row_filter.apply(store, candidates[first:first + VIEW_CHUNK_ROWS]))
+                    timings["filter"] = time.perf_counter() - start
+
+            if self.stale():
+                return
+            start = time.perf_counter()
+            order = view_order(store, matches, *(self.sort or ()))
+            if self.sort is not None:
+                timings["sort"] = time.perf_counter() - start
+        except Exception as e:
+            self.signals.error.emit(self.generation, str(e))
+            return
+        self.signals.finished.emit(self.generation, (store, matches, order, timings))
+
+
+def replace_changed_lines(text_edit, text):
+    """Replace only the lines of text_edit that differ from text, keeping scroll position and undo cheap"""
+    old_lines = text_edit.toPlainText().split("\n")
+    new_lines = text.split("\n")
+    if old_lines == new_lines:
+        return
+    common = min(len(old_lines), len(new_lines))
+    prefix = 0
+    while prefix < common and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < common - prefix and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+    old_end = len(old_lines) - suffix
+    new_middle = new_lines[prefix:len(new_lines) - suffix]
+
+    doc = text_edit.document()
+    cursor = QTextCursor(doc)
+    cursor.beginEditBlock()
+    if prefix == old_end:
+        # Pure insertion between unchanged lines
+        if suffix:
+            cursor.setPosition(doc.findBlockByNumber(prefix).position())
+            cursor.insertText("\n".join(new_middle) + "\n")
+        else:
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText("\n" + "\n".join(new_middle))
+    else:
+        start = doc.findBlockByNumber(prefix).position()
+        last = doc.findBlockByNumber(old_end - 1)
+        end = last.position() + last.length() - 1
+        if not new_middle:
+            # Removing whole lines also removes one of the line breaks around them
+            if suffix:
+                end += 1
+            elif prefix:
+                start -= 1
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        cursor.insertText("\n".join(new_middle))
+    cursor.endEditBlock()
 
 
 class DatabaseConnectDialog(QDialog):
@@ -311,6 +1051,206 @@ class DatabaseConnectDialog(QDialog):
         }
 
 
+class PlanDiffDialog(QDialog):
+    """Two recorded plans of a query side by side, with their differences outlined"""
+    def __init__(self, records, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Compare Plans")
+        self.resize(1400, 800)
+        self.records = records
+
+        layout = QVBoxLayout(self)
+        pickers_layout = QHBoxLayout()
+        self.before_picker = QComboBox()
+        self.after_picker = QComboBox()
+        for picker in (self.before_picker, self.after_picker):
+            for record in records:
+                picker.addItem(record.label())
+        self.before_picker.setCurrentIndex(len(records) - 2)
+        self.after_picker.setCurrentIndex(len(records) - 1)
+        pickers_layout.addWidget(QLabel("Before:"))
+        pickers_layout.addWidget(self.before_picker, 1)
+        pickers_layout.addWidget(QLabel("After:"))
+        pickers_layout.addWidget(self.after_picker, 1)
+
+        legend = QLabel("   ".join(f'<span style="color: {color};">&#9632;</span> {status.capitalize()}'
+                                   for status, color in DIFF_COLORS.items()))
+        splitter = QSplitter(Qt.Horizontal)
+        self.before_view = QEPTreeView()
+        self.after_view = QEPTreeView()
+        splitter.addWidget(self.before_view)
+        splitter.addWidget(self.after_view)
+        self.changes_output = QTextEdit()
+        self.changes_output.setReadOnly(True)
+        self.changes_output.setMaximumHeight(160)
+
+        layout.addLayout(pickers_layout)
+        layout.addWidget(legend)
+        layout.addWidget(splitter, 1)
+        layout.addWidget(self.changes_output)
+
+        self.before_picker.currentIndexChanged.connect(self.compare)
+        self.after_picker.currentIndexChanged.connect(self.compare)
+        self.compare()
+
+    def compare(self):
+        before = self.records[self.before_picker.currentIndex()]
+        after = self.records[self.after_picker.currentIndex()]
+        diff = PlanDiff(before.root, after.root)
+        for view, record, highlights in ((self.before_view, before, diff.before),
+                                         (self.after_view, after, diff.after)):
+            view.visualize_qep(record.root, collapsed=expanded_to(record.root, highlights))
+            view.set_highlights(highlights)
+        self.changes_output.setPlainText("\n".join(str(change) for change in diff.changes)
+                                         or "The plans are the same.")
+
+
+class WaterfallView(QWidget):
+    """The spans of one trace as bars on a shared time axis, one row per span"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.trace = None
+        self.spans = []
+        self.threads = {}
+        self.font_metrics = QFontMetrics(self.font())
+
+    def set_trace(self, trace):
+        self.trace = trace
+        self.spans = trace.sorted_spans() if trace else []
+        self.threads = {}
+        for span in self.spans:
+            self.threads.setdefault(span.thread, len(self.threads))
+        self.setMinimumHeight((len(self.spans) + 1) * WATERFALL_ROW_HEIGHT)
+        self.update()
+
+    def span_at(self, y):
+        row = int(y // WATERFALL_ROW_HEIGHT)
+        return self.spans[row] if 0 <= row < len(self.spans) else None
+
+    def event(self, event):
+        if event.type() == event.Type.ToolTip:
+            span = self.span_at(event.pos().y())
+            if span is None:
+                QToolTip.hideText()
+            else:
+                start = (span.start - self.trace.start) * 1000
+                text = f"{span.name}\n{span.duration * 1000:.3f} ms, from {start:.3f} ms\nThread: {span.thread}"
+                text += "".join(f"\n{key}: {value}" for key, value in span.args.items())
+                QToolTip.showText(event.globalPos(), text, self)
+            return True
+        return super().event(event)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        if not self.spans:
+            painter.drawText(self.rect(), Qt.AlignCenter, "Execute a query while the profiler is open to see its phases.")
+            return
+        duration = max(self.trace.duration, 1e-9)
+        bar_space = max(1.0, self.width() - WATERFALL_LABEL_WIDTH - 80)
+        visible = event.rect()
+        for row, span in enumerate(self.spans):
+            y = row * WATERFALL_ROW_HEIGHT
+            if y + WATERFALL_ROW_HEIGHT < visible.top() or y > visible.bottom():
+                continue
+            label = self.font_metrics.elidedText("  " * span.depth + span.name, Qt.ElideRight,
+                                                 WATERFALL_LABEL_WIDTH - 8)
+            painter.setPen(QColor("#37474F"))
+            painter.drawText(QRectF(4, y, WATERFALL_LABEL_WIDTH - 8, WATERFALL_ROW_HEIGHT),
+                             Qt.AlignVCenter | Qt.AlignLeft, label)
+            x = WATERFALL_LABEL_WIDTH + (span.start - self.trace.start) / duration * bar_space
+            width = max(1.0, span.duration / duration * bar_space)
+            color = WATERFALL_COLORS[self.threads[span.thread] % len(WATERFALL_COLORS)]
+            painter.fillRect(QRectF(x, y + 3, width, WATERFALL_ROW_HEIGHT - 6), QColor(color))
+            painter.drawText(QRectF(x + width + 4, y, 76, WATERFALL_ROW_HEIGHT),
+                             Qt.AlignVCenter | Qt.AlignLeft, f"{span.duration * 1000:.1f} ms")
+
+
+class ProfilerPanel(QDockWidget):
+    """Dockable waterfall of the phases of recent runs.
+
+    Spans are only recorded while the panel is shown, so a hidden panel
+    costs the instrumented code no more than a flag check.
+    """
+    def __init__(self, parent=None):
+        super().__init__("Profiler", parent)
+        self.traces = deque(maxlen=MAX_PROFILED_RUNS)
+
+        self.run_selector = QComboBox()
+        self.run_selector.currentIndexChanged.connect(self.show_trace)
+        export_btn = QPushButton("Export Chrome Trace...")
+        export_btn.clicked.connect(self.export_trace)
+        clear_btn = QPushButton("Clear")
+        clear_btn.clicked.connect(self.clear)
+        self.summary = QLabel("")
+        self.summary.setStyleSheet("color: #455A64;")
+        self.waterfall = WaterfallView()
+        scroll = QScrollArea()
+        scroll.setWidgetResizable(True)
+        scroll.setWidget(self.waterfall)
+
+        header = QHBoxLayout()
+        header.addWidget(self.run_selector, 1)
+        header.addWidget(self.summary)
+        header.addWidget(clear_btn)
+        header.addWidget(export_btn)
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        layout.addLayout(header)
+        layout.addWidget(scroll)
+        self.setWidget(widget)
+        self.visibilityChanged.connect(profiling.enable)
+
+    def add_trace(self, trace):
+        if trace is None:
+            return
+        self.traces.append(trace)
+        self.run_selector.blockSignals(True)
+        self.run_selector.insertItem(0, trace.name)
+        while self.run_selector.count() > len(self.traces):
+            self.run_selector.removeItem(self.run_selector.count() - 1)
+        self.run_selector.setCurrentIndex(0)
+        self.run_selector.blockSignals(False)
+        self.show_trace(0)
+
+    def show_trace(self, index):
+        trace = self.traces[len(self.traces) - 1 - index] if 0 <= index < len(self.traces) else None
+        self.waterfall.set_trace(trace)
+        self.summary.setText(f"{len(trace.spans)} spans, {trace.duration * 1000:.1f} ms" if trace else "")
+
+    def clear(self):
+        self.traces.clear()
+        self.run_selector.clear()
+        self.show_trace(-1)
+
+    def export_trace(self):
+        if not self.traces:
+            QMessageBox.information(self, "Export Chrome Trace", "No runs were profiled yet.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export Chrome Trace", "trace.json", "JSON files (*.json)")
+        if not path:
+            return
+        try:
+            profiling.export_chrome_trace(list(self.traces), path)
+        except OSError as e:
+            QMessageBox.critical(self, "Export Error", f"Failed to export trace: {str(e)}")
+            print(f"Trace export error: {e}")
+
+
+def expanded_to(root, nodes):
+    """auto_collapsed(root), except for the ancestors of nodes, so that all of them are shown"""
+    parents = {}
+    for node, _, _ in walk_plan(root):
+        for child in node.children:
+            parents[child] = node
+    expanded = set()
+    for node in nodes:
+        parent = parents.get(node)
+        while parent is not None and parent not in expanded:
+            expanded.add(parent)
+            parent = parents.get(parent)
+    return auto_collapsed(root) - expanded
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -320,12 +1260,38 @@ class MainWindow(QMainWindow):
         
         self.db = None
         self.current_qep_root = None
+        self.current_fingerprint = None
+        self.plan_history = PlanHistory(PLAN_HISTORY_PATH)
+        self.disk_cache = DiskCache(CACHE_PATH, CACHE_MAX_BYTES) if CACHE_PATH else None
+        use_disk_cache(self.disk_cache)
+        # Shared by every connection, so results cached before a reconnect stay usable
+        self.result_cache = ResultCache(store=self.disk_cache)
         self.current_result_tab = 0
         
+        # Queries run on a thread pool, each on pooled connections. The work is
+        # mostly waiting on the server, so the pool is not limited to the core count
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(MAX_CONCURRENT_QUERIES)
+        self.active_workers = {}
+        self.next_run_id = 1
+        self.displayed_run_id = 0
+        # The multi-statement script shown in the statement tabs, if any
+        self.script = None
+        
+        # Live preview converts on its own single thread so it never queues behind queries
+        self.preview_pool = QThreadPool(self)
+        self.preview_pool.setMaxThreadCount(1)
+        self.preview_generation = 0
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self.start_preview)
+        
         self.setup_ui()
         self.apply_theme()
 
-    def sanitize_query(self, query: str) -> str:
+    @staticmethod
+    def sanitize_query(query: str) -> str:
          return query.strip().rstrip(';')
     
     def setup_ui(self):
@@ -342,9 +1308,20 @@ class MainWindow(QMainWindow):
         connect_btn = QPushButton("Connect")
         connect_btn.clicked.connect(self.connect_database)
         
+        # The profiler records spans only while its panel is open
+        self.profiler = ProfilerPanel(self)
+        self.profiler.setObjectName("profiler")
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.profiler)
+        self.profiler.hide()
+        self.profiler_btn = QPushButton("Profiler")
+        self.profiler_btn.setCheckable(True)
+        self.profiler_btn.toggled.connect(self.profiler.setVisible)
+        self.profiler.visibilityChanged.connect(self.profiler_btn.setChecked)
+
         db_layout.addWidget(db_label)
         db_layout.addWidget(self.db_status)
         db_layout.addStretch()
+        db_layout.addWidget(self.profiler_btn)
         db_layout.addWidget(connect_btn)
         
         main_layout.addLayout(db_layout)
@@ -365,10 +1342,64 @@ class MainWindow(QMainWindow):
         
         self.execute_btn = QPushButton("Execute")
         self.execute_btn.clicked.connect(self.execute_query)
-        
+        # Plans the query without running it, so it returns at once even for expensive queries
+        self.explain_btn = QPushButton("Explain Only")
+        self.explain_btn.clicked.connect(self.explain_query)
+        
+        # Streaming keeps the result set on the server and fetches it in batches while scrolling
+        execute_options_layout = QHBoxLayout()
+        self.stream_checkbox = QCheckBox("Stream results")
+        self.itersize_input = QSpinBox()
+        self.itersize_input.setRange(100, 100000)
+        self.itersize_input.setSingleStep(500)
+        self.itersize_input.setValue(DEFAULT_ITERSIZE)
+        self.itersize_input.setPrefix("Batch size: ")
+        self.live_preview_checkbox = QCheckBox("Live pipe-syntax preview")
+        self.live_preview_checkbox.toggled.connect(self.toggle_live_preview)
+        self.query_input.textChanged.connect(self.schedule_preview)
+        # Small results of deterministic queries are reused while their tables do not change
+        self.result_cache_checkbox = QCheckBox("Cache small results")
+        self.result_cache_checkbox.toggled.connect(self.toggle_result_cache)
+        execute_options_layout.addWidget(self.stream_checkbox)
+        execute_options_layout.addWidget(self.itersize_input)
+        execute_options_layout.addWidget(self.result_cache_checkbox)
+        execute_options_layout.addStretch()
+        execute_options_layout.addWidget(self.live_preview_checkbox)
+        
+        # EXPLAIN options; Buffers, WAL and Timing need Analyze, and a generic plan
+        # (PostgreSQL 16) is only available through Explain Only
+        explain_options_layout = QHBoxLayout()
+        explain_label = QLabel("EXPLAIN:")
+        explain_label.setStyleSheet("color: #455A64;")
+        self.analyze_checkbox = QCheckBox("Analyze")
+        self.analyze_checkbox.setChecked(True)
+        self.buffers_checkbox = QCheckBox("Buffers")
+        self.wal_checkbox = QCheckBox("WAL")
+        self.timing_checkbox = QCheckBox("Timing")
+        self.timing_checkbox.setChecked(True)
+        self.settings_checkbox = QCheckBox("Settings")
+        self.generic_plan_checkbox = QCheckBox("Generic plan ($1 parameters)")
+        self.analyze_checkbox.toggled.connect(self.buffers_checkbox.setEnabled)
+        self.analyze_checkbox.toggled.connect(self.wal_checkbox.setEnabled)
+        self.analyze_checkbox.toggled.connect(self.timing_checkbox.setEnabled)
+        explain_options_layout.addWidget(explain_label)
+        for checkbox in (self.analyze_checkbox, self.buffers_checkbox, self.wal_checkbox,
+                         self.timing_checkbox, self.settings_checkbox, self.generic_plan_checkbox):
+            explain_options_layout.addWidget(checkbox)
+        explain_options_layout.addStretch()
+
         query_layout.addWidget(query_header)
         query_layout.addWidget(self.query_input)
-        query_layout.addWidget(self.execute_btn)
+        query_layout.addLayout(execute_options_layout)
+        query_layout.addLayout(explain_options_layout)
+        execute_buttons_layout = QHBoxLayout()
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_queries)
+        execute_buttons_layout.addWidget(self.execute_btn)
+        execute_buttons_layout.addWidget(self.explain_btn)
+        execute_buttons_layout.addWidget(self.cancel_btn)
+        query_layout.addLayout(execute_buttons_layout)
         
         results_widget = QWidget()
         results_layout = QVBoxLayout(results_widget)
@@ -408,6 +1439,13 @@ class MainWindow(QMainWindow):
         results_header_layout.addWidget(results_header)
         results_header_layout.addLayout(self.results_buttons_layout)
         
+        # One tab per statement of a script; choosing one shows its results, plan and pipe-syntax
+        self.statement_tabs = QTabBar()
+        self.statement_tabs.setExpanding(False)
+        self.statement_tabs.setUsesScrollButtons(True)
+        self.statement_tabs.currentChanged.connect(self.show_statement)
+        self.statement_tabs.hide()
+
         self.result_table_model = ResultTableModel()
         self.result_table = QTableView()
         self.result_table.setModel(self.result_table_model)
@@ -415,6 +1453,30 @@ class MainWindow(QMainWindow):
         self.result_table.horizontalHeader().setStretchLastSection(True)
         self.result_table.setSelectionBehavior(QTableView.SelectRows)
         self.result_table.setAlternatingRowColors(True)
+        # Clicking a column header sorts by it, ascending, descending and back to unsorted
+        self.result_table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.result_table.horizontalHeader().setSortIndicatorClearable(True)
+        self.result_table.setSortingEnabled(True)
+        self.result_table_model.view_status.connect(lambda message: self.statusBar().showMessage(message))
+        self.result_table_model.result_replaced.connect(self.reset_result_filter)
+
+        # Filters the rows already fetched, without running the query again
+        self.result_filter_bar = QWidget()
+        result_filter_layout = QHBoxLayout(self.result_filter_bar)
+        result_filter_layout.setContentsMargins(0, 0, 0, 0)
+        self.result_filter_input = QLineEdit()
+        self.result_filter_input.setPlaceholderText("Filter rows: text, or a range such as 10..20, >=5, <1995-01-01")
+        self.result_filter_input.setClearButtonEnabled(True)
+        self.result_filter_input.textChanged.connect(lambda: self.filter_timer.start())
+        self.result_filter_column = QComboBox()
+        self.result_filter_column.addItem("All columns")
+        self.result_filter_column.currentIndexChanged.connect(self.apply_result_filter)
+        result_filter_layout.addWidget(self.result_filter_input)
+        result_filter_layout.addWidget(self.result_filter_column)
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(FILTER_DEBOUNCE_MS)
+        self.filter_timer.timeout.connect(self.apply_result_filter)
         
         self.pipe_syntax_output = QTextEdit()
         self.pipe_syntax_output.setReadOnly(True)
@@ -423,6 +1485,8 @@ class MainWindow(QMainWindow):
         self.qep_output.setReadOnly(True)
         
         results_layout.addLayout(results_header_layout)
+        results_layout.addWidget(self.statement_tabs)
+        results_layout.addWidget(self.result_filter_bar)
         results_layout.addWidget(self.result_table)
         results_layout.addWidget(self.pipe_syntax_output)
         results_layout.addWidget(self.qep_output)
@@ -443,7 +1507,14 @@ class MainWindow(QMainWindow):
         
         self.qep_visual = QEPTreeView()
         
-        visual_layout.addWidget(visual_header)
+        visual_header_layout = QHBoxLayout()
+        self.compare_btn = QPushButton("Compare Plans")
+        self.compare_btn.clicked.connect(self.show_plan_diff)
+        visual_header_layout.addWidget(visual_header)
+        visual_header_layout.addStretch()
+        visual_header_layout.addWidget(self.compare_btn)
+
+        visual_layout.addLayout(visual_header_layout)
         visual_layout.addWidget(self.qep_visual)
         
         h_splitter.addWidget(left_panel)
@@ -457,6 +1528,9 @@ class MainWindow(QMainWindow):
         
         self.statusBar().showMessage("Ready")
         self.statusBar().setStyleSheet("color: #455A64;")
+        
+        self.pool_status = QLabel("")
+        self.statusBar().addPermanentWidget(self.pool_status)
     
     def apply_theme(self):
         app = QApplication.instance()
@@ -637,6 +1711,10 @@ class MainWindow(QMainWindow):
         """
 
         self.execute_btn.setStyleSheet(gray_button_style)
+        self.explain_btn.setStyleSheet(gray_button_style)
+        self.compare_btn.setStyleSheet(gray_button_style)
+        self.profiler_btn.setStyleSheet(gray_button_style)
+        self.cancel_btn.setStyleSheet(gray_button_style)
 
         connect_btn = self.findChild(QPushButton, "")
         execute_btn = self.findChild(QPushButton, "")
@@ -690,21 +1768,25 @@ class MainWindow(QMainWindow):
         if dialog.exec():
             params = dialog.get_connection_params()
             
+            if self.db:
+                self.db.disconnect()
             try:
                 self.db = Database(
                     dbname=params["dbname"],
                     user=params["user"],
                     password=params["password"],
                     host=params["host"],
-                    port=params["port"]
+                    port=params["port"],
+                    plan_cache=PlanCache(store=self.disk_cache),
+                    result_cache=self.result_cache if self.result_cache_checkbox.isChecked() else None
                 )
+                # Opening the pool's first connection already verifies the credentials
                 self.db.connect()
                 
-                self.db.execute_query("SELECT 1")
-                
                 self.db_status.setText(f"Connected to {params['dbname']}")
                 self.db_status.setStyleSheet("color: #4CAF50; font-weight: bold;")
                 self.statusBar().showMessage("Database connected successfully")
+                self.update_connection_status()
             
             except Exception as e:
                 self.db = None
@@ -712,7 +1794,24 @@ class MainWindow(QMainWindow):
                 self.db_status.setText("Not connected")
                 self.db_status.setStyleSheet("color: #F44336; font-weight: bold;")
     
-    def execute_query(self):
+    def explain_options(self, plan_only=False):
+        if plan_only:
+            return ExplainOptions(analyze=False, settings=self.settings_checkbox.isChecked(),
+                                  generic_plan=self.generic_plan_checkbox.isChecked())
+        return ExplainOptions(analyze=self.analyze_checkbox.isChecked(),
+                              buffers=self.buffers_checkbox.isChecked(),
+                              wal=self.wal_checkbox.isChecked(),
+                              timing=self.timing_checkbox.isChecked(),
+                              settings=self.settings_checkbox.isChecked())
+
+    def toggle_result_cache(self, enabled):
+        if self.db:
+            self.db.result_cache = self.result_cache if enabled else None
+
+    def explain_query(self):
+        self.execute_query(plan_only=True)
+
+    def execute_query(self, plan_only=False):
         if not self.db:
             QMessageBox.warning(self, "Not Connected", "Please connect to a database first.")
             return
@@ -722,61 +1821,327 @@ class MainWindow(QMainWindow):
         if not query:
             QMessageBox.warning(self, "Empty Query", "Please enter an SQL query.")
             return
-        
-        try:
-            self.statusBar().showMessage("Executing query...")
 
-            # Get both parsed and original version of the execution plan from the database
+        if ";" in query.rstrip(";"):
+            statements = split_statements(query)
+            if len(statements) > 1:
+                # Explaining executes nothing, so only executed scripts must not write
+                writer = None if plan_only else next(
+                    (index for index, statement in enumerate(statements) if not is_read_only(statement)), None)
+                if writer is not None:
+                    QMessageBox.warning(
+                        self, "Writes Not Supported in Scripts",
+                        f"Statement {writer + 1} of the script is not a read-only query, and scripts that "
+                        "write are refused. Scripts run each statement on its own pooled connection and roll it "
+                        "back, so its changes would not be seen by the statements after it. Execute it on its "
+                        "own, or use Explain Only to see the plans of the whole script.")
+                    return
+                self.run_script(statements, plan_only)
+                return
+        self.script = None
+        self.statement_tabs.hide()
 
-            plan_json = self.db.get_plan_json(query)
-            original_plan = self.db.get_plan_original(query)
-            
-            root = parse_qep_json(plan_json)
-            self.current_qep_root = root
-            
-           # Convert query into pipe-syntax string for display
-            pipe_syntax = sql_to_pipe(query)
+        run_id = self.next_run_id
+        self.next_run_id += 1
+        worker = QueryWorker(run_id, self.db, query, self.stream_checkbox.isChecked(),
+                             self.itersize_input.value(), self.explain_options(plan_only), plan_only)
+        worker.signals.progress.connect(self.on_query_progress)
+        worker.signals.finished.connect(self.on_query_finished)
+        worker.signals.error.connect(self.on_query_error)
+        self.active_workers[run_id] = worker
+        self.cancel_btn.setEnabled(True)
+        self.statusBar().showMessage("Explaining query..." if plan_only else "Executing query...")
+        self.thread_pool.start(worker)
 
+    def run_script(self, statements, plan_only=False):
+        """Run the statements of a script concurrently in workspace mode, with a statement tab for each.
 
-            self.pipe_syntax_output.setText(pipe_syntax)
-            self.qep_output.setText(original_plan)
-            
-            try:
-                clean_query = self.sanitize_query(query)
-                results = self.db.execute_query(clean_query)
-                
-                if results and len(results) > 0:
-                    cursor = self.db.conn.cursor()
-                    # Get only the column names (headers) without fetching actual data again
-                    cursor.execute(f"SELECT * FROM ({clean_query}) AS temp LIMIT 0")
-                    headers = [desc[0] for desc in cursor.description]
-                    cursor.close()
-                    
-                    processed_results = []
-                    for row in results:
-                        processed_row = []
-                        for item in row:
-                            processed_row.append(item)
-                        processed_results.append(processed_row)
-                    
-                    self.result_table_model.setData(processed_results, headers)
-                    self.statusBar().showMessage(f"Query executed successfully. {len(results)} rows returned.")
-                else:
-                    self.result_table_model.setData([], [])
-                    self.statusBar().showMessage("Query executed successfully. No results returned.")
-            except Exception as e:
-                self.result_table_model.setData([], [])
-                self.statusBar().showMessage(f"Cannot show query results: {str(e)}")
-                print(f"Query result error: {str(e)}")
-            
-            self.qep_visual.visualize_qep(root)
-            self.switch_result_tab(0)
-            
-        except Exception as e:
-            QMessageBox.critical(self, "Query Error", f"Error executing query: {str(e)}")
-            self.statusBar().showMessage("Query execution failed")
-            print(f"Query execution error: {str(e)}")
+        Executed scripts only hold read-only statements; execute_query refuses the others.
+        """
+        if self.script is not None:
+            self.script.cancelled = True
+        self.script = ScriptRun(statements, plan_only)
+        # A query started before the script never replaces its views
+        self.displayed_run_id = self.next_run_id
+        self.statement_tabs.blockSignals(True)
+        while self.statement_tabs.count():
+            self.statement_tabs.removeTab(0)
+        for index, statement in enumerate(statements):
+            self.statement_tabs.addTab(f"{index + 1}")
+            self.statement_tabs.setTabToolTip(index, statement)
+        self.statement_tabs.setCurrentIndex(0)
+        self.statement_tabs.blockSignals(False)
+        self.statement_tabs.show()
+        self.result_table_model.setData([], [])
+        self.start_script()
+
+    def start_script(self):
+        script = self.script
+        # Scripts never stream, so no statement keeps a connection checked out once it finished;
+        # the thread pool runs MAX_CONCURRENT_QUERIES of them at a time
+        options = self.explain_options(script.plan_only)
+        for index in range(len(script.statements)):
+            run_id = self.next_run_id
+            self.next_run_id += 1
+            worker = QueryWorker(run_id, self.db, script.statements[index], False,
+                                 self.itersize_input.value(), options, script.plan_only)
+            worker.signals.finished.connect(self.on_statement_finished)
+            worker.signals.error.connect(self.on_statement_error)
+            script.running[run_id] = index
+            self.active_workers[run_id] = worker
+            self.thread_pool.start(worker)
+        self.cancel_btn.setEnabled(True)
+        self.show_script_progress()
+
+    def on_statement_finished(self, run_id, run):
+        self._finish_worker(run_id)
+        if run.result.plan_json:
+            self.plan_history.add(run.query, run.result.plan_json, run.fingerprint)
+        script = self.script
+        index = script.running.pop(run_id, None) if script else None
+        if index is None:
+            return
+        script.runs[index] = run
+        self.statement_tabs.setTabText(index, f"{index + 1}: {run.wall_time * 1000:.0f} ms")
+        if self.statement_tabs.currentIndex() == index:
+            with profiling.activate(run.trace), profiling.span("show results"):
+                self.show_statement(index)
+        self.profiler.add_trace(run.trace)
+        self.statement_done()
+
+    def on_statement_error(self, run_id, message):
+        self._finish_worker(run_id)
+        script = self.script
+        index = script.running.pop(run_id, None) if script else None
+        if index is None:
+            return
+        if message == "Query cancelled":
+            script.cancelled = True
+        else:
+            print(f"Statement {index + 1} error: {message}")
+        script.errors[index] = message
+        self.statement_tabs.setTabText(index, f"{index + 1}: {'cancelled' if script.cancelled else 'failed'}")
+        if self.statement_tabs.currentIndex() == index:
+            self.show_statement(index)
+        self.statement_done()
+
+    def statement_done(self):
+        script = self.script
+        if script.running:
+            self.show_script_progress()
+        else:
+            self.finish_script()
+
+    def finish_script(self):
+        script = self.script
+        script.wall_time = time.perf_counter() - script.started
+        self.show_statement(self.statement_tabs.currentIndex())
+
+    def show_script_progress(self):
+        script = self.script
+        done = sum(run is not None for run in script.runs) + sum(error is not None for error in script.errors)
+        if self.statement_tabs.currentIndex() < 0 or script.runs[self.statement_tabs.currentIndex()] is None:
+            self.statusBar().showMessage(f"Running script: {done} of {len(script.statements)} statements done, "
+                                         f"{len(script.running)} running")
+
+    def script_summary(self):
+        script = self.script
+        runs = [run for run in script.runs if run is not None]
+        statement_time = sum(run.wall_time for run in runs)
+        summary = (f"Script: {len(runs)} of {len(script.statements)} statements in {script.wall_time:.2f} s, "
+                   f"{statement_time:.2f} s of statement time "
+                   f"({statement_time / script.wall_time if script.wall_time else 0:.1f}x concurrency).")
+        failed = sum(error is not None and error != "Query cancelled" for error in script.errors)
+        if failed:
+            summary += f" {failed} failed."
+        if script.cancelled:
+            summary += " Cancelled."
+        return summary
+
+    def show_statement(self, index):
+        script = self.script
+        if script is None or not 0 <= index < len(script.statements):
+            return
+        run = script.runs[index]
+        if run is not None:
+            message = f"Statement {index + 1}: {self.show_run(run)}"
+        else:
+            self.current_qep_root = None
+            self.current_fingerprint = None
+            self.result_table_model.setData([], [])
+            replace_changed_lines(self.pipe_syntax_output, "")
+            self.qep_output.setText("")
+            self.qep_visual.visualize_qep(None)
+            error = script.errors[index]
+            if error == "Query cancelled":
+                message = f"Statement {index + 1} was cancelled."
+            elif error is not None:
+                message = f"Statement {index + 1} failed: {error}"
+            elif script.finished:
+                message = f"Statement {index + 1} did not run."
+            else:
+                message = f"Statement {index + 1} is waiting for earlier statements."
+        if script.finished:
+            message = f"{self.script_summary()} {message}"
+        self.statusBar().showMessage(message)
+
+    def cancel_queries(self):
+        for worker in self.active_workers.values():
+            worker.cancel()
+        if self.script is not None:
+            self.script.cancelled = True
+        self.statusBar().showMessage("Cancelling...")
+
+    def _finish_worker(self, run_id):
+        self.active_workers.pop(run_id, None)
+        self.cancel_btn.setEnabled(bool(self.active_workers))
+        self.update_connection_status()
+
+    def update_connection_status(self):
+        stats = self.db.pool_stats() if self.db else {}
+        if not stats:
+            self.pool_status.setText("")
+            return
+        cache_stats = self.db.plan_cache.stats()
+        self.pool_status.setText(
+            f"Pool: {stats['in_use']}/{stats['open']} in use, {stats['checkouts']} checkouts, "
+            f"{stats['waits']} waits ({stats['wait_time'] * 1000:.1f} ms) | "
+            f"Plan cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} plans"
+        )
+
+    def on_query_progress(self, run_id, message):
+        if len(self.active_workers) > 1:
+            message = f"{message} ({len(self.active_workers)} queries running)"
+        self.statusBar().showMessage(message)
+
+    def on_query_error(self, run_id, message):
+        self._finish_worker(run_id)
+        if message == "Query cancelled":
+            self.statusBar().showMessage(message)
+            return
+        QMessageBox.critical(self, "Query Error", f"Error executing query: {message}")
+        self.statusBar().showMessage("Query execution failed")
+        print(f"Query execution error: {message}")
+
+    def on_query_finished(self, run_id, run):
+        self._finish_worker(run_id)
+        if run.result.plan_json:
+            self.plan_history.add(run.query, run.result.plan_json, run.fingerprint)
+        # Runs may finish out of order; never let an older query replace a newer one
+        if run_id < self.displayed_run_id:
+            if run.result.stream:
+                run.result.stream.close()
+            return
+        self.displayed_run_id = run_id
+        with profiling.activate(run.trace), profiling.span("show results"):
+            message = self.show_run(run)
+        self.statusBar().showMessage(message)
+        self.profiler.add_trace(run.trace)
+
+    def show_run(self, run):
+        """Show a finished run in the result, pipe-syntax, plan and QEP views; returns its status message"""
+        timings = dict(run.timings)
+        result = run.result
+
+        self.current_qep_root = run.qep_root
+        self.current_fingerprint = run.fingerprint
+        with profiling.span("pipe-syntax text"):
+            replace_changed_lines(self.pipe_syntax_output, run.pipe_syntax)
+        with profiling.span("plan text"):
+            self.qep_output.setText(run.original_plan)
+        
+        results = result.rows
+        if run.plan_only:
+            self.result_table_model.setData([], [])
+            message = "Query explained without running it."
+        elif result.stream:
+            self.result_table_model.setData(results, result.headers, result.stream)
+            message = f"Query executed successfully. First {len(results)} rows loaded, more are fetched while scrolling."
+        elif results:
+            self.result_table_model.setData(results, result.headers)
+            message = f"Query executed successfully. {len(results)} rows returned."
+        else:
+            self.result_table_model.setData([], [])
+            message = "Query executed successfully. No results returned."
+        
+        start = time.perf_counter()
+        self.qep_visual.visualize_qep(run.qep_root, run.layout, run.collapsed, run.metrics)
+        timings["draw"] = time.perf_counter() - start
+        self.switch_result_tab(0)
+        if run.plan_only:
+            cache_message = ""
+        elif result.result_cached:
+            cache_message = "Result cache hit."
+        else:
+            cache_message = "Plan cache hit." if result.plan_cached else "Plan cache miss."
+        bottleneck = run.metrics.bottleneck
+        if bottleneck is not None:
+            cache_message += (f" Bottleneck: {bottleneck.label()}"
+                              f" ({run.metrics.self_time[bottleneck]:.1f} ms self).")
+        return " ".join(part for part in (message, cache_message, format_timings(timings)) if part)
     
+    def show_plan_diff(self):
+        records = self.plan_history.plans(fingerprint=self.current_fingerprint) if self.current_fingerprint else []
+        if len(records) < 2:
+            QMessageBox.information(self, "Compare Plans",
+                                    "Run the query at least twice, e.g. before and after adding an index, "
+                                    "to compare its plans.")
+            return
+        PlanDiffDialog(records, self).exec()
+
+    def toggle_live_preview(self, enabled):
+        if enabled:
+            self.switch_result_tab(1)
+            self.start_preview()
+        else:
+            self.preview_timer.stop()
+            self.preview_generation += 1
+
+    def schedule_preview(self):
+        if self.live_preview_checkbox.isChecked():
+            # Restarting the timer on every keystroke converts only once typing pauses
+            self.preview_timer.start()
+
+    def start_preview(self):
+        query = self.query_input.toPlainText().strip()
+        self.preview_generation += 1
+        if not query:
+            return
+        worker = PipePreviewWorker(self.preview_generation, query, lambda: self.preview_generation)
+        worker.signals.finished.connect(self.on_preview_finished)
+        worker.signals.error.connect(self.on_preview_error)
+        self.preview_pool.start(worker)
+
+    def on_preview_finished(self, generation, pipe_syntax):
+        # Results of conversions that were already running when newer text arrived are dropped
+        if generation != self.preview_generation:
+            return
+        replace_changed_lines(self.pipe_syntax_output, pipe_syntax)
+
+    def on_preview_error(self, generation, message):
+        if generation != self.preview_generation:
+            return
+        self.statusBar().showMessage("Preview paused: the query does not parse yet")
+
+    def apply_result_filter(self):
+        self.filter_timer.stop()
+        column = self.result_filter_column.currentIndex() - 1
+        self.result_table_model.set_filter(self.result_filter_input.text(), column if column >= 0 else None)
+
+    def reset_result_filter(self):
+        """Clear the filter and sort controls for a new result, offering its columns to filter on"""
+        self.filter_timer.stop()
+        for widget in (self.result_filter_input, self.result_filter_column):
+            widget.blockSignals(True)
+        self.result_filter_input.clear()
+        self.result_filter_column.clear()
+        self.result_filter_column.addItem("All columns")
+        self.result_filter_column.addItems(self.result_table_model.headers)
+        for widget in (self.result_filter_input, self.result_filter_column):
+            widget.blockSignals(False)
+        self.result_table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+
     def switch_result_tab(self, index):
         # Update tab index
         self.current_result_tab = index
@@ -787,12 +2152,14 @@ class MainWindow(QMainWindow):
         self.btn_qep.setChecked(index == 2)
         
         # Hide all widgets
+        self.result_filter_bar.hide()
         self.result_table.hide()
         self.pipe_syntax_output.hide()
         self.qep_output.hide()
         
         # Show selected widget
         if index == 0:
+            self.result_filter_bar.show()
             self.result_table.show()
         elif index == 1:
             self.pipe_syntax_output.show()
@@ -800,6 +2167,18 @@ class MainWindow(QMainWindow):
             self.qep_output.show()
 
 
+def format_timings(timings):
+    phases = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in timings.items())
+    return f"[{phases}]"
+
+
+def preload_modules():
+    """Import the database driver and SQL parser, which the first connection and
+    conversion need but the window does not"""
+    for name in ("psycopg2.extensions", "sqlglot"):
+        importlib.import_module(name)
+
+
 def execute_conversion():
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
@@ -807,6 +2186,8 @@ def execute_conversion():
     
     window = MainWindow()
     window.show()
+    # Loaded once the window is up instead of before it appears
+    QTimer.singleShot(0, lambda: QThreadPool.globalInstance().start(preload_modules))
     sys.exit(app.exec())
 
 
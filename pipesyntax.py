@@ -1,115 +1,369 @@
+import hashlib
 import re
+from collections import deque
 from typing import List
-import sqlglot
-from sqlglot import parse_one, exp
+import profiling
+from cache import LRUCache
+
+# sqlglot takes a noticeable time to import and plan parsing never needs it,
+# so the functions that do import it themselves
+
+# Pipe-syntax of recently converted queries, keyed by their text
+_pipe_cache = LRUCache(max_entries=512)
+# Rendered clauses keyed by their (structurally hashed) sqlglot expression
+_clause_cache = LRUCache(max_entries=2048)
+# Optional DiskCache beneath _pipe_cache, see use_disk_cache
+_pipe_store = None
+# Part of the stored conversions' keys; bump it whenever tree_to_pipe's output or the key changes
+# (2: keyed by the exact query text, no longer with its whitespace collapsed)
+PIPE_FORMAT_VERSION = 2
 
 class QEPNode:
+    # Plans over heavily partitioned tables reach tens of thousands of nodes,
+    # so nodes carry no instance __dict__
+    __slots__ = ('operation', 'startup_cost', 'total_cost', 'table', 'children', 'properties',
+                 'plan_rows', 'actual_startup_time', 'actual_total_time', 'actual_rows', 'actual_loops')
+
     def __init__(self, operation, startup_cost=None, total_cost=None, table=None):
         self.operation = operation    
         self.startup_cost = startup_cost  
         self.total_cost = total_cost          
         self.table = table           
         self.children = []           
-        self.properties = {
-            'condition': None,       
-            'group_key': None,        
-            'sort_key': None,         
-            'sort_order': None,       
-            'filter': None,           
-            'method': None,           
-        }
-
-def parse_qep(qep):
+        # Only properties that are set are stored: condition, group_key, sort_key,
+        # sort_order, filter, method, strategy, output, parallel, buffers, workers,
+        # workers_planned and workers_launched
+        self.properties = {}
+        self.plan_rows = None
+        self.actual_startup_time = None
+        self.actual_total_time = None
+        self.actual_rows = None
+        self.actual_loops = None
+
+    def label(self):
+        method = self.properties.get('method')
+        return f"{method} {self.operation}" if method else self.operation
+
+def walk_plan(root):
+    """Yield (node, depth, sibling_index) for a plan tree in pre-order.
+
+    Uses an explicit stack, so plans of any depth can be walked.
+    """
+    if root is None:
+        return
+    stack = [(root, 0, 0)]
+    while stack:
+        node, depth, index = stack.pop()
+        yield node, depth, index
+        children = node.children
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((children[i], depth + 1, i))
+
+
+class QEPIndex:
+    """Plan nodes in pre-order, removable by operation keyword in constant time.
+
+    pop(keyword) takes the first remaining node whose operation contains the
+    keyword (case-insensitively), or the first remaining node when none does.
+    """
+    KEYWORDS = ("SCAN", "JOIN", "FILTER", "AGGREGATE", "SORT", "LIMIT")
+
+    def __init__(self, root):
+        self.nodes = []
+        self._by_keyword = {keyword: deque() for keyword in self.KEYWORDS}
+        for node, _, _ in walk_plan(root):
+            index = len(self.nodes)
+            self.nodes.append(node)
+            operation = node.operation.upper()
+            for keyword, queue in self._by_keyword.items():
+                if keyword in operation:
+                    queue.append(index)
+        self._taken = [False] * len(self.nodes)
+        self._first = 0
+        self.remaining = len(self.nodes)
+
+    def pop(self, keyword=None):
+        if not self.remaining:
+            return None
+        if keyword is not None:
+            keyword = keyword.upper()
+            queue = self._by_keyword.get(keyword)
+            if queue is None:
+                queue = deque(i for i, node in enumerate(self.nodes) if keyword in node.operation.upper())
+                self._by_keyword[keyword] = queue
+            # Nodes taken through another keyword or the fallback are skipped lazily
+            while queue:
+                index = queue.popleft()
+                if not self._taken[index]:
+                    return self._take(index)
+        while self._taken[self._first]:
+            self._first += 1
+        return self._take(self._first)
+
+    def _take(self, index):
+        self._taken[index] = True
+        self.remaining -= 1
+        return self.nodes[index]
+
+
+class PlanMetrics:
+    """Where an EXPLAIN ANALYZE plan spent its time.
+
+    total_time and self_time hold each node's wall-clock milliseconds over all
+    of its loops, with and without its children. Under a Gather the loops of a
+    node ran side by side in the workers and the leader, so only the loops of
+    one process count. row_ratio is actual over estimated rows per loop, so
+    above 1 means the planner underestimated. The bottleneck is the node with
+    the most self time and critical_path runs from the root down to it.
+    Nodes that never ran, and plans without actuals, have no entries.
+    """
+    def __init__(self, root):
+        self.total_time = {}
+        self.self_time = {}
+        self.row_ratio = {}
+        self.critical_path = []
+        self.bottleneck = None
+        self.max_self_time = 0.0
+        self.plan_time = 0.0
+
+        parents = {}
+        order = []
+        stack = [(root, 1)] if root is not None else []
+        while stack:
+            node, processes = stack.pop()
+            order.append(node)
+            if node.operation.startswith("Gather"):
+                processes = node.properties.get('workers_launched', 0) + 1
+            for child in node.children:
+                parents[child] = node
+                stack.append((child, processes))
+            loops = node.actual_loops
+            if node.actual_total_time is not None and loops:
+                self.total_time[node] = node.actual_total_time * loops / min(processes, loops)
+                if node.plan_rows is not None and node.actual_rows is not None:
+                    self.row_ratio[node] = max(node.actual_rows, 1.0) / max(node.plan_rows, 1)
+        if not self.total_time:
+            return
+
+        for node in reversed(order):
+            total = self.total_time.get(node)
+            if total is None:
+                continue
+            children_time = sum(self.total_time.get(child, 0.0) for child in node.children)
+            self_time = max(total - children_time, 0.0)
+            self.self_time[node] = self_time
+            if self.bottleneck is None or self_time > self.max_self_time:
+                self.bottleneck = node
+                self.max_self_time = self_time
+        self.plan_time = self.total_time.get(root, 0.0)
+        node = self.bottleneck
+        while node is not None:
+            self.critical_path.append(node)
+            node = parents.get(node)
+        self.critical_path.reverse()
+
+    def heat(self, node):
+        """Self time of node as a fraction of the bottleneck's, or None if it never ran"""
+        self_time = self.self_time.get(node)
+        if self_time is None:
+            return None
+        return self_time / self.max_self_time if self.max_self_time else 0.0
+
+
+# One pattern tokenizes every line of a text-format plan: a plan boundary
+# (psql's header or an auto_explain log prefix), a "Key: value" detail line,
+# or a plan node with its optional estimates and EXPLAIN ANALYZE actuals
+_TEXT_PLAN_LINE = re.compile(r"""
+    ^(?P<indent>[ \t]*)
+    (?:
+        (?P<header>QUERY\ PLAN)\s*$
+      | (?!->)(?P<key>[A-Z][\w -]*):(?:\s+(?P<value>.*\S))?\s*$
+      | (?P<label>(?:SubPlan|InitPlan)\ \d+.*|CTE\ (?!Scan\b)\S+)\s*$
+      | (?P<arrow>->\s+)?
+        (?P<operation>[A-Z][A-Za-z]*(?:[ -][A-Z][A-Za-z]*)*)
+        (?:\ using\ (?P<index>\S+))?
+        (?:\ on\ (?P<relation>\S+)(?:\ (?P<alias>\S+))?)?
+        (?:\s+\(cost=(?P<startup_cost>[\d.]+)\.\.(?P<total_cost>[\d.]+)\ rows=(?P<plan_rows>\d+)\ width=\d+\))?
+        (?:\s+\((?:actual(?:\ time=(?P<actual_startup_time>[\d.]+)\.\.(?P<actual_total_time>[\d.]+))?
+                  \ rows=(?P<actual_rows>[\d.]+)\ loops=(?P<actual_loops>\d+)
+               |(?P<never>never\ executed))\))?
+        \s*$
+      | (?P<boundary>.*\bplan:)\s*$
+    )""", re.VERBOSE)
+_BUFFER_COUNTS = re.compile(r"(?:(shared|local|temp) )?([a-z]+)=(\d+)")
+_WORKER_ACTUALS = re.compile(r"actual(?: time=([\d.]+)\.\.([\d.]+))? rows=([\d.]+) loops=(\d+)")
+# Plans end with these sections; their detail lines do not belong to any node
+_PLAN_TRAILERS = frozenset(("Planning", "Planning Time", "Execution Time", "JIT", "Trigger", "Settings"))
+
+def _text_plan_node(match):
+    operation = match['operation']
+    node = QEPNode(operation)
+    if match['startup_cost'] is not None:
+        node.startup_cost = float(match['startup_cost'])
+        node.total_cost = float(match['total_cost'])
+        node.plan_rows = int(match['plan_rows'])
+    if match['actual_rows'] is not None:
+        if match['actual_startup_time'] is not None:
+            node.actual_startup_time = float(match['actual_startup_time'])
+            node.actual_total_time = float(match['actual_total_time'])
+        node.actual_rows = float(match['actual_rows'])
+        node.actual_loops = int(match['actual_loops'])
+    elif match['never'] is not None:
+        node.actual_loops = 0
+
+    if operation.startswith("Parallel "):
+        node.properties['parallel'] = True
+    if "Scan" in operation:
+        if match['relation'] is not None:
+            node.table = match['relation'].rpartition('.')[2]
+            node.operation = "SCAN"
+            if "Index" in operation:
+                node.properties['method'] = "INDEX"
+            elif "Seq" in operation:
+                node.properties['method'] = "SEQUENTIAL"
+    elif "Join" in operation:
+        node.operation = "JOIN"
+        if "Hash" in operation:
+            node.properties['method'] = "HASH"
+        elif "Merge" in operation:
+            node.properties['method'] = "MERGE"
+        elif "Nested" in operation:
+            node.properties['method'] = "NESTED LOOP"
+    elif "Aggregate" in operation:
+        node.operation = "AGGREGATE"
+        if operation.startswith("Partial"):
+            node.properties['method'] = "PARTIAL"
+        elif operation.startswith("Finalize"):
+            node.properties['method'] = "FINAL"
+    return node
+
+def _add_buffers(target, value):
+    buffers = target.setdefault('buffers', {})
+    kind = ""
+    for prefix, name, number in _BUFFER_COUNTS.findall(value):
+        kind = prefix or kind
+        key = f"{kind} {name}"
+        buffers[key] = buffers.get(key, 0) + int(number)
+
+def _add_text_plan_detail(node, key, value):
+    """Store a detail line on its node; returns the worker's dict for "Worker N" lines"""
+    properties = node.properties
+    if key == "Sort Key":
+        properties['sort_key'] = value
+        properties['sort_order'] = "DESC" if "DESC" in value else "ASC"
+    elif key == "Group Key":
+        properties['group_key'] = value
+    elif key in ("Hash Cond", "Merge Cond", "Join Filter"):
+        properties.setdefault('condition', value)
+    elif key == "Filter":
+        properties['filter'] = value
+    elif key == "Buffers":
+        _add_buffers(properties, value)
+    elif key == "Workers Planned":
+        properties['workers_planned'] = int(value)
+    elif key == "Workers Launched":
+        properties['workers_launched'] = int(value)
+    elif key.startswith("Worker "):
+        worker = properties.setdefault('workers', {}).setdefault(int(key[7:]), {})
+        actuals = _WORKER_ACTUALS.match(value)
+        if actuals:
+            if actuals.group(1) is not None:
+                worker['actual_startup_time'] = float(actuals.group(1))
+                worker['actual_total_time'] = float(actuals.group(2))
+            worker['actual_rows'] = float(actuals.group(3))
+            worker['actual_loops'] = int(actuals.group(4))
+        else:
+            worker.setdefault('details', []).append(value)
+        return worker
+    return None
+
+def iter_text_plans(lines):
+    """Parse text-format plans from a string or an iterable of lines (e.g. an open
+    auto_explain log) and yield the root QEPNode of each plan as it completes.
+
+    Each line is tokenized once and only the plan being read is kept in memory.
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
     root = None
-    nodes_stack = []
-    qep = "\n-> " + qep
-    
-    for line in qep.split('\n'):
-        if "->" not in line:
-            if "Sort Key:" in line:
-                if nodes_stack:
-                    sort_info = re.search(r'Sort Key: (.+)', line)
-                    if sort_info:
-                        current = nodes_stack[-1][1]
-                        current.properties['sort_key'] = sort_info.group(1)
-                        if "DESC" in line:
-                            current.properties['sort_order'] = "DESC"
-                        else:
-                            current.properties['sort_order'] = "ASC"
-            elif "Group Key:" in line:
-                if nodes_stack:
-                    group_info = re.search(r'Group Key: (.+)', line)
-                    if group_info:
-                        nodes_stack[-1][1].properties['group_key'] = group_info.group(1)
-            elif "Hash Cond:" in line:
-                if nodes_stack:
-                    cond_info = re.search(r'Hash Cond: (.+)', line)
-                    if cond_info:
-                        nodes_stack[-1][1].properties['condition'] = cond_info.group(1)
-            elif "Filter:" in line:
-                if "Rows Removed by Filter:" in line:
+    stack = []
+    in_query_text = False
+    in_trailer = False
+    worker, worker_indent = None, 0
+    for line in lines:
+        match = _TEXT_PLAN_LINE.match(line)
+        if match is None:
+            continue
+        if match['boundary'] is not None or match['header'] is not None:
+            if root is not None:
+                yield root
+            root, stack, in_query_text, in_trailer = None, [], False, False
+            continue
+
+        key = match['key']
+        if key is not None:
+            if key == "Query Text":
+                in_query_text = True
+            elif key in _PLAN_TRAILERS:
+                in_trailer = True
+            elif stack and not in_query_text and not in_trailer:
+                indent = len(match['indent'])
+                if worker is not None and indent > worker_indent:
+                    # Lines nested under "Worker N:" describe that worker alone
+                    if key == "Buffers":
+                        _add_buffers(worker, match['value'] or "")
                     continue
-                if nodes_stack:
-                    filter_info = re.search(r'Filter: (.+)', line)
-                    if filter_info:
-                        nodes_stack[-1][1].properties['filter'] = filter_info.group(1)
+                worker = _add_text_plan_detail(stack[-1][1], key, match['value'] or "")
+                worker_indent = indent
             continue
-        
-        if any(op in line for op in [
-            'Partial', 
-            'Finalize',
-            'Gather',
-            'Worker'
-        ]):
+
+        if match['label'] is not None:
+            # "SubPlan 1", "InitPlan 1 (returns $1)" or "CTE name" sits at the indent of
+            # its owner's children, so the arrow nodes below it belong to that owner
+            if stack and not in_query_text and not in_trailer:
+                indent = len(match['indent'])
+                while len(stack) > 1 and stack[-1][0] >= indent:
+                    stack.pop()
+                worker = None
             continue
-        
-        indent = len(line) - len(line.lstrip())
-        cost_match = re.search(r'\(cost=(\d+\.\d+)\.\.(\d+\.\d+)', line)
-        cost = f"{cost_match.group(1)}..{cost_match.group(2)}" if cost_match else None
-        
-        op_match = re.search(r'->\s+([A-Za-z ]+)', line)
-        if not op_match:
+
+        arrow = match['arrow'] is not None
+        if not arrow:
+            # A query's own lines can follow "Query Text:" in an auto_explain log
+            if in_query_text and match['startup_cost'] is None:
+                continue
+        in_query_text = False
+        worker = None
+        node = _text_plan_node(match)
+        indent = len(match['indent'])
+        if not arrow:
+            # Only a plan's root has no arrow, so this starts the next plan
+            if root is not None:
+                yield root
+            root, stack, in_trailer = node, [(indent, node)], False
             continue
-            
-        operation = op_match.group(1).strip()
-        node = QEPNode(operation, cost)
-        
-        if "Scan" in operation:
-            table_match = re.search(r'on\s+(\w+)', line)
-            if table_match:
-                node.table = table_match.group(1)
-                node.operation = "SCAN"
-                if "Index" in operation:
-                    node.properties['method'] = "INDEX"
-                elif "Seq" in operation:
-                    node.properties['method'] = "SEQUENTIAL"
-
-        elif "Join" in operation:
-            node.operation = "JOIN"
-            if "Hash" in operation:
-                node.properties['method'] = "HASH"
-            elif "Merge" in operation:
-                node.properties['method'] = "MERGE"
-            elif "Nested" in operation:
-                node.properties['method'] = "NESTED LOOP"
-        elif "Aggregate" in operation:
-            node.operation = "AGGREGATE"
-            if "Partial" in operation:
-                node.properties['method'] = "PARTIAL"
-            elif "Final" in operation:
-                node.properties['method'] = "FINAL"
+        if not stack or in_trailer:
+            continue
+        while len(stack) > 1 and stack[-1][0] >= indent:
+            stack.pop()
+        stack[-1][1].children.append(node)
+        stack.append((indent, node))
+    if root is not None:
+        yield root
+
+@profiling.traced("parse text plan")
+def parse_qep(qep):
+    """Parse a text-format plan, given as a string or an iterable of lines, and
+    return its root QEPNode (the first plan's, if there are several)"""
+    for root in iter_text_plans(qep):
+        return root
+    return None
 
-        while nodes_stack and nodes_stack[-1][0] >= indent:
-            nodes_stack.pop()
-            
-        if nodes_stack:
-            nodes_stack[-1][1].children.append(node)
-        else:
-            root = node
-        nodes_stack.append((indent, node))
-    
-    return root
+_JSON_BUFFER_COUNTS = tuple((f"{kind.capitalize()} {name.capitalize()} Blocks", f"{kind} {name}")
+                            for kind in ("shared", "local", "temp")
+                            for name in ("hit", "read", "dirtied", "written"))
 
+@profiling.traced("parse plan")
 def parse_qep_json(qep_json):
     """Parse JSON format query execution plan"""
     def process_node(plan_dict):
@@ -121,16 +375,24 @@ def parse_qep_json(qep_json):
         if startup_cost is not None and total_cost is not None:
             node.startup_cost = startup_cost
             node.total_cost = total_cost
+        node.plan_rows = plan_dict.get('Plan Rows')
+        node.actual_startup_time = plan_dict.get('Actual Startup Time')
+        node.actual_total_time = plan_dict.get('Actual Total Time')
+        node.actual_rows = plan_dict.get('Actual Rows')
+        node.actual_loops = plan_dict.get('Actual Loops')
+        if plan_dict.get('Parallel Aware'):
+            node.properties['parallel'] = True
+        if 'Workers Planned' in plan_dict:
+            node.properties['workers_planned'] = plan_dict['Workers Planned']
+        if 'Workers Launched' in plan_dict:
+            node.properties['workers_launched'] = plan_dict['Workers Launched']
+        # Zero counters are left out, as EXPLAIN's text format leaves them out
+        buffers = {key: plan_dict[name] for name, key in _JSON_BUFFER_COUNTS if plan_dict.get(name)}
+        if buffers:
+            node.properties['buffers'] = buffers
         
         if 'Filter' in plan_dict:
             node.properties['filter'] = plan_dict['Filter']
-
-        if 'Plans' in plan_dict:
-            for child_plan in plan_dict['Plans']:
-                child_node = process_node(child_plan)
-                if child_node:
-                    node.children.append(child_node)
-
         
         if 'Scan' in node_type:
             node.table = plan_dict.get('Relation Name')
@@ -176,37 +438,247 @@ def parse_qep_json(qep_json):
     if not qep_json or not isinstance(qep_json, list) or not qep_json[0].get('Plan'):
         return None
     
-    return process_node(qep_json[0]['Plan'])
+    # Children are attached from an explicit stack so deep plans cannot hit the recursion limit
+    root_plan = qep_json[0]['Plan']
+    root = process_node(root_plan)
+    stack = [(root_plan, root)]
+    while stack:
+        plan_dict, node = stack.pop()
+        for child_plan in plan_dict.get('Plans', ()):
+            child_node = process_node(child_plan)
+            node.children.append(child_node)
+            stack.append((child_plan, child_node))
+    return root
 
-def sql_to_pipe(query: str, qep_root=None, is_subquery=False) -> str:
-    tree = parse_one(query)
-    lines = []
-    qep_nodes = []
+@profiling.traced("format text plan")
+def format_plan_text(qep_json):
+    """Render an EXPLAIN (FORMAT JSON) plan in PostgreSQL's text layout"""
+    if not qep_json or not isinstance(qep_json, list) or not qep_json[0].get('Plan'):
+        return ""
 
-    def flatten_qep(node):
-        if not node:
-            return []
-        nodes = [node]
-        for child in node.children:
-            nodes.extend(flatten_qep(child))
-        return nodes
+    lines = []
 
-    if qep_root:
-        qep_nodes = flatten_qep(qep_root)
+    def node_title(plan):
+        node_type = plan.get('Node Type', '')
+        title = node_type
+        if node_type == 'Aggregate':
+            title = {
+                'Hashed': 'HashAggregate',
+                'Sorted': 'GroupAggregate',
+                'Mixed': 'MixedAggregate',
+            }.get(plan.get('Strategy'), 'Aggregate')
+        if plan.get('Partial Mode') in ('Partial', 'Finalize'):
+            title = f"{plan['Partial Mode']} {title}"
+        if plan.get('Parallel Aware'):
+            title = f"Parallel {title}"
+        join_type = plan.get('Join Type')
+        if join_type and join_type != 'Inner':
+            if node_type.endswith(' Join'):
+                title = f"{node_type[:-len(' Join')]} {join_type} Join"
+            else:
+                title = f"{title} {join_type} Join"
+        if plan.get('Index Name'):
+            title += f" using {plan['Index Name']}"
+        relation = plan.get('Relation Name') or plan.get('CTE Name') or plan.get('Function Name')
+        alias = plan.get('Alias')
+        if relation:
+            title += f" on {relation}"
+            if alias and alias != relation:
+                title += f" {alias}"
+        elif alias:
+            title += f" on {alias}"
+
+        if plan.get('Startup Cost') is not None and plan.get('Total Cost') is not None:
+            title += (f"  (cost={plan['Startup Cost']:.2f}..{plan['Total Cost']:.2f}"
+                      f" rows={plan.get('Plan Rows', 0):.0f} width={plan.get('Plan Width', 0)})")
+        if plan.get('Actual Loops') == 0:
+            title += " (never executed)"
+        elif plan.get('Actual Total Time') is not None:
+            title += (f" (actual time={plan['Actual Startup Time']:.3f}..{plan['Actual Total Time']:.3f}"
+                      f" rows={plan['Actual Rows']:.0f} loops={plan['Actual Loops']:.0f})")
+        elif plan.get('Actual Rows') is not None:
+            title += f" (actual rows={plan['Actual Rows']:.0f} loops={plan['Actual Loops']:.0f})"
+        return title
+
+    def node_details(plan):
+        details = []
+        for key in ('Sort Key', 'Group Key', 'Hash Cond', 'Merge Cond', 'Index Cond',
+                    'Recheck Cond', 'Join Filter', 'Filter', 'One-Time Filter'):
+            value = plan.get(key)
+            if value is None:
+                continue
+            if isinstance(value, list):
+                value = ", ".join(value)
+            details.append(f"{key}: {value}")
+            removed = plan.get(f"Rows Removed by {key}")
+            if removed is not None:
+                details.append(f"Rows Removed by {key}: {removed:.0f}")
+        if plan.get('Sort Method'):
+            details.append(f"Sort Method: {plan['Sort Method']}  "
+                           f"{plan.get('Sort Space Type', 'Memory')}: {plan.get('Sort Space Used', 0)}kB")
+        if plan.get('Workers Planned') is not None:
+            details.append(f"Workers Planned: {plan['Workers Planned']}")
+        if plan.get('Workers Launched') is not None:
+            details.append(f"Workers Launched: {plan['Workers Launched']}")
+        buffers = []
+        for label, key in (('hit', 'Shared Hit Blocks'), ('read', 'Shared Read Blocks'),
+                           ('dirtied', 'Shared Dirtied Blocks'), ('written', 'Shared Written Blocks')):
+            if plan.get(key):
+                buffers.append(f"{label}={plan[key]}")
+        if buffers:
+            details.append("Buffers: shared " + " ".join(buffers))
+        return details
+
+    stack = [(qep_json[0]['Plan'], 0)]
+    while stack:
+        plan, depth = stack.pop()
+        if depth == 0:
+            title_indent, detail_indent = "", "  "
+        else:
+            title_indent, detail_indent = " " * (6 * depth - 4) + "->  ", " " * (6 * depth + 2)
+        if plan.get('Subplan Name'):
+            lines.append(" " * (6 * depth - 4 if depth else 0) + plan['Subplan Name'])
+        lines.append(title_indent + node_title(plan))
+        for detail in node_details(plan):
+            lines.append(detail_indent + detail)
+        for child in reversed(plan.get('Plans', [])):
+            stack.append((child, depth + 1))
+
+    if qep_json[0].get('Planning Time') is not None:
+        lines.append(f"Planning Time: {qep_json[0]['Planning Time']:.3f} ms")
+    if qep_json[0].get('Execution Time') is not None:
+        lines.append(f"Execution Time: {qep_json[0]['Execution Time']:.3f} ms")
+    return "\n".join(lines)
+
+def split_statements(script: str) -> List[str]:
+    """The statements of a script, each in its original text without the semicolon.
+
+    The script is split between sqlglot's (PostgreSQL) tokens, so semicolons in
+    strings, quoted identifiers, dollar-quoted bodies and comments do not end a
+    statement. A script sqlglot cannot tokenize is returned as one statement.
+    """
+    from sqlglot.dialects.dialect import Dialect
+    from sqlglot.errors import TokenError
+    from sqlglot.tokens import TokenType
+    try:
+        tokens = Dialect.get_or_raise("postgres").tokenize(script)
+    except TokenError:
+        statement = script.strip().rstrip(';').strip()
+        return [statement] if statement else []
+    statements = []
+    first = last = None
+    for token in tokens:
+        if token.token_type == TokenType.SEMICOLON:
+            if first is not None:
+                statements.append(script[first.start:last.end + 1])
+            first = None
+            continue
+        if first is None:
+            first = token
+        last = token
+    if first is not None:
+        statements.append(script[first.start:last.end + 1])
+    return statements
+
+def normalize_sql(query: str, whitespace=True, case=True, literals=False) -> str:
+    """Canonical text of a query, so the same query written differently compares equal.
+
+    Normalizing regenerates the SQL from its (PostgreSQL) sqlglot tree, which
+    normalizes whitespace outside literals as a side effect. A query that is
+    not a single statement sqlglot can parse is kept as written, bar the
+    whitespace around it: inside, whitespace may belong to a literal.
+    """
+    query = query.strip()
+    if whitespace or case or literals:
+        from sqlglot import parse, exp
+        from sqlglot.errors import SqlglotError
+        try:
+            trees = [tree for tree in parse(query, read="postgres") if tree is not None]
+        except SqlglotError:
+            trees = []
+        if len(trees) == 1:
+            tree = trees[0]
+            if literals:
+                tree = tree.transform(lambda node: exp.Placeholder() if isinstance(node, exp.Literal) else node)
+            return tree.sql(dialect="postgres", normalize=case)
+    return query
+
+def fingerprint_sql(query: str, whitespace=True, case=True, literals=False) -> str:
+    canonical = normalize_sql(query, whitespace, case, literals)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+def plan_relations(qep_json):
+    """Names of all relations an EXPLAIN (FORMAT JSON) plan reads"""
+    relations = set()
+    if not qep_json or not isinstance(qep_json, list) or not qep_json[0].get('Plan'):
+        return relations
+    stack = [qep_json[0]['Plan']]
+    while stack:
+        plan = stack.pop()
+        if plan.get('Relation Name'):
+            relations.add(plan['Relation Name'])
+        stack.extend(plan.get('Plans', []))
+    return relations
+
+@profiling.traced("sql_to_pipe")
+def sql_to_pipe(query, qep_root=None) -> str:
+    """Convert SQL text or an already-parsed sqlglot expression to pipe-syntax.
+
+    Conversions without a plan do not depend on anything but the query, so
+    their output is memoized by the query text, and also on disk once
+    use_disk_cache was given a store. Only the whitespace around the query is
+    ignored: inside it, whitespace may belong to a string literal or a quoted
+    identifier.
+    """
+    if not isinstance(query, str):
+        return tree_to_pipe(query, qep_root)
+    from sqlglot import parse_one
+    if qep_root is not None:
+        return tree_to_pipe(parse_one(query), qep_root)
+    key = query.strip()
+    pipe_syntax = _pipe_cache.get(key)
+    if pipe_syntax is None:
+        store = _pipe_store
+        if store is not None:
+            pipe_syntax = store.get("pipe", (PIPE_FORMAT_VERSION, key))
+        if pipe_syntax is None:
+            pipe_syntax = tree_to_pipe(parse_one(query))
+            if store is not None:
+                store.put("pipe", (PIPE_FORMAT_VERSION, key), pipe_syntax)
+        _pipe_cache.put(key, pipe_syntax)
+    return pipe_syntax
+
+def use_disk_cache(store):
+    """Keep plan-less conversions in store (a DiskCache, or None for memory only) across sessions"""
+    global _pipe_store
+    _pipe_store = store
+
+@profiling.traced("tree_to_pipe")
+def tree_to_pipe(tree, qep_root=None) -> str:
+    from sqlglot import exp
+    lines = []
+    qep_index = QEPIndex(qep_root) if qep_root else None
+    metrics = PlanMetrics(qep_root) if qep_root else None
 
     def pop_qep_node(operation_type=None):
-        if not qep_nodes:
+        if qep_index is None:
             return None
-        if operation_type is None:
-            return qep_nodes.pop(0)
-        for i, node in enumerate(qep_nodes):
-            if operation_type.upper() in node.operation.upper():
-                return qep_nodes.pop(i)
-        return qep_nodes.pop(0) 
+        return qep_index.pop(operation_type)
 
     def cost_comment(node):
         if node and node.startup_cost is not None and node.total_cost is not None:
-            return f"  -- cost={node.startup_cost:.2f}..{node.total_cost:.2f}"
+            comment = f"  -- cost={node.startup_cost:.2f}..{node.total_cost:.2f}"
+            if node.actual_loops == 0:
+                comment += " never executed"
+            elif node.actual_rows is not None:
+                comment += f" rows={node.actual_rows:g}"
+                if node.plan_rows is not None:
+                    comment += f" (est. {node.plan_rows:g})"
+                if node in metrics.self_time:
+                    comment += f" time={metrics.total_time[node]:.3f} ms self={metrics.self_time[node]:.3f} ms"
+                if node.actual_loops > 1:
+                    comment += f" loops={node.actual_loops}"
+            return comment
         return ""
 
 
@@ -215,7 +687,7 @@ def sql_to_pipe(query: str, qep_root=None, is_subquery=False) -> str:
             node = pop_qep_node("Scan")
             table_expr = expr.this
             if isinstance(table_expr, exp.Subquery):
-                return sql_to_pipe(table_expr.unnest().sql(), qep_root=None, is_subquery=True)
+                return tree_to_pipe(table_expr.unnest())
             return f"FROM {table_expr.sql()}{cost_comment(node)}"
 
 
@@ -232,7 +704,7 @@ def sql_to_pipe(query: str, qep_root=None, is_subquery=False) -> str:
             node = pop_qep_node("Join")
 
             if isinstance(table_expr, exp.Subquery):
-                sub_lines = sql_to_pipe(table_expr.unnest().sql(), qep_root=None, is_subquery=True).splitlines()
+                sub_lines = tree_to_pipe(table_expr.unnest()).splitlines()
                 return "\n".join(sub_lines + [f"|> {join_type} JOIN subplan{condition}{cost_comment(node)}"])
             else:
                 return f"|> {join_type} JOIN {table_expr.sql()}{condition}{cost_comment(node)}"
@@ -260,34 +732,45 @@ def sql_to_pipe(query: str, qep_root=None, is_subquery=False) -> str:
 
         return None
 
+    def render(expr):
+        # Without a plan a clause renders the same wherever it appears, so unchanged
+        # clauses of an edited query are reused instead of generated again
+        if qep_root is not None:
+            return extract(expr)
+        line = _clause_cache.get(expr)
+        if line is None:
+            line = extract(expr)
+            _clause_cache.put(expr, line)
+        return line
+
     if isinstance(tree, exp.Select):
         if tree.args.get("from"):
-            from_clause = extract(tree.args["from"])
+            from_clause = render(tree.args["from"])
             if from_clause:
                 lines.append(from_clause)
 
         joins = tree.args.get("joins") or []
         for join in joins:
-            join_clause = extract(join)
+            join_clause = render(join)
             if join_clause:
                 lines.append(join_clause)
 
         if tree.args.get("where"):
-            lines.append(extract(tree.args["where"]))
+            lines.append(render(tree.args["where"]))
 
         if tree.args.get("group"):
             group = tree.args["group"]
-            lines.append(extract(group))
+            lines.append(render(group))
         else:
             lines.append(f"|> SELECT {', '.join([e.sql() for e in tree.expressions])}")
 
         if tree.args.get("having"):
-            lines.append(extract(tree.args["having"]))
+            lines.append(render(tree.args["having"]))
 
         if tree.args.get("order"):
-            lines.append(extract(tree.args["order"]))
+            lines.append(render(tree.args["order"]))
 
         if tree.args.get("limit"):
-            lines.append(extract(tree.args["limit"]))
+            lines.append(render(tree.args["limit"]))
 
     return "\n".join(lines)
\ No newline at end of file
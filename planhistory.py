@@ -0,0 +1,319 @@
+"""Plans of earlier runs of a query, and structural diffs between two plans.
+
+A PlanHistory keeps recent plans per query fingerprint, so a query run before
+and after adding an index or changing a setting can be compared. PlanDiff
+walks two plan trees together, skipping every pair of subtrees whose Merkle
+hashes match, and reports changed operators and cost or time changes.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import pipesyntax
+from cache import LRUCache
+
+# Cost and actual time changes smaller than this fraction are not reported
+CHANGE_THRESHOLD = 0.1
+# and actual time changes smaller than this many milliseconds are timing noise
+MIN_TIME_CHANGE_MS = 0.1
+# Change kinds in the order a node's highlight is chosen by
+STRUCTURAL_CHANGES = ("added", "removed", "join method", "scan type", "operation", "relation")
+
+
+class PlanRecord:
+    """One recorded plan of a query; the QEPNode tree is parsed on first use"""
+    __slots__ = ('id', 'fingerprint', 'query', 'plan_json', 'recorded_at', '_root')
+
+    def __init__(self, fingerprint, query, plan_json, recorded_at=None, id=None):
+        self.id = id
+        self.fingerprint = fingerprint
+        self.query = query
+        self.plan_json = plan_json
+        self.recorded_at = time.time() if recorded_at is None else recorded_at
+        self._root = None
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = pipesyntax.parse_qep_json(self.plan_json)
+        return self._root
+
+    def label(self):
+        label = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.recorded_at))
+        if self.root is not None and self.root.total_cost is not None:
+            label += f"  cost={self.root.total_cost:.2f}"
+        execution_time = self.plan_json[0].get("Execution Time") if self.plan_json else None
+        if execution_time is not None:
+            label += f"  {execution_time:.1f} ms"
+        return label
+
+
+class PlanHistory:
+    """Recorded plans by query fingerprint, oldest first.
+
+    At most max_plans plans are kept per query, and the plans of max_queries
+    queries in memory, least recently used out first. With a path every plan
+    is also written to a SQLite database there, and queries no longer (or not
+    yet) in memory are read back from it. Safe to use from any thread.
+    """
+    def __init__(self, path=None, max_plans=20, max_queries=256):
+        self.max_plans = max_plans
+        self._queries = LRUCache(max_entries=max_queries)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS plan_history (id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL, "
+                "query TEXT NOT NULL, plan TEXT NOT NULL, recorded_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS plan_history_fingerprint ON plan_history (fingerprint, id)")
+            self._db.commit()
+
+    def add(self, query, plan_json, fingerprint=None):
+        """Record a plan of query and return its PlanRecord"""
+        if fingerprint is None:
+            fingerprint = pipesyntax.fingerprint_sql(query)
+        record = PlanRecord(fingerprint, query, plan_json)
+        with self._lock:
+            plans = self._load(fingerprint)
+            plans.append(record)
+            if self._db is not None:
+                cursor = self._db.execute(
+                    "INSERT INTO plan_history (fingerprint, query, plan, recorded_at) VALUES (?, ?, ?, ?)",
+                    (fingerprint, query, json.dumps(plan_json), record.recorded_at))
+                record.id = cursor.lastrowid
+                self._db.execute(
+                    "DELETE FROM plan_history WHERE fingerprint = ? AND id NOT IN "
+                    "(SELECT id FROM plan_history WHERE fingerprint = ? ORDER BY id DESC LIMIT ?)",
+                    (fingerprint, fingerprint, self.max_plans))
+                self._db.commit()
+        return record
+
+    def plans(self, query=None, fingerprint=None):
+        """The recorded plans of a query, given as text or by fingerprint, oldest first"""
+        if fingerprint is None:
+            fingerprint = pipesyntax.fingerprint_sql(query)
+        with self._lock:
+            return list(self._load(fingerprint))
+
+    def clear(self):
+        with self._lock:
+            self._queries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM plan_history")
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _load(self, fingerprint):
+        plans = self._queries.get(fingerprint)
+        if plans is None:
+            plans = deque(maxlen=self.max_plans)
+            if self._db is not None:
+                rows = self._db.execute(
+                    "SELECT id, query, plan, recorded_at FROM plan_history WHERE fingerprint = ? "
+                    "ORDER BY id DESC LIMIT ?", (fingerprint, self.max_plans)).fetchall()
+                for id, query, plan, recorded_at in reversed(rows):
+                    plans.append(PlanRecord(fingerprint, query, json.loads(plan), recorded_at, id))
+            self._queries.put(fingerprint, plans)
+        return plans
+
+
+def plan_hashes(root):
+    """Merkle hashes of every subtree of a plan, as two {node: hash} dicts.
+
+    The shape hash covers operators, methods and relations; the value hash
+    also covers costs, row counts and actual times. Subtrees with equal
+    hashes are taken to be equal, so a diff need not look inside them.
+    """
+    shape = {}
+    values = {}
+    stack = [(root, False)] if root is not None else []
+    while stack:
+        node, children_done = stack.pop()
+        if not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+            continue
+        shape[node] = hash((_operator(node), tuple(shape[child] for child in node.children)))
+        values[node] = hash((shape[node], node.startup_cost, node.total_cost, node.plan_rows,
+                             node.actual_total_time, node.actual_rows, node.actual_loops,
+                             tuple(values[child] for child in node.children)))
+    return shape, values
+
+
+class PlanChange:
+    """One difference between two plans; before or after is None for an added or removed subtree"""
+    __slots__ = ('kind', 'before', 'after', 'detail', 'worse')
+
+    def __init__(self, kind, before, after, detail, worse=False):
+        self.kind = kind
+        self.before = before
+        self.after = after
+        self.detail = detail
+        self.worse = worse
+
+    def __str__(self):
+        return f"{self.kind.capitalize()}: {self.detail}"
+
+
+class PlanDiff:
+    """Structural diff of two plan trees.
+
+    changes lists PlanChange entries in plan order. before and after map each
+    node that differs, in the respective tree, to how it is highlighted:
+    "added", "removed", "changed" for a different operator, or "worse" and
+    "better" for cost or actual time changes of at least threshold.
+    """
+    def __init__(self, before_root, after_root, threshold=CHANGE_THRESHOLD):
+        self.threshold = threshold
+        self.changes = []
+        self.before = {}
+        self.after = {}
+        before_shape, before_values = plan_hashes(before_root)
+        after_shape, after_values = plan_hashes(after_root)
+
+        stack = [(before_root, after_root)]
+        while stack:
+            before, after = stack.pop()
+            if before is None and after is None:
+                continue
+            if before is None or after is None:
+                self._subtree_change(before, after)
+                continue
+            if before_values[before] == after_values[after]:
+                continue
+            if not _same_operator(before, after):
+                # A single node such as a Sort or Materialize put above, or taken
+                # from above, an operator that is otherwise unchanged
+                if len(after.children) == 1 and _same_operator(before, after.children[0]):
+                    self._node_change("added", None, after)
+                    stack.append((before, after.children[0]))
+                    continue
+                if len(before.children) == 1 and _same_operator(before.children[0], after):
+                    self._node_change("removed", before, None)
+                    stack.append((before.children[0], after))
+                    continue
+            self._compare(before, after)
+            if before_shape[before] == after_shape[after]:
+                pairs = list(zip(before.children, after.children))
+            else:
+                pairs = _match_children(before.children, after.children, before_shape, after_shape)
+            stack.extend(reversed(pairs))
+
+    @property
+    def identical(self):
+        return not self.changes
+
+    def _subtree_change(self, before, after):
+        if before is not None:
+            self.changes.append(PlanChange("removed", before, None, _describe(before)))
+            for node, _, _ in pipesyntax.walk_plan(before):
+                self.before[node] = "removed"
+        else:
+            self.changes.append(PlanChange("added", None, after, _describe(after)))
+            for node, _, _ in pipesyntax.walk_plan(after):
+                self.after[node] = "added"
+
+    def _node_change(self, kind, before, after):
+        node = before or after
+        detail = f"{_describe(node)} above {_describe(node.children[0])}"
+        self.changes.append(PlanChange(kind, before, after, detail))
+        if before is not None:
+            self.before[before] = kind
+        else:
+            self.after[after] = kind
+
+    def _compare(self, before, after):
+        changes = []
+        if _operator(before)[::2] != _operator(after)[::2]:
+            if "JOIN" in before.label().upper() and "JOIN" in after.label().upper() or (
+                    "Nested Loop" in (before.operation, after.operation)):
+                kind = "join method"
+            elif before.table is not None and before.table == after.table:
+                kind = "scan type"
+            else:
+                kind = "operation"
+            changes.append(PlanChange(kind, before, after, f"{_describe(before)} -> {_describe(after)}"))
+        elif before.table != after.table:
+            changes.append(PlanChange("relation", before, after, f"{_describe(before)} -> {_describe(after)}"))
+        # Costs and times of different operators are not comparable
+        comparable = () if changes else (("cost", before.total_cost, after.total_cost, ""),
+                                         ("time", _actual_time(before), _actual_time(after), " ms"))
+        for kind, old, new, unit in comparable:
+            if old is None or new is None or old == new:
+                continue
+            if kind == "time" and abs(new - old) < MIN_TIME_CHANGE_MS:
+                continue
+            delta = (new - old) / old if old else float("inf")
+            if abs(delta) >= self.threshold:
+                detail = f"{_describe(after)} {old:.2f}{unit} -> {new:.2f}{unit} ({delta:+.0%})"
+                changes.append(PlanChange(kind, before, after, detail, worse=new > old))
+        if not changes:
+            return
+        self.changes.extend(changes)
+        first = changes[0]
+        if first.kind in STRUCTURAL_CHANGES:
+            status = "changed"
+        else:
+            status = "worse" if first.worse else "better"
+        self.before[before] = status
+        self.after[after] = status
+
+
+def _operator(node):
+    return node.label(), node.table, node.properties.get('strategy')
+
+
+def _same_operator(before, after):
+    return _operator(before) == _operator(after)
+
+
+def _describe(node):
+    description = node.label()
+    if node.properties.get('strategy'):
+        description += f" ({node.properties['strategy']})"
+    return f"{description} on {node.table}" if node.table else description
+
+
+def _actual_time(node):
+    if node.actual_total_time is None or not node.actual_loops:
+        return None
+    return node.actual_total_time * node.actual_loops
+
+
+def _relations(node):
+    return frozenset(descendant.table for descendant, _, _ in pipesyntax.walk_plan(node) if descendant.table)
+
+
+def _match_children(before_children, after_children, before_shape, after_shape):
+    """Pair up children of two differing nodes: equal subtrees first, then the
+    same operator on the same relation, then subtrees reading the same
+    relations, then by position; the rest were added or removed"""
+    pairs = [None] * len(before_children)
+    unmatched = list(range(len(after_children)))
+    for key in (lambda node, shapes: shapes[node], lambda node, shapes: (node.label(), node.table),
+                lambda node, shapes: _relations(node)):
+        by_key = {}
+        for j in unmatched:
+            by_key.setdefault(key(after_children[j], after_shape), deque()).append(j)
+        for i, node in enumerate(before_children):
+            if pairs[i] is None:
+                candidates = by_key.get(key(node, before_shape))
+                if candidates:
+                    pairs[i] = candidates.popleft()
+        taken = set(pairs)
+        unmatched = [j for j in unmatched if j not in taken]
+    for i in range(len(before_children)):
+        if pairs[i] is None and unmatched:
+            pairs[i] = unmatched.pop(0)
+    result = [(before_children[i], after_children[j] if j is not None else None)
+              for i, j in enumerate(pairs)]
+    result.extend((None, after_children[j]) for j in unmatched)
+    return result
@@ -1,52 +1,823 @@
-import psycopg2
+import itertools
+import json
+import pickle
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 import pipesyntax
+import profiling
+from cache import LRUCache
+
+DEFAULT_ITERSIZE = 2000
+
+_cursor_names = itertools.count(1)
+_read_only_start = re.compile(r"^\s*(?:SELECT|VALUES|TABLE|WITH)\b", re.IGNORECASE)
+_write_keywords = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|MERGE|INTO|FOR\s+(?:NO\s+KEY\s+)?UPDATE|FOR\s+(?:KEY\s+)?SHARE)\b",
+    re.IGNORECASE)
+# Functions whose result differs between runs of the same statement
+_volatile_calls = re.compile(
+    r"\b(?:random|setseed|now|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday|"
+    r"current_timestamp|current_time|current_date|localtime|localtimestamp|nextval|currval|lastval|setval|"
+    r"gen_random_uuid|uuid_generate_v\d\w*|txid_current\w*|pg_current_xact_id\w*|pg_sleep\w*|"
+    r"pg_backend_pid|inet_client_\w+|tablesample)\b",
+    re.IGNORECASE)
+# Settings besides those of the Query Tuning categories that change plans
+PLANNER_SETTINGS = ("work_mem", "hash_mem_multiplier", "max_parallel_workers", "effective_io_concurrency")
+# Part of the plan and result caches' keys, so entries a DiskCache kept from before
+# are not read back; bump it whenever fingerprint_sql's output changes
+# (2: fingerprints parse as PostgreSQL and keep unparsable queries as written)
+CACHE_KEY_VERSION = 2
+_explain_executor = None
+_explain_executor_lock = threading.Lock()
+# Imported on first connect, so importing this module stays cheap
+psycopg2 = None
+
+
+def _import_psycopg2():
+    global psycopg2
+    if psycopg2 is None:
+        import psycopg2
+        import psycopg2.extensions
+
+
+def is_read_only(sql):
+    """Conservative check that a statement only reads, so it may run twice at once"""
+    return bool(_read_only_start.match(sql)) and not _write_keywords.search(sql)
+
+
+def is_deterministic(sql):
+    """Conservative check that a statement only reads and calls no volatile functions,
+    so running it again on unchanged tables returns the same rows"""
+    return is_read_only(sql) and not _volatile_calls.search(sql)
+
+
+def _background_executor():
+    global _explain_executor
+    with _explain_executor_lock:
+        if _explain_executor is None:
+            _explain_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="explain")
+        return _explain_executor
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Idle connections beyond minconn are closed after idle_timeout seconds.
+    A connection that sat idle for longer than validate_interval is pinged
+    before it is handed out, and broken connections are replaced by new ones.
+    """
+    def __init__(self, connect, minconn=1, maxconn=8, idle_timeout=300, validate_interval=30):
+        _import_psycopg2()
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.validate_interval = validate_interval
+        self._cond = threading.Condition()
+        # (connection, returned_at) with the most recently returned last
+        self._idle = []
+        self._open = 0
+        self._state = {}
+        self.closed = False
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.reconnects = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._open += 1
+
+    def getconn(self, timeout=None):
+        wait_start = None
+        with self._cond:
+            if self.closed:
+                raise ValueError("Not connected to the database")
+            self.checkouts += 1
+            while True:
+                self._expire_idle()
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._open < self.maxconn:
+                    self._open += 1
+                    conn, returned_at = None, None
+                    break
+                if wait_start is None:
+                    wait_start = time.monotonic()
+                    self.waits += 1
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.monotonic() - wait_start)
+                    if remaining <= 0:
+                        self.wait_time += time.monotonic() - wait_start
+                        raise PoolTimeout(f"No connection available after {timeout} seconds")
+                self._cond.wait(remaining)
+            if wait_start is not None:
+                self.wait_time += time.monotonic() - wait_start
+
+        if conn is not None:
+            if self._is_alive(conn, returned_at):
+                return conn
+            self._close(conn)
+            with self._cond:
+                self.reconnects += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn):
+        discard = conn.closed or self.closed
+        if not discard and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard:
+            self._close(conn)
+        with self._cond:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def state(self, conn):
+        """Per-connection flags that live exactly as long as the connection"""
+        with self._cond:
+            return self._state.setdefault(conn, {})
+
+    def closeall(self):
+        with self._cond:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "reconnects": self.reconnects,
+            }
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        while (self._idle and self._open > self.minconn
+               and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.pop(0)
+            self._open -= 1
+            self._close(conn)
+
+    def _is_alive(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.validate_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close(self, conn):
+        self._state.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class ExplainOptions:
+    """Options of the EXPLAIN statements that fetch plans.
+
+    analyze runs the statement for actual times and rows; buffers, wal and
+    timing only apply to analyzed plans and are left out otherwise.
+    generic_plan (PostgreSQL 16) plans a statement with $1-style parameters
+    left without values, so it cannot be analyzed.
+    """
+    def __init__(self, analyze=True, buffers=False, wal=False, timing=True, settings=False,
+                 generic_plan=False):
+        if analyze and generic_plan:
+            raise ValueError("A generic plan cannot be analyzed")
+        self.analyze = analyze
+        self.buffers = buffers
+        self.wal = wal
+        self.timing = timing
+        self.settings = settings
+        self.generic_plan = generic_plan
+
+    def sql(self, format="JSON"):
+        """The EXPLAIN prefix for these options; it also keys the plan cache"""
+        options = [f"FORMAT {format}", "COSTS TRUE"]
+        if self.analyze:
+            options.append("ANALYZE TRUE")
+            if self.buffers:
+                options.append("BUFFERS TRUE")
+            if self.wal:
+                options.append("WAL TRUE")
+            if not self.timing:
+                options.append("TIMING FALSE")
+        if self.settings:
+            options.append("SETTINGS TRUE")
+        if self.generic_plan:
+            options.append("GENERIC_PLAN TRUE")
+        return f"EXPLAIN ({', '.join(options)}) "
+
+    def estimate(self):
+        """The same options without analyze, for a plan that does not run the statement"""
+        return ExplainOptions(False, self.buffers, self.wal, self.timing, self.settings, self.generic_plan)
+
+    def auto_explain_settings(self):
+        """auto_explain settings that log the plans EXPLAIN with these options would show"""
+        settings = {
+            "auto_explain.log_analyze": self.analyze,
+            "auto_explain.log_buffers": self.analyze and self.buffers,
+            "auto_explain.log_wal": self.analyze and self.wal,
+            "auto_explain.log_timing": self.analyze and self.timing,
+            "auto_explain.log_settings": self.settings,
+        }
+        return {name: "on" if value else "off" for name, value in settings.items()}
+
+    def __repr__(self):
+        return f"ExplainOptions({self.sql()[9:-2]})"
+
+
+class PlanCache:
+    """EXPLAIN output keyed by query fingerprint, database identity, server
+    version, search_path and the settings that change plans.
+
+    Each entry remembers the pg_stat_user_tables counters and the indexes of
+    the relations its plan reads; an entry whose relations were modified,
+    re-analyzed or re-indexed since is dropped instead of returned. With a
+    store (a DiskCache) entries are also written there and outlive the
+    process; they are checked the same way when read back.
+    """
+    namespace = "plans"
+    # Whether values reading a relation without statistics are left out
+    require_statistics = False
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, ttl=600,
+                 normalize_whitespace=True, normalize_case=True, normalize_literals=False, store=None):
+        self.entries = LRUCache(max_entries, max_bytes, ttl)
+        self.store = store
+        self.normalize_whitespace = normalize_whitespace
+        self.normalize_case = normalize_case
+        self.normalize_literals = normalize_literals
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, db, conn, sql, explain):
+        fingerprint = pipesyntax.fingerprint_sql(
+            sql, self.normalize_whitespace, self.normalize_case, self.normalize_literals)
+        state = db.pool.state(conn)
+        if "planner_settings" not in state:
+            # Statements always end in a rollback, so a SET never outlives its query
+            # and these stay valid for the connection's lifetime
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT current_setting('search_path'), current_setting('server_version_num'), "
+                "md5(string_agg(name || '=' || setting, ',' ORDER BY name)) FROM pg_settings "
+                "WHERE category LIKE 'Query Tuning%%' OR name = ANY(%s)", (list(PLANNER_SETTINGS),))
+            state["search_path"], state["server_version"], state["planner_settings"] = cur.fetchone()
+            cur.close()
+            conn.rollback()
+        return (CACHE_KEY_VERSION, fingerprint, explain, db.host, db.port, db.dbname, db.user, state["search_path"],
+                state["server_version"], state["planner_settings"])
+
+    def get(self, conn, key):
+        entry = self.entries.get(key)
+        from_store = entry is None and self.store is not None
+        if from_store:
+            entry = self.store.get(self.namespace, key)
+        if entry is not None and self._signature(conn, entry[1]) != entry[2]:
+            self.entries.pop(key)
+            if self.store is not None:
+                self.store.pop(self.namespace, key)
+            self.invalidations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        if from_store:
+            self.entries.put(key, entry, size=self._size(entry[0]))
+        self.hits += 1
+        return entry[0]
+
+    def put(self, conn, key, value, relations=None):
+        """Cache value, the plan itself unless given the relations it depends on"""
+        if relations is None:
+            relations = pipesyntax.plan_relations(value)
+        relations = sorted(relations)
+        entry = (value, relations, self._signature(conn, relations))
+        if self.require_statistics and len(entry[2]) < len(relations):
+            return
+        self.entries.put(key, entry, size=self._size(value))
+        if self.store is not None:
+            self.store.put(self.namespace, key, entry)
+
+    def clear(self):
+        self.entries.clear()
+        if self.store is not None:
+            self.store.clear(self.namespace)
+
+    def stats(self):
+        stats = self.entries.stats()
+        stats.update(hits=self.hits, misses=self.misses, invalidations=self.invalidations)
+        return stats
+
+    def _size(self, plan):
+        return len(json.dumps(plan))
+
+    def _signature(self, conn, relations):
+        if not relations:
+            return ()
+        cur = conn.cursor()
+        try:
+            # Indexes are part of it, so adding or dropping one invalidates the plans
+            cur.execute(
+                "SELECT relid, n_tup_ins, n_tup_upd, n_tup_del, last_analyze, last_autoanalyze, "
+                "ARRAY(SELECT indexrelid FROM pg_index WHERE indrelid = relid ORDER BY indexrelid) "
+                "FROM pg_stat_user_tables WHERE relname = ANY(%s) ORDER BY relid",
+                (relations,)
+            )
+            return tuple(cur.fetchall())
+        finally:
+            cur.close()
+
+
+class ResultCache(PlanCache):
+    """Rows of small deterministic queries, invalidated like cached plans.
+
+    Only statements is_deterministic accepts, whose plans read nothing but
+    user tables, and results of at most max_rows rows are kept. Sessions
+    report their changes to pg_stat_user_tables up to about ten seconds after
+    committing, so a result may outlive a change to its tables by that long;
+    caching results is therefore opt-in (Database's result_cache).
+    """
+    namespace = "results"
+    # Catalogs and foreign tables could change unnoticed
+    require_statistics = True
+
+    def __init__(self, max_rows=1000, max_entries=128, max_bytes=16 * 1024 * 1024, ttl=None, store=None):
+        super().__init__(max_entries, max_bytes, ttl, store=store)
+        self.max_rows = max_rows
+
+    def cacheable(self, sql, rows, relations):
+        return len(rows) <= self.max_rows and bool(relations) and is_deterministic(sql)
+
+    def _size(self, result):
+        return len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+
+
+class QueryResult:
+    def __init__(self, rows, description, plan_json=None, timings=None, stream=None, plan_cached=False,
+                 result_cached=False):
+        self.rows = rows
+        self.description = description
+        self.plan_json = plan_json
+        self.timings = timings or {}
+        self.plan_cached = plan_cached
+        self.result_cached = result_cached
+        # Set when only the first batch is in rows and the rest is still on the server
+        self.stream = stream
+
+    @property
+    def headers(self):
+        if not self.description:
+            return []
+        return [column[0] for column in self.description]
+
+
+class ResultStream:
+    """Rows of a server-side cursor, fetched in batches of itersize on demand"""
+    def __init__(self, conn, cursor, itersize, on_close=None):
+        self.conn = conn
+        self.cursor = cursor
+        self.itersize = itersize
+        self.on_close = on_close
+        self.description = None
+        self.rows_fetched = 0
+        self.exhausted = False
+
+    @profiling.traced("fetch batch")
+    def fetch(self, count=None):
+        if self.exhausted:
+            return []
+        count = count or self.itersize
+        rows = self.cursor.fetchmany(count)
+        self.description = self.cursor.description
+        self.rows_fetched += len(rows)
+        if len(rows) < count:
+            self.close()
+        return rows
+
+    def close(self):
+        if self.exhausted:
+            return
+        self.exhausted = True
+        if not self.conn.closed:
+            try:
+                self.cursor.close()
+                self.conn.rollback()
+            except psycopg2.Error:
+                pass
+        if self.on_close:
+            self.on_close()
+
 
 class Database:
-    def __init__(self, dbname, user, password, host, port = 5432):
+    def __init__(self, dbname, user, password, host, port = 5432, minconn=1, maxconn=8, pool=None,
+                 plan_cache=None, explain_options=None, result_cache=None):
         self.dbname = dbname
         self.user = user
         self.password = password
         self.host = host
         self.port = port
-        self.conn = None
+        self.minconn = minconn
+        self.maxconn = maxconn
+        # Clones share their parent's pool but only cancel their own connections
+        self.pool = pool
+        self._owns_pool = pool is None
+        self._checked_out = set()
+        self._lock = threading.Lock()
+        self.plan_cache = plan_cache
+        # Optional ResultCache that run_query answers small deterministic queries from
+        self.result_cache = result_cache
+        # What get_plan_json, run_query and stream_query ask EXPLAIN for
+        self.explain_options = explain_options or ExplainOptions()
 
     def connect(self):
-        self.conn = psycopg2.connect(
+        _import_psycopg2()
+        if self.pool is None:
+            self.pool = ConnectionPool(self._new_connection, self.minconn, self.maxconn)
+            self._owns_pool = True
+        if self.plan_cache is None:
+            self.plan_cache = PlanCache()
+
+    def _new_connection(self):
+        return psycopg2.connect(
             dbname=self.dbname,
             user=self.user,
             password=self.password,
             host=self.host,
-            port=self.port   
+            port=self.port,
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3
         )
         
     def disconnect(self):
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        if self.pool and self._owns_pool:
+            self.pool.closeall()
+        self.pool = None
 
-    def execute_query(self, query):
-        if not self.conn:
+    def clone(self):
+        """Return a Database handle that borrows from the same connection pool"""
+        return Database(self.dbname, self.user, self.password, self.host, self.port,
+                        self.minconn, self.maxconn, pool=self.pool, plan_cache=self.plan_cache,
+                        explain_options=self.explain_options, result_cache=self.result_cache)
+
+    def pool_stats(self):
+        return self.pool.stats() if self.pool else {}
+
+    @profiling.traced("pool checkout")
+    def _checkout(self):
+        if not self.pool:
             raise ValueError("Not connected to the database")
-        cur = self.conn.cursor()
-        cur.execute(query)
-        result = cur.fetchall()
-        cur.close()
-        return result
+        conn = self.pool.getconn()
+        with self._lock:
+            self._checked_out.add(conn)
+        return conn
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._checked_out.discard(conn)
+        self.pool.putconn(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def cancel(self):
+        """Ask the server to cancel every query this handle is running; safe from any thread"""
+        with self._lock:
+            connections = list(self._checked_out)
+        for conn in connections:
+            if not conn.closed:
+                try:
+                    conn.cancel()
+                except psycopg2.Error:
+                    pass
+
+    def execute_query(self, query):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query)
+            result = cur.fetchall()
+            cur.close()
+            return result
         
-    def get_plan_json(self, sql):
-        if not self.conn:
-            raise ValueError("Not connected to the database")
-        cur = self.conn.cursor()
-        cur.execute("EXPLAIN (FORMAT JSON, ANALYZE TRUE, COSTS TRUE) " + sql)
-        plan = cur.fetchone()[0]    
-        cur.close()
-        return plan
+    @profiling.traced("explain")
+    def explain(self, sql, options=None, params=None):
+        """EXPLAIN sql and return its JSON plan, from the plan cache while it is valid.
 
-    def get_plan_original(self, sql): 
-        if not self.conn:
-            raise ValueError("Not connected to the database")
-        cur = self.conn.cursor()
-        cur.execute(f"EXPLAIN ANALYZE {sql}")
-        plan = "\n".join(row[0] for row in cur.fetchall())
-        cur.close()
+        options defaults to explain_options. params are bound to %s placeholders
+        in sql; such plans are not cached. An analyzed statement really runs,
+        inside a transaction that is rolled back, so data-modifying statements
+        can be analyzed safely.
+        """
+        options = options or self.explain_options
+        with self.connection() as conn:
+            key, plan = self._cached_plan(conn, sql, options) if params is None else (None, None)
+            if plan is not None:
+                return plan
+            cur = conn.cursor()
+            try:
+                plan = self._explain(cur, sql, options, params)
+            finally:
+                cur.close()
+                conn.rollback()
+            self._cache_plan(conn, key, plan)
+            return plan
+
+    def get_plan_json(self, sql, options=None):
+        return self.explain(sql, options)
+
+    def get_estimated_plan_json(self, sql):
+        """EXPLAIN (FORMAT JSON) without running the query"""
+        return self.explain(sql, self.explain_options.estimate())
+
+    @profiling.traced("EXPLAIN")
+    def _explain(self, cur, sql, options, params=None):
+        # Anything an analyzed statement changed is undone before the transaction goes on
+        if not options.analyze:
+            cur.execute(options.sql() + sql, params)
+            return cur.fetchone()[0]
+        cur.execute("SAVEPOINT explain_analyze")
+        cur.execute(options.sql() + sql, params)
+        plan = cur.fetchone()[0]
+        cur.execute("ROLLBACK TO SAVEPOINT explain_analyze")
         return plan
+
+    @profiling.traced("plan cache lookup")
+    def _cached_plan(self, conn, sql, options):
+        if not self.plan_cache:
+            return None, None
+        key = self.plan_cache.key(self, conn, sql, options.sql())
+        return key, self.plan_cache.get(conn, key)
+
+    @profiling.traced("plan cache store")
+    def _cache_plan(self, conn, key, plan):
+        if self.plan_cache and key is not None and plan is not None:
+            self.plan_cache.put(conn, key, plan)
+
+    @profiling.traced("text plan")
+    def get_plan_original(self, sql, options=None):
+        """The text-format plan, with the same options as explain"""
+        options = options or self.explain_options
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(options.sql("TEXT") + sql)
+                return "\n".join(row[0] for row in cur.fetchall())
+            finally:
+                cur.close()
+                conn.rollback()
+
+    @profiling.traced("run_query")
+    def run_query(self, sql, options=None):
+        """Execute sql once and return its rows, column description and plan.
+
+        The plan is explained with options (default explain_options); without
+        analyze it is the planner's estimate, fetched before the statement runs.
+        A still-valid plan from the plan cache means only the query itself runs.
+        When the server allows auto_explain to report to the client, an analyzed
+        plan is captured from the same execution that produces the rows.
+        Otherwise a separate EXPLAIN ANALYZE is needed; for read-only statements
+        it runs on a second pooled connection at the same time as the execution
+        itself, and for others in a savepoint rolled back before the execution.
+        With a result_cache, a deterministic query whose tables did not change
+        since it last ran is answered from there without running.
+        """
+        options = options or self.explain_options
+        if options.generic_plan:
+            raise ValueError("A generic plan leaves parameters without values, so its query cannot run")
+        timings = {}
+        plan_future = None
+        result_cache = self.result_cache
+        with self.connection() as conn:
+            result_key = None
+            if result_cache is not None and is_deterministic(sql):
+                start = time.perf_counter()
+                with profiling.span("result cache lookup"):
+                    result_key = result_cache.key(self, conn, sql, options.sql())
+                    cached = result_cache.get(conn, result_key)
+                timings["result cache"] = time.perf_counter() - start
+                if cached is not None:
+                    rows, description, plan = cached
+                    return QueryResult(rows, description, plan, timings, plan_cached=True, result_cached=True)
+            start = time.perf_counter()
+            cache_key, plan = self._cached_plan(conn, sql, options)
+            timings["plan cache"] = time.perf_counter() - start
+            plan_cached = plan is not None
+            use_auto_explain = options.analyze and not plan_cached and self._enable_auto_explain(conn)
+            if options.analyze and not plan_cached and not use_auto_explain and is_read_only(sql):
+                plan_future = _background_executor().submit(profiling.bind(self._explain_analyze), sql, options)
+            cur = conn.cursor()
+            try:
+                if use_auto_explain:
+                    del conn.notices[:]
+                    self._set_auto_explain(cur, options)
+                elif not plan_cached and plan_future is None:
+                    start = time.perf_counter()
+                    plan = self._explain(cur, sql, options)
+                    timings["plan"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                with profiling.span("execute"):
+                    cur.execute(sql)
+                timings["execute"] = time.perf_counter() - start
+
+                start = time.perf_counter()
+                with profiling.span("fetch"):
+                    description = cur.description
+                    rows = cur.fetchall() if description else []
+                timings["fetch"] = time.perf_counter() - start
+
+                if use_auto_explain:
+                    plan = self._plan_from_notices(conn)
+                    if plan is None:
+                        # The rows are read, so undo the statement before explaining it
+                        conn.rollback()
+                        start = time.perf_counter()
+                        plan = self._explain(cur, sql, options)
+                        timings["plan"] = time.perf_counter() - start
+                if plan_future is not None:
+                    with profiling.span("wait for concurrent EXPLAIN"):
+                        plan, timings["plan (concurrent)"] = plan_future.result()
+            except BaseException:
+                # The concurrent EXPLAIN hits the same error or cancellation, so just let it finish
+                if plan_future is not None:
+                    wait([plan_future])
+                raise
+            finally:
+                cur.close()
+                # Results are read inside a transaction that is never committed,
+                # so statements behave the same as they did through EXPLAIN ANALYZE.
+                conn.rollback()
+            if not plan_cached:
+                self._cache_plan(conn, cache_key, plan)
+            if result_key is not None and description:
+                relations = pipesyntax.plan_relations(plan)
+                if result_cache.cacheable(sql, rows, relations):
+                    description = [tuple(column) for column in description]
+                    with profiling.span("result cache store"):
+                        result_cache.put(conn, result_key, (rows, description, plan), relations)
+
+        return QueryResult(rows, description, plan, timings, plan_cached=plan_cached)
+
+    @profiling.traced("EXPLAIN ANALYZE (concurrent)")
+    def _explain_analyze(self, sql, options):
+        with self.connection() as conn:
+            cur = conn.cursor()
+            try:
+                start = time.perf_counter()
+                plan = self._explain(cur, sql, options)
+                return plan, time.perf_counter() - start
+            finally:
+                cur.close()
+                conn.rollback()
+
+    def _enable_auto_explain(self, conn):
+        state = self.pool.state(conn)
+        if "auto_explain" in state:
+            return state["auto_explain"]
+        cur = conn.cursor()
+        try:
+            cur.execute("LOAD 'auto_explain'")
+            cur.execute("SET auto_explain.log_min_duration = -1")
+            cur.execute("SET auto_explain.log_format = 'json'")
+            cur.execute("SET auto_explain.log_level = 'notice'")
+            conn.commit()
+            state["auto_explain"] = True
+        except psycopg2.Error:
+            conn.rollback()
+            state["auto_explain"] = False
+        finally:
+            cur.close()
+        return state["auto_explain"]
+
+    def _set_auto_explain(self, cur, options):
+        """Log the plan of the transaction's next statement, as EXPLAIN with options would show it"""
+        settings = options.auto_explain_settings()
+        settings["auto_explain.log_min_duration"] = "0"
+        cur.execute("SELECT " + ", ".join(["set_config(%s, %s, true)"] * len(settings)),
+                    [value for setting in settings.items() for value in setting])
+
+    def _plan_from_notices(self, conn):
+        for notice in reversed(conn.notices):
+            marker = notice.find("plan:")
+            if marker == -1:
+                continue
+            try:
+                plan = json.loads(notice[marker + len("plan:"):])
+            except ValueError:
+                continue
+            return [plan]
+        return None
+
+    @profiling.traced("stream_query")
+    def stream_query(self, sql, itersize=DEFAULT_ITERSIZE, options=None):
+        """Execute sql through a named cursor and return only its first batch.
+
+        The remaining rows stay on the server and are pulled through the
+        returned QueryResult.stream. The plan is the planner's estimate, since
+        an analyzed plan would mean running the query to completion.
+        Statements is_read_only does not accept, which may not be queries a
+        cursor can be declared for, run through run_query instead.
+        """
+        options = options or self.explain_options
+        if not is_read_only(sql):
+            # The server rejects a DECLARE of anything else as a plain syntax error, so
+            # this is decided up front: a failing query must fail, not run a second time
+            return self.run_query(sql, options)
+        estimate = options.estimate()
+        timings = {}
+        with self.connection() as conn:
+            start = time.perf_counter()
+            cache_key, plan = None, None
+            if options.analyze:
+                # An analyzed plan of the same query is even better than the estimate
+                cache_key, plan = self._cached_plan(conn, sql, options)
+            if plan is None:
+                cache_key, plan = self._cached_plan(conn, sql, estimate)
+            plan_cached = plan is not None
+            if not plan_cached:
+                cur = conn.cursor()
+                try:
+                    plan = self._explain(cur, sql, estimate)
+                finally:
+                    cur.close()
+                    conn.rollback()
+                self._cache_plan(conn, cache_key, plan)
+            timings["plan"] = time.perf_counter() - start
+
+        # The stream keeps this connection checked out until its last batch is read
+        conn = self._checkout()
+        cur = conn.cursor(name=f"result_stream_{next(_cursor_names)}")
+        cur.itersize = itersize
+        try:
+            start = time.perf_counter()
+            with profiling.span("execute"):
+                cur.execute(sql)
+            timings["execute"] = time.perf_counter() - start
+        except BaseException:
+            self._checkin(conn)
+            raise
+
+        stream = ResultStream(conn, cur, itersize, on_close=lambda: self._checkin(conn))
+        start = time.perf_counter()
+        try:
+            rows = stream.fetch()
+        except BaseException:
+            stream.close()
+            raise
+        timings["fetch"] = time.perf_counter() - start
+        return QueryResult(rows, stream.description, plan, timings,
+                           stream=None if stream.exhausted else stream, plan_cached=plan_cached)
@@ -0,0 +1,181 @@
+"""Spans that time the phases of a run, for the profiler panel and Chrome trace export.
+
+A Trace collects the spans of one run. Spans are recorded into the trace
+that is active on the current thread (see activate and bind), so work a run
+hands to another thread is still attributed to it. Profiling is off until
+enable() turns it on; until then span() returns one shared do-nothing context
+manager and traced functions cost a single flag check.
+"""
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+_enabled = False
+_local = threading.local()
+
+
+class Span:
+    __slots__ = ('name', 'start', 'end', 'thread', 'depth', 'args')
+
+    def __init__(self, name, start, end, thread, depth, args):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.thread = thread
+        self.depth = depth
+        self.args = args
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Trace:
+    """The spans recorded for one run, from whichever threads did its work"""
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def end(self):
+        with self._lock:
+            return max((span.end for span in self.spans), default=self.start)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def sorted_spans(self):
+        """Spans by start time, enclosing spans before the ones they contain"""
+        with self._lock:
+            return sorted(self.spans, key=lambda span: (span.start, -span.end))
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan:
+    __slots__ = ('trace', 'name', 'args', 'start', 'depth')
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.depth = getattr(_local, 'depth', 0)
+        _local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        _local.depth = self.depth
+        self.trace.add(Span(self.name, self.start, end, threading.current_thread().name, self.depth, self.args))
+        return False
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def current_trace():
+    return getattr(_local, 'trace', None) if _enabled else None
+
+
+def span(name, **args):
+    """Context manager timing a block as a span of the current thread's trace"""
+    if not _enabled:
+        return _NULL_SPAN
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL_SPAN
+    return _ActiveSpan(trace, name, args)
+
+
+def traced(name):
+    """Decorator recording every call of a function as a span called name"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def activate(trace):
+    """Record the spans of this thread into trace (None records nothing) within the block"""
+    previous = getattr(_local, 'trace', None), getattr(_local, 'depth', 0)
+    _local.trace = trace
+    _local.depth = 0
+    try:
+        yield trace
+    finally:
+        _local.trace, _local.depth = previous
+
+
+def bind(function):
+    """function, made to record into the current trace on whichever thread calls it"""
+    trace = current_trace()
+    if trace is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with activate(trace):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def chrome_trace(traces):
+    """Chrome trace event format (chrome://tracing, Perfetto) of traces, one process per trace"""
+    events = []
+    origin = min((trace.start for trace in traces), default=0.0)
+    for pid, trace in enumerate(traces, 1):
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": trace.name}})
+        threads = {}
+        for span in trace.sorted_spans():
+            if span.thread not in threads:
+                threads[span.thread] = len(threads) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": threads[span.thread],
+                               "args": {"name": span.thread}})
+            events.append({
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start - origin) * 1e6,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": threads[span.thread],
+                "args": span.args,
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def export_chrome_trace(traces, path):
+    with open(path, "w") as f:
+        json.dump(chrome_trace(traces), f)
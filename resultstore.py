@@ -0,0 +1,455 @@
+"""Query results kept column by column, with numbers and dates in typed arrays.
+
+Rows arrive as the tuples psycopg2 returns. A ResultStore takes each batch
+apart into its columns: integers, floats, booleans, dates and numerics of one
+scale go into array.array, everything else stays a list of the original
+objects. Once stored, the tuples and the int, float, Decimal and date objects
+in them can be freed, which leaves a large result of numbers and dates a
+fraction of its size as tuples. Values are rebuilt on access and the text of
+the cells being painted is cached.
+
+Sorting and filtering work on the stored columns too: a column sorts on its
+encoded values, and RowFilter compares number and date ranges against them.
+"""
+import copy
+import datetime
+import math
+from array import array
+from decimal import Decimal, InvalidOperation
+
+# Formatted cells kept for painting; the cache is dropped when it grows past this
+DISPLAY_CACHE_CELLS = 20000
+# Filtered rows fewer than this fraction of the result are sorted by themselves
+# rather than picked out of the column's cached sort of every row
+SORT_SUBSET_FRACTION = 0.1
+
+_NoneType = type(None)
+
+
+class _ObjectColumn:
+    """Values of any type, as the original objects"""
+    def __init__(self, values=()):
+        self.values = list(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def extend(self, values, types):
+        self.values.extend(values)
+        return True
+
+    def copy(self):
+        return _ObjectColumn(self.values)
+
+    def argsort(self, rows):
+        values = self.values
+        present = [row for row in rows if values[row] is not None]
+        try:
+            present.sort(key=values.__getitem__)
+        except TypeError:
+            # Mixed types, or ones without an order such as JSON objects, sort by type and then text
+            present.sort(key=lambda row: (type(values[row]).__name__, str(values[row])))
+        present.extend(row for row in rows if values[row] is None)
+        return array('q', present)
+
+
+class _TypedColumn:
+    """Values of one Python type, encoded into an array.array, with a mask of the NULLs"""
+    typecode = None
+    python_type = None
+    # Encoded in place of NULLs, which the mask then hides
+    null = None
+
+    def __init__(self):
+        self.values = array(self.typecode)
+        # One byte per row, allocated at the first NULL
+        self.nulls = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        return self.decode(self.values[index])
+
+    def __iter__(self):
+        for index in range(len(self.values)):
+            yield self[index]
+
+    def extend(self, values, types):
+        """Append values, whose set of types is given; False, leaving the column as it was, if they do not fit"""
+        if types - {_NoneType, self.python_type}:
+            return False
+        has_nulls = _NoneType in types
+        try:
+            encoded = array(self.typecode, self.encode(
+                [self.null if value is None else value for value in values] if has_nulls else values))
+        except (OverflowError, ValueError):
+            return False
+        if has_nulls:
+            if self.nulls is None:
+                self.nulls = bytearray(len(self.values))
+            self.nulls.extend(value is None for value in values)
+        elif self.nulls is not None:
+            self.nulls.extend(bytes(len(encoded)))
+        self.values.extend(encoded)
+        return True
+
+    def encode(self, values):
+        return values
+
+    def decode(self, value):
+        return value
+
+    def copy(self):
+        column = copy.copy(self)
+        column.values = array(self.typecode, self.values)
+        column.nulls = None if self.nulls is None else bytearray(self.nulls)
+        return column
+
+    def argsort(self, rows):
+        # Encoded values sort as the values do
+        values = self.values
+        if self.nulls is None:
+            return array('q', sorted(rows, key=values.__getitem__))
+        nulls = self.nulls
+        present = [row for row in rows if not nulls[row]]
+        present.sort(key=values.__getitem__)
+        present.extend(row for row in rows if nulls[row])
+        return array('q', present)
+
+    def lower_bound(self, text, strict):
+        """The least encoded value above (strict) or at the value written as text; ValueError if it does not parse"""
+        raise ValueError("Column has no range")
+
+    def upper_bound(self, text, strict):
+        raise ValueError("Column has no range")
+
+
+class _IntColumn(_TypedColumn):
+    typecode = 'q'
+    python_type = int
+    null = 0
+    scale = 0
+
+    def lower_bound(self, text, strict):
+        value = self._scaled(text)
+        return math.floor(value) + 1 if strict else math.ceil(value)
+
+    def upper_bound(self, text, strict):
+        value = self._scaled(text)
+        return math.ceil(value) - 1 if strict else math.floor(value)
+
+    def _scaled(self, text):
+        try:
+            value = Decimal(text).scaleb(self.scale)
+        except InvalidOperation:
+            raise ValueError(f"Not a number: {text}")
+        if not value.is_finite():
+            raise ValueError(f"Not a number: {text}")
+        return value
+
+
+class _FloatColumn(_TypedColumn):
+    typecode = 'd'
+    python_type = float
+    null = 0.0
+
+    def lower_bound(self, text, strict):
+        value = float(text)
+        return math.nextafter(value, math.inf) if strict else value
+
+    def upper_bound(self, text, strict):
+        value = float(text)
+        return math.nextafter(value, -math.inf) if strict else value
+
+
+class _BoolColumn(_TypedColumn):
+    typecode = 'b'
+    python_type = bool
+    null = False
+
+    def decode(self, value):
+        return bool(value)
+
+
+class _DateColumn(_TypedColumn):
+    typecode = 'i'
+    python_type = datetime.date
+    null = datetime.date.min
+
+    def encode(self, values):
+        return [value.toordinal() for value in values]
+
+    def decode(self, value):
+        return datetime.date.fromordinal(value)
+
+    def lower_bound(self, text, strict):
+        return datetime.date.fromisoformat(text).toordinal() + strict
+
+    def upper_bound(self, text, strict):
+        return datetime.date.fromisoformat(text).toordinal() - strict
+
+
+class _DecimalColumn(_IntColumn):
+    """Numerics with the same number of decimal places, as integers scaled by that many digits"""
+    python_type = Decimal
+
+    def __init__(self, scale):
+        super().__init__()
+        self.scale = scale
+        self.null = Decimal(0).scaleb(-scale)
+
+    def encode(self, values):
+        # Going through the text keeps exactly the digits and exponent str() shows;
+        # NaN, infinities, exponent notation and -0 do not fit
+        encoded = []
+        for value in values:
+            whole, _, fraction = str(value).partition(".")
+            if len(fraction) != self.scale or "E" in whole or "E" in fraction:
+                raise ValueError("Numeric does not have the column's scale")
+            number = int(whole + fraction)
+            if not number and whole.startswith("-"):
+                raise ValueError("Negative zero")
+            encoded.append(number)
+        return encoded
+
+    def decode(self, value):
+        return Decimal(value).scaleb(-self.scale)
+
+
+_COLUMN_TYPES = {
+    int: _IntColumn,
+    float: _FloatColumn,
+    bool: _BoolColumn,
+    datetime.date: _DateColumn,
+}
+
+
+def _new_column(values, types):
+    """An empty column suited to values, the first non-NULL batch of a column"""
+    types = types - {_NoneType}
+    if len(types) != 1:
+        return _ObjectColumn()
+    python_type = next(iter(types))
+    if python_type is Decimal:
+        first = next(value for value in values if value is not None)
+        _, _, fraction = str(first).partition(".")
+        return _DecimalColumn(len(fraction))
+    column_type = _COLUMN_TYPES.get(python_type)
+    return column_type() if column_type else _ObjectColumn()
+
+
+class ResultStore:
+    """Rows of a query result, stored by column.
+
+    Behaves as a sequence of row tuples, so it can stand in for the list
+    psycopg2 returns; value() and display() read single cells without
+    building the row.
+    """
+    def __init__(self, rows=(), columns=None):
+        self._rows = 0
+        # None for a column that has only had NULLs so far and so has no type yet
+        self._columns = [None] * columns if columns is not None else None
+        self._display = {}
+        # Row numbers of every row in the order of a column, by column
+        self._ranks = {}
+        self.extend(rows)
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(self._rows))]
+        if index < 0:
+            index += self._rows
+        if not 0 <= index < self._rows:
+            raise IndexError("Result row index out of range")
+        return self.row(index)
+
+    def __iter__(self):
+        for index in range(self._rows):
+            yield self.row(index)
+
+    @property
+    def column_count(self):
+        return len(self._columns) if self._columns is not None else 0
+
+    def extend(self, rows):
+        """Append a batch of row tuples"""
+        if not rows:
+            return
+        if self._columns is None:
+            self._columns = [None] * len(rows[0])
+        for index, values in enumerate(zip(*rows)):
+            column = self._columns[index]
+            types = set(map(type, values))
+            if column is None:
+                if types == {_NoneType}:
+                    continue
+                column = _new_column(values, types)
+                if self._rows:
+                    column.extend([None] * self._rows, {_NoneType})
+            if not column.extend(values, types):
+                column = _ObjectColumn(column)
+                column.extend(values, types)
+            self._columns[index] = column
+        self._rows += len(rows)
+        self._ranks.clear()
+
+    def copy(self):
+        """A store with the same rows that can be extended without changing this one"""
+        store = ResultStore()
+        if self._columns is not None:
+            store._columns = [None if values is None else values.copy() for values in self._columns]
+        store._rows = self._rows
+        store._ranks = dict(self._ranks)
+        return store
+
+    def value(self, row, column):
+        values = self._columns[column]
+        return None if values is None else values[row]
+
+    def row(self, row):
+        return tuple(None if values is None else values[row] for values in self._columns)
+
+    def column(self, column):
+        """All values of one column, in row order"""
+        values = self._columns[column]
+        return [None] * self._rows if values is None else list(values)
+
+    def display(self, row, column):
+        """The text of one cell, as str() of its value"""
+        key = row * len(self._columns) + column
+        text = self._display.get(key)
+        if text is None:
+            # Painting only asks for the cells in view, so starting over costs one repaint's formatting
+            if len(self._display) >= DISPLAY_CACHE_CELLS:
+                self._display.clear()
+            text = self._display[key] = str(self.value(row, column))
+        return text
+
+    def argsort(self, column, rows=None):
+        """Row numbers, of every row or of rows, in ascending order of a column with NULLs last.
+
+        The order of every row is cached until rows are added.
+        """
+        if rows is None and column in self._ranks:
+            return self._ranks[column]
+        values = self._columns[column]
+        candidates = range(self._rows) if rows is None else rows
+        ranks = array('q', candidates) if values is None else values.argsort(candidates)
+        if rows is None:
+            self._ranks[column] = ranks
+        return ranks
+
+
+def _parse_range(text):
+    """(low, high) bounds of a range written as a..b, a.., ..b, >a, >=a, <b or <=b, each a (text, strict)
+    pair or None for no bound; None if text is not a range"""
+    for operator, strict in ((">=", False), ("<=", False), (">", True), ("<", True)):
+        if text.startswith(operator):
+            bound = (text[len(operator):].strip(), strict)
+            return (bound, None) if operator[0] == ">" else (None, bound)
+    low, dots, high = text.partition("..")
+    low, high = low.strip(), high.strip()
+    if not dots or not (low or high):
+        return None
+    return (low, False) if low else None, (high, False) if high else None
+
+
+class RowFilter:
+    """Rows whose text in a column, or in any column when column is None, contains text, ignoring case.
+
+    On a number or date column text can also be a range (10..20, 10.., ..20,
+    >5, >=5, <5, <=5, or dates such as >=1995-01-01), which is compared with
+    the stored values rather than their text.
+    """
+    def __init__(self, text, column=None):
+        self.text = text.strip()
+        self.column = column
+        self.needle = self.text.lower()
+        self._range = _parse_range(self.text)
+
+    def __eq__(self, other):
+        return isinstance(other, RowFilter) and (self.text, self.column) == (other.text, other.column)
+
+    def __hash__(self):
+        return hash((self.text, self.column))
+
+    def narrows(self, previous, store):
+        """Whether every row of store this filter keeps is also kept by previous, so only those need checking"""
+        if self.column != previous.column:
+            return False
+        bounds, previous_bounds = self._bounds(store), previous._bounds(store)
+        if bounds is None and previous_bounds is None:
+            return previous.needle in self.needle
+        if bounds is None or previous_bounds is None:
+            return False
+        return bounds[0] >= previous_bounds[0] and bounds[1] <= previous_bounds[1]
+
+    def apply(self, store, rows):
+        """The row numbers of rows, in order, that this filter keeps"""
+        bounds = self._bounds(store)
+        if bounds is not None:
+            low, high = bounds
+            column = store._columns[self.column]
+            values, nulls = column.values, column.nulls
+            if nulls is None:
+                return [row for row in rows if low <= values[row] <= high]
+            return [row for row in rows if low <= values[row] <= high and not nulls[row]]
+        columns = store._columns if self.column is None else [store._columns[self.column]]
+        if len(columns) == 1:
+            return _text_matches(columns[0], rows, self.needle)
+        matched = set()
+        for column in columns:
+            matched.update(_text_matches(column, rows, self.needle))
+        return sorted(matched)
+
+    def _bounds(self, store):
+        """Inclusive bounds on the stored values of the column, or None when matching text"""
+        if self._range is None or self.column is None:
+            return None
+        column = store._columns[self.column]
+        if not isinstance(column, _TypedColumn):
+            return None
+        low, high = self._range
+        try:
+            return (-math.inf if low is None else column.lower_bound(*low),
+                    math.inf if high is None else column.upper_bound(*high))
+        except ValueError:
+            return None
+
+
+def _text_matches(column, rows, needle):
+    if column is None:
+        return list(rows) if needle in "none" else []
+    if isinstance(column, _ObjectColumn):
+        values = column.values
+        return [row for row in rows if needle in str(values[row]).lower()]
+    return [row for row in rows if needle in str(column[row]).lower()]
+
+
+def view_order(store, matches=None, column=None, descending=False):
+    """Row numbers of store to show, in order: matches (None for every row) sorted by column,
+    with NULLs last, or first when descending as in PostgreSQL; None for every row as stored"""
+    if column is None:
+        return None if matches is None else array('q', matches)
+    if matches is None:
+        order = store.argsort(column)
+    elif len(matches) < len(store) * SORT_SUBSET_FRACTION:
+        order = store.argsort(column, matches)
+    else:
+        keep = bytearray(len(store))
+        for row in matches:
+            keep[row] = 1
+        order = array('q', [row for row in store.argsort(column) if keep[row]])
+    return order[::-1] if descending else order
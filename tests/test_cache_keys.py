@@ -0,0 +1,29 @@
+"""Keys of the plan and result caches"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import PlanCache, ResultCache
+
+
+def fake_db():
+    # The connection's planner state is already known, so key() asks the server nothing
+    state = {"planner_settings": "md5", "search_path": "public", "server_version": "160000"}
+    return SimpleNamespace(pool=SimpleNamespace(state=lambda conn: state), host="localhost", port=5432,
+                           dbname="postgres", user="postgres")
+
+
+def test_dollar_quoted_literals_get_different_keys():
+    db = fake_db()
+    for cache in (PlanCache(), ResultCache()):
+        first = cache.key(db, None, "SELECT * FROM t WHERE c = $$x;y$$", "")
+        second = cache.key(db, None, "SELECT * FROM t WHERE c = $$x;z$$", "")
+        assert first != second
+
+
+def test_same_query_written_differently_gets_one_key():
+    db = fake_db()
+    cache = ResultCache()
+    assert cache.key(db, None, "select * from t", "") == cache.key(db, None, "SELECT *\n FROM t;", "")
@@ -0,0 +1,26 @@
+"""Query fingerprints, which key the plan and result caches"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipesyntax import fingerprint_sql, normalize_sql
+
+
+def test_same_query_written_differently_compares_equal():
+    assert fingerprint_sql("select *\n  from t where c = 1;") == fingerprint_sql("SELECT * FROM t WHERE c = 1")
+
+
+def test_dollar_quoted_literals_are_parsed_as_postgresql():
+    assert fingerprint_sql("SELECT * FROM t WHERE c = $$x;y$$") != fingerprint_sql("SELECT * FROM t WHERE c = $$x;z$$")
+    assert normalize_sql("select * from t where c = $$x;y$$") == "SELECT * FROM t WHERE c = 'x;y'"
+
+
+def test_unparsable_query_is_kept_as_written():
+    # sqlglot cannot tokenize backslash escapes in E'' strings
+    assert normalize_sql("  SELECT E'a\\'b'  ") == "SELECT E'a\\'b'"
+    assert fingerprint_sql("SELECT E'a  \\'b'") != fingerprint_sql("SELECT E'a \\'b'")
+
+
+def test_scripts_are_not_reduced_to_their_first_statement():
+    assert fingerprint_sql("select 1; select 2") != fingerprint_sql("select 1; select 3")
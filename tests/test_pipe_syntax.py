@@ -0,0 +1,49 @@
+"""sql_to_pipe output on the example queries, against the output recorded before QEPIndex"""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pipesyntax
+from pipesyntax import parse_qep_json, sql_to_pipe
+
+# queryN.pipe and queryN.plan.pipe hold the baseline's output without and with the plan
+FIXTURE_DIR = os.path.join(ROOT, "tests", "fixtures")
+QUERIES = [f"query{i}" for i in range(1, 6)]
+
+
+def read(*path):
+    with open(os.path.join(*path)) as f:
+        return f.read()
+
+
+def estimated(plan):
+    """The plan without the actuals of EXPLAIN ANALYZE, which the baseline did not show"""
+    if isinstance(plan, dict):
+        return {key: estimated(value) for key, value in plan.items() if not key.startswith("Actual ")}
+    if isinstance(plan, list):
+        return [estimated(value) for value in plan]
+    return plan
+
+
+@pytest.fixture(autouse=True)
+def no_memo(monkeypatch):
+    monkeypatch.setattr(pipesyntax, "_pipe_cache", pipesyntax.LRUCache(max_entries=512))
+    monkeypatch.setattr(pipesyntax, "_pipe_store", None)
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_without_plan_matches_baseline(name):
+    query = read(ROOT, "example", f"{name}.txt")
+    assert sql_to_pipe(query) + "\n" == read(FIXTURE_DIR, f"{name}.pipe")
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_with_plan_matches_baseline(name):
+    query = read(ROOT, "example", f"{name}.txt")
+    plan = estimated(json.loads(read(ROOT, "fixtures", f"{name}.json")))
+    assert sql_to_pipe(query, parse_qep_json(plan)) + "\n" == read(FIXTURE_DIR, f"{name}.plan.pipe")
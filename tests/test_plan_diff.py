@@ -0,0 +1,116 @@
+"""PlanDiff between a fixture plan and edited copies of it"""
+import copy
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pipesyntax import parse_qep_json, walk_plan
+from planhistory import PlanDiff, _match_children, plan_hashes
+
+
+def fixture_plan():
+    """Sort > Aggregate > Hash Join > (Hash Join > (Seq Scan lineitem, Hash > Seq Scan orders),
+    Hash > Seq Scan customer)"""
+    with open(os.path.join(ROOT, "fixtures", "query4.json")) as f:
+        return json.load(f)
+
+
+def joins(plan):
+    outer_join = plan[0]["Plan"]["Plans"][0]["Plans"][0]
+    return outer_join, outer_join["Plans"][0]
+
+
+def tables(root):
+    return {node.table for node, _, _ in walk_plan(root) if node.table}
+
+
+def test_identical_plans_have_equal_hashes_and_no_changes():
+    before, after = parse_qep_json(fixture_plan()), parse_qep_json(fixture_plan())
+    before_shape, before_values = plan_hashes(before)
+    after_shape, after_values = plan_hashes(after)
+    assert before_shape[before] == after_shape[after]
+    assert before_values[before] == after_values[after]
+    assert PlanDiff(before, after).identical
+
+
+def test_cost_change_keeps_the_shape_hash():
+    plan = fixture_plan()
+    joins(plan)[1]["Total Cost"] *= 2
+    before, after = parse_qep_json(fixture_plan()), parse_qep_json(plan)
+    assert plan_hashes(before)[0][before] == plan_hashes(after)[0][after]
+    assert plan_hashes(before)[1][before] != plan_hashes(after)[1][after]
+    diff = PlanDiff(before, after)
+    assert [(change.kind, change.worse) for change in diff.changes] == [("cost", True)]
+
+
+def test_changed_join_method_and_inserted_wrapper():
+    plan = fixture_plan()
+    outer_join, inner_join = joins(plan)
+    inner_join["Node Type"] = "Merge Join"
+    hash_customer = outer_join["Plans"][1]
+    outer_join["Plans"][1] = {"Node Type": "Materialize", "Parent Relationship": "Inner",
+                              "Startup Cost": 17.0, "Total Cost": 17.5, "Plan Rows": 1000,
+                              "Plan Width": 4, "Plans": [hash_customer]}
+    before, after = parse_qep_json(fixture_plan()), parse_qep_json(plan)
+    diff = PlanDiff(before, after)
+
+    assert [change.kind for change in diff.changes] == ["join method", "added"]
+    join_change, wrapper = diff.changes
+    assert join_change.before.properties["method"] == "HASH"
+    assert join_change.after.properties["method"] == "MERGE"
+    assert wrapper.before is None and wrapper.after.operation == "Materialize"
+    assert "Materialize above" in wrapper.detail
+
+    # The subtrees below both changes are identical and not highlighted
+    assert set(diff.before.values()) == {"changed"}
+    assert sorted(diff.after.values()) == ["added", "changed"]
+    for node in join_change.before.children + wrapper.after.children:
+        assert node not in diff.before and node not in diff.after
+
+
+def test_removed_wrapper_is_reported_as_removed():
+    plan = fixture_plan()
+    outer_join, _ = joins(plan)
+    outer_join["Plans"][1] = {"Node Type": "Materialize", "Startup Cost": 17.0, "Total Cost": 17.5,
+                              "Plan Rows": 1000, "Plan Width": 4, "Plans": [outer_join["Plans"][1]]}
+    diff = PlanDiff(parse_qep_json(plan), parse_qep_json(fixture_plan()))
+    assert [change.kind for change in diff.changes] == ["removed"]
+    assert diff.changes[0].before.operation == "Materialize"
+
+
+def test_match_children_pairs_identical_subtrees_then_relations():
+    before = parse_qep_json(fixture_plan())
+    plan = fixture_plan()
+    outer_join, inner_join = joins(plan)
+    inner_join["Node Type"] = "Merge Join"
+    # Swapped sides: the identical Hash of customer must still pair with its twin
+    outer_join["Plans"].reverse()
+    after = parse_qep_json(plan)
+    before_shape, _ = plan_hashes(before)
+    after_shape, _ = plan_hashes(after)
+    before_join = before.children[0].children[0]
+    after_join = after.children[0].children[0]
+
+    pairs = _match_children(before_join.children, after_join.children, before_shape, after_shape)
+    assert [(tables(old), tables(new)) for old, new in pairs] == [
+        ({"lineitem", "orders"}, {"lineitem", "orders"}),
+        ({"customer"}, {"customer"}),
+    ]
+    assert before_shape[pairs[1][0]] == after_shape[pairs[1][1]]
+
+
+def test_match_children_reports_unmatched_children():
+    before = parse_qep_json(fixture_plan())
+    before_join = before.children[0].children[0]
+    after_children = [copy.deepcopy(before_join.children[1])]
+    before_shape, _ = plan_hashes(before)
+    after_shape = {}
+    for node in after_children:
+        after_shape.update(plan_hashes(node)[0])
+
+    pairs = _match_children(before_join.children, after_children, before_shape, after_shape)
+    assert pairs[0] == (before_join.children[0], None)
+    assert pairs[1] == (before_join.children[1], after_children[0])
@@ -0,0 +1,144 @@
+"""ResultStore gives back exactly the values it was given, and RowFilter ranges"""
+import datetime
+import math
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resultstore import (ResultStore, RowFilter, _DateColumn, _DecimalColumn, _FloatColumn, _IntColumn,
+                         _ObjectColumn, _parse_range)
+
+
+def stored(*batches):
+    store = ResultStore()
+    for batch in batches:
+        store.extend([(value,) for value in batch])
+    return store
+
+
+def assert_same(values, store):
+    """Equal values of the same type, which also tells Decimal('1.50') from Decimal('1.5')"""
+    back = store.column(0)
+    assert [(type(value), str(value)) for value in back] == [(type(value), str(value)) for value in values]
+
+
+def column_type(store):
+    return type(store._columns[0])
+
+
+@pytest.mark.parametrize("values, kind", [
+    ([1, None, -2, 2 ** 63 - 1], _IntColumn),
+    ([Decimal("1.50"), None, Decimal("-0.25"), Decimal("100.00")], _DecimalColumn),
+    ([datetime.date(1995, 1, 1), None, datetime.date.min, datetime.date.max], _DateColumn),
+    ([0.5, None, float("inf"), -1e300], _FloatColumn),
+])
+def test_typed_columns_round_trip(values, kind):
+    store = stored(values)
+    assert column_type(store) is kind
+    assert_same(values, store)
+    assert store[1] == (None,)
+
+
+@pytest.mark.parametrize("batches", [
+    # Mixed scales in one batch, and a later batch with another scale
+    [[Decimal("1.5"), Decimal("1.50")]],
+    [[Decimal("1.50"), Decimal("2.00")], [Decimal("2.5")]],
+    # Values str() shows without a plain fraction of the column's scale
+    [[Decimal("1.00"), Decimal("-0.00")]],
+    [[Decimal("1"), Decimal("NaN")]],
+    [[Decimal("1"), Decimal("1E+3")]],
+    [[Decimal("1.0"), Decimal("Infinity")]],
+    # Integers beyond 64 bits, and later batches of another type
+    [[1, 2 ** 64]],
+    [[1, 2], [True]],
+    [[datetime.date(2000, 1, 1)], [datetime.datetime(2000, 1, 1, 12)]],
+    [[0.5], [1]],
+])
+def test_values_that_do_not_fit_fall_back_to_objects(batches):
+    store = stored(*batches)
+    assert column_type(store) is _ObjectColumn
+    assert_same([value for batch in batches for value in batch], store)
+
+
+def test_float_nan_and_negative_zero_round_trip():
+    store = stored([float("nan"), -0.0, 0.0])
+    assert column_type(store) is _FloatColumn
+    nan, negative_zero, zero = store.column(0)
+    assert math.isnan(nan)
+    assert negative_zero == 0.0 and math.copysign(1, negative_zero) == -1
+    assert math.copysign(1, zero) == 1
+
+
+def test_nulls_before_the_first_value_and_across_batches():
+    store = stored([None, None], [3, None], [None, 4])
+    assert column_type(store) is _IntColumn
+    assert store.column(0) == [None, None, 3, None, None, 4]
+    # NULLs sort last
+    assert list(store.argsort(0)) == [2, 5, 0, 1, 3, 4]
+
+
+def test_copy_is_extended_independently():
+    store = stored([Decimal("1.10")])
+    copy = store.copy()
+    copy.extend([(Decimal("2.5"),)])
+    assert len(store) == 1 and column_type(store) is _DecimalColumn
+    assert_same([Decimal("1.10"), Decimal("2.5")], copy)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("10..20", (("10", False), ("20", False))),
+    ("10..", (("10", False), None)),
+    ("..20", (None, ("20", False))),
+    (">5", (("5", True), None)),
+    (">= 5", (("5", False), None)),
+    ("<5", (None, ("5", True))),
+    ("<=1995-01-01", (None, ("1995-01-01", False))),
+    ("..", None),
+    ("abc", None),
+])
+def test_parse_range(text, expected):
+    assert _parse_range(text) == expected
+
+
+def filtered(store, text, column=0):
+    return [store.value(row, column) for row in RowFilter(text, column).apply(store, range(len(store)))]
+
+
+def test_ranges_compare_stored_values():
+    ints = stored([5, None, 10, 15, 20, 25])
+    assert filtered(ints, "10..20") == [10, 15, 20]
+    assert filtered(ints, ">10") == [15, 20, 25]
+    assert filtered(ints, "<=10") == [5, 10]
+    assert filtered(ints, "<10.5") == [5, 10]
+
+    prices = stored([Decimal("1.00"), Decimal("1.01"), Decimal("1.02")])
+    assert filtered(prices, ">1.005") == [Decimal("1.01"), Decimal("1.02")]
+    assert filtered(prices, "<=1.01") == [Decimal("1.00"), Decimal("1.01")]
+
+    dates = stored([datetime.date(1994, 12, 31), datetime.date(1995, 1, 1), None])
+    assert filtered(dates, ">=1995-01-01") == [datetime.date(1995, 1, 1)]
+
+    floats = stored([0.1, 0.2, 0.3])
+    assert filtered(floats, ">0.2") == [0.3]
+
+
+def test_text_that_is_not_a_range_of_the_column_matches_as_text():
+    store = ResultStore([(10, "a..b"), (20, "10..20")], 2)
+    # Not numbers, so matched as text in the int column, which has none
+    assert filtered(store, "a..b") == []
+    assert filtered(store, "a..b", 1) == ["a..b"]
+    # A range on a text column is text too
+    assert filtered(store, "10..20", 1) == ["10..20"]
+    assert RowFilter(">5").apply(store, range(2)) == []
+
+
+def test_narrowing_ranges():
+    store = stored([1, 2, 3])
+    assert RowFilter("2..3", 0).narrows(RowFilter("1..3", 0), store)
+    assert not RowFilter("1..3", 0).narrows(RowFilter("2..3", 0), store)
+    assert RowFilter("ab", 0).narrows(RowFilter("a", 0), store)
+    assert not RowFilter("2..3", 0).narrows(RowFilter("2", 0), store)
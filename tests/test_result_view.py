@@ -0,0 +1,102 @@
+"""Re-sorting and re-filtering a streamed result while its rows are still being fetched"""
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import QApplication
+
+import interface
+from interface import ResultTableModel
+
+ROWS = 1000
+BATCH = 100
+
+
+class FakeStream:
+    """A ResultStream over ROWS rows that can be held after a given batch or fail on one"""
+
+    def __init__(self, shown, hold_after=None, fail_at=None):
+        self.next = shown
+        self.exhausted = False
+        self.hold_after = hold_after
+        self.fail_at = fail_at
+        self.batches = 0
+        self.held = threading.Event()
+        self.resume = threading.Event()
+
+    def fetch(self, count=BATCH):
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise RuntimeError("connection lost")
+        rows = [(i, f"row {i}") for i in range(self.next, min(self.next + count, ROWS))]
+        self.next += len(rows)
+        self.exhausted = self.next >= ROWS
+        if self.batches == self.hold_after:
+            self.held.set()
+            self.resume.wait(5)
+        return rows
+
+    def close(self):
+        self.exhausted = True
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(interface, "VIEW_FETCH_ROWS", BATCH)
+    return QApplication.instance() or QApplication([])
+
+
+def streamed_model(stream):
+    model = ResultTableModel()
+    model.setData([(i, f"row {i}") for i in range(stream.next)], ["id", "name"], stream)
+    return model
+
+
+def wait_for_view(app, model):
+    deadline = time.monotonic() + 10
+    while model._view_pending:
+        assert time.monotonic() < deadline, "view worker did not finish"
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()
+
+
+def test_resort_while_fetching_keeps_every_row(app):
+    stream = FakeStream(BATCH, hold_after=2)
+    model = streamed_model(stream)
+    model.sort(0)
+    assert stream.held.wait(5)
+    # The first worker is replaced with rows of the stream it fetched still in hand
+    model.sort(0, Qt.DescendingOrder)
+    stream.resume.set()
+    wait_for_view(app, model)
+    assert model.rowCount() == ROWS
+    assert model.data(model.index(0, 0), Qt.DisplayRole) == str(ROWS - 1)
+
+
+def test_refilter_while_fetching_keeps_every_row(app):
+    stream = FakeStream(BATCH, hold_after=3)
+    model = streamed_model(stream)
+    model.set_filter("row 1")
+    assert stream.held.wait(5)
+    model.set_filter("row")
+    stream.resume.set()
+    wait_for_view(app, model)
+    assert model.rowCount() == ROWS
+
+
+def test_failed_fetch_keeps_the_rows_fetched_before_it(app):
+    stream = FakeStream(BATCH, fail_at=4)
+    model = streamed_model(stream)
+    model.sort(0)
+    wait_for_view(app, model)
+    assert model.rowCount() == BATCH
+    model.sort(0, Qt.DescendingOrder)
+    wait_for_view(app, model)
+    assert model.rowCount() == ROWS
@@ -0,0 +1,46 @@
+"""Text-format plans parse into the same tree as the JSON format of the same query"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipesyntax import parse_qep, parse_qep_json
+
+# EXPLAIN (ANALYZE, BUFFERS) output, as text and as JSON, of the same run of a query
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load(name):
+    with open(os.path.join(FIXTURE_DIR, f"{name}.txt")) as f:
+        text_root = parse_qep(f.read())
+    with open(os.path.join(FIXTURE_DIR, f"{name}.json")) as f:
+        json_root = parse_qep_json(json.load(f))
+    return text_root, json_root
+
+
+def parents(root):
+    """(preorder number of the parent, actual rows, loops, table) of each node, in preorder"""
+    nodes = []
+    stack = [(root, None)]
+    while stack:
+        node, parent = stack.pop()
+        nodes.append((parent, node.actual_rows, node.actual_loops, node.table))
+        number = len(nodes) - 1
+        stack.extend((child, number) for child in reversed(node.children))
+    return nodes
+
+
+@pytest.mark.parametrize("name", ["subplan", "initplan", "gather"])
+def test_text_plan_nodes_have_the_json_plans_parents(name):
+    text_root, json_root = load(name)
+    assert parents(text_root) == parents(json_root)
+
+
+def test_subplan_belongs_to_the_node_above_its_label():
+    root, _ = load("subplan")
+    scan, subplan = root.children
+    assert scan.table == "orders" and scan.children == []
+    assert [child.table for child in subplan.children] == ["lineitem"]
@@ -0,0 +1,161 @@
+import profiling
+from cache import LRUCache
+
+
+class TreeLayout:
+    """Tidy, non-overlapping layout of a plan tree (Walker's algorithm in the
+    linear-time form given by Buchheim, Jünger and Leipert).
+
+    Parents are centred over their children and subtrees are packed as close
+    as their contours allow. Nodes in a collapsed set are laid out as leaves,
+    so relayout after collapsing or expanding only costs the visible nodes.
+    Positions are cached per collapsed set, so showing a plan again is free.
+    Both walks use explicit stacks and work for plans of any depth.
+    """
+    def __init__(self, root, node_spacing=200, level_spacing=150, max_cached=16):
+        self.root = root
+        self.node_spacing = node_spacing
+        self.level_spacing = level_spacing
+        self._cache = LRUCache(max_entries=max_cached)
+
+    @profiling.traced("layout")
+    def positions(self, collapsed=frozenset()):
+        """{node: (x, y)} for every visible node, with the root at (0, 0)"""
+        if self.root is None:
+            return {}
+        key = frozenset(collapsed)
+        positions = self._cache.get(key)
+        if positions is None:
+            positions = self._compute(key)
+            self._cache.put(key, positions)
+        return positions
+
+    def _compute(self, collapsed):
+        # Visible nodes in pre-order, as indices into flat arrays
+        nodes = []
+        parent = []
+        children = []
+        number = []
+        depth = []
+        stack = [(self.root, -1, 0, 0)]
+        while stack:
+            node, parent_index, sibling_number, level = stack.pop()
+            index = len(nodes)
+            nodes.append(node)
+            parent.append(parent_index)
+            children.append([])
+            number.append(sibling_number)
+            depth.append(level)
+            if parent_index >= 0:
+                children[parent_index].append(index)
+            if node not in collapsed:
+                for i in range(len(node.children) - 1, -1, -1):
+                    stack.append((node.children[i], index, i, level + 1))
+
+        count = len(nodes)
+        prelim = [0.0] * count
+        mod = [0.0] * count
+        shift = [0.0] * count
+        change = [0.0] * count
+        thread = [-1] * count
+        ancestor = list(range(count))
+        default_ancestor = [-1] * count
+
+        def left_sibling(v):
+            return children[parent[v]][number[v] - 1] if parent[v] >= 0 and number[v] > 0 else -1
+
+        def next_left(v):
+            return children[v][0] if children[v] else thread[v]
+
+        def next_right(v):
+            return children[v][-1] if children[v] else thread[v]
+
+        def move_subtree(wl, wr, amount):
+            subtrees = number[wr] - number[wl]
+            change[wr] -= amount / subtrees
+            shift[wr] += amount
+            change[wl] += amount / subtrees
+            prelim[wr] += amount
+            mod[wr] += amount
+
+        def apportion(v, default):
+            w = left_sibling(v)
+            if w < 0:
+                return default
+            v_inner_right = v_outer_right = v
+            v_inner_left = w
+            v_outer_left = children[parent[v]][0]
+            s_inner_right = s_outer_right = mod[v]
+            s_inner_left = mod[v_inner_left]
+            s_outer_left = mod[v_outer_left]
+            while next_right(v_inner_left) >= 0 and next_left(v_inner_right) >= 0:
+                v_inner_left = next_right(v_inner_left)
+                v_inner_right = next_left(v_inner_right)
+                v_outer_left = next_left(v_outer_left)
+                v_outer_right = next_right(v_outer_right)
+                ancestor[v_outer_right] = v
+                amount = (prelim[v_inner_left] + s_inner_left) - (prelim[v_inner_right] + s_inner_right) + 1
+                if amount > 0:
+                    greatest = ancestor[v_inner_left]
+                    if parent[greatest] != parent[v]:
+                        greatest = default
+                    move_subtree(greatest, v, amount)
+                    s_inner_right += amount
+                    s_outer_right += amount
+                s_inner_left += mod[v_inner_left]
+                s_inner_right += mod[v_inner_right]
+                s_outer_left += mod[v_outer_left]
+                s_outer_right += mod[v_outer_right]
+            if next_right(v_inner_left) >= 0 and next_right(v_outer_right) < 0:
+                thread[v_outer_right] = next_right(v_inner_left)
+                mod[v_outer_right] += s_inner_left - s_outer_right
+            if next_left(v_inner_right) >= 0 and next_left(v_outer_left) < 0:
+                thread[v_outer_left] = next_left(v_inner_right)
+                mod[v_outer_left] += s_inner_right - s_outer_left
+                default = v
+            return default
+
+        # First walk, in post-order with siblings left to right, so each subtree is
+        # apportioned against its already placed left siblings
+        finished = [False] * count
+        stack = [0]
+        while stack:
+            v = stack[-1]
+            if not finished[v] and children[v]:
+                finished[v] = True
+                default_ancestor[v] = children[v][0]
+                stack.extend(reversed(children[v]))
+                continue
+            stack.pop()
+            if children[v]:
+                s = c = 0.0
+                for w in reversed(children[v]):
+                    prelim[w] += s
+                    mod[w] += s
+                    c += change[w]
+                    s += shift[w] + c
+                midpoint = (prelim[children[v][0]] + prelim[children[v][-1]]) / 2
+                w = left_sibling(v)
+                if w >= 0:
+                    prelim[v] = prelim[w] + 1
+                    mod[v] = prelim[v] - midpoint
+                else:
+                    prelim[v] = midpoint
+            else:
+                w = left_sibling(v)
+                prelim[v] = prelim[w] + 1 if w >= 0 else 0.0
+            if parent[v] >= 0:
+                default_ancestor[parent[v]] = apportion(v, default_ancestor[parent[v]])
+
+        # Second walk, in pre-order: absolute x is prelim plus the ancestors' mods
+        positions = {}
+        origin = prelim[0]
+        stack = [(0, 0.0)]
+        while stack:
+            v, mod_sum = stack.pop()
+            positions[nodes[v]] = ((prelim[v] + mod_sum - origin) * self.node_spacing,
+                                   depth[v] * self.level_spacing)
+            for w in children[v]:
+                stack.append((w, mod_sum + mod[v]))
+        return positions
+